@@ -0,0 +1,125 @@
+import argparse
+import json
+import sys
+import time
+
+from kubernetes import client, watch
+
+from src.cache import JOB_STORE, Informer, get_labels, get_resource_version, trim_job
+from src.controller import LocustSpec
+from src.objects import get_job_body, get_job_owner
+from src.status import get_job_status
+from src.views import View, orjson
+
+
+def get_fields(value):
+    # fieldsV1 of the managedFields, the same shape as the object
+    if isinstance(value, dict):
+        return {f"f:{key}": get_fields(item) for key, item in value.items()}
+    return {}
+
+
+def get_job(index: int) -> dict:
+    # A master Job as returned by the API server, with its managedFields
+    spec = LocustSpec.from_dict(
+        {"workers": 10, "runTime": "10m", "image": "locustio/locust:2.15.1"}
+    )
+    job = client.ApiClient().sanitize_for_serialization(
+        get_job_body(f"locust-{index}", f"job-locust-{index}", spec)
+    )
+    job["metadata"].update(
+        namespace="locust",
+        uid=f"00000000-0000-0000-0000-{index:012d}",
+        resourceVersion=str(1000 + index),
+        creationTimestamp="2026-10-17T12:00:00Z",
+        managedFields=[
+            {
+                "manager": "locust-operator",
+                "operation": "Update",
+                "apiVersion": "batch/v1",
+                "time": "2026-10-17T12:00:00Z",
+                "fieldsType": "FieldsV1",
+                "fieldsV1": get_fields(job["spec"]),
+            }
+        ],
+    )
+    job["status"] = {
+        "active": 1,
+        "startTime": "2026-10-17T12:00:01Z",
+        "ready": 1,
+        "uncountedTerminatedPods": {},
+    }
+    return job
+
+
+def read(job):
+    # What the Job store and handlers read of every event
+    job = trim_job(job)
+    get_labels(job)
+    get_resource_version(job)
+    get_job_status(job)
+    get_job_owner(job)
+
+
+def run_models(lines: list):
+    stream = watch.Watch()
+    for line in lines:
+        read(stream.unmarshal_event(line, "V1Job")["object"])
+
+
+def run_views(lines: list):
+    informer = Informer(JOB_STORE, None)
+    informer.decode = View
+    for line in lines:
+        read(informer.decode_event(line)["object"])
+
+
+def measure(func, lines: list, repeat: int) -> float:
+    # CPU seconds per event, best of repeat
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        func(lines)
+        seconds = (time.process_time() - started) / len(lines)
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="CPU time of the watch events decoded into the client models or views"
+    )
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=200,
+        help="watch events per second to convert into CPU millicores",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    lines = [
+        json.dumps({"type": "MODIFIED", "object": get_job(index)})
+        for index in range(args.events)
+    ]
+    result = {
+        "events": args.events,
+        "event_bytes": sum(map(len, lines)) // len(lines),
+        "orjson": orjson is not None,
+    }
+    for name, func in [("models", run_models), ("views", run_views)]:
+        seconds = measure(func, lines, args.repeat)
+        result[name] = {
+            "us_per_event": round(seconds * 1e6, 1),
+            "events_per_cpu_second": round(1 / seconds),
+            "millicores_at_rate": round(seconds * args.rate * 1000, 1),
+        }
+    result["speedup"] = round(
+        result["models"]["us_per_event"] / result["views"]["us_per_event"], 1
+    )
+    json.dump(result, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,383 @@
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PATH = re.compile(
+    r"^/(?:api/(?P<core>v1)|apis/(?P<group>[^/]+)/(?P<version>[^/]+))"
+    r"(?:/namespaces/(?P<namespace>[^/]+))?/(?P<plural>[^/]+)"
+    r"(?:/(?P<name>[^/]+)(?:/(?P<subresource>[^/]+))?)?$"
+)
+DISCOVERY = re.compile(r"^/apis/(?P<group>[^/]+)/(?P<version>[^/]+)/?$")
+KINDS = {
+    "locusts": "Locust",
+    "jobs": "Job",
+    "cronjobs": "CronJob",
+    "replicasets": "ReplicaSet",
+    "services": "Service",
+    "leases": "Lease",
+}
+
+
+def get_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def match_labels(labels: dict, selector: str) -> bool:
+    for requirement in filter(None, (selector or "").split(",")):
+        if requirement.startswith("!"):
+            if requirement[1:] in labels:
+                return False
+        elif "=" in requirement:
+            key, value = requirement.split("=", 1)
+            if labels.get(key.rstrip("=")) != value:
+                return False
+        elif requirement not in labels:
+            return False
+    return True
+
+
+def merge_patch(target: dict, patch: dict) -> dict:
+    # JSON merge patch, plus the "$patch": "replace" directive of strategic merge patches
+    if patch.get("$patch") == "replace":
+        return {key: value for key, value in patch.items() if key != "$patch"}
+    target = dict(target)
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            target[key] = merge_patch(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+# In-memory stand-in of the API server for the resources the operator uses: list, watch,
+# get, create, replace, patch, delete, the scale subresource and discovery
+class FakeCluster:
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.resource_version = 0
+        self.objects = defaultdict(dict)
+        self.events = defaultdict(list)
+        self.calls = Counter()
+        self.watch_events = 0
+        self.closed = False
+        # Called under the lock on every change, with the plural, operation and object
+        self.hooks = []
+
+    def next_resource_version(self) -> str:
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def emit(self, plural: str, operation: str, obj: dict):
+        self.events[plural].append(
+            (self.resource_version, operation, copy.deepcopy(obj))
+        )
+        for hook in self.hooks:
+            hook(plural, operation, obj)
+        self.lock.notify_all()
+
+    def list(self, plural: str, namespace: str, selector: str) -> dict:
+        with self.lock:
+            items = [
+                copy.deepcopy(obj)
+                for (ns, _), obj in self.objects[plural].items()
+                if (namespace is None or ns == namespace)
+                and match_labels(obj["metadata"].get("labels") or {}, selector)
+            ]
+            return {
+                "kind": f"{KINDS.get(plural, 'Object')}List",
+                "apiVersion": "v1",
+                "metadata": {"resourceVersion": str(self.resource_version)},
+                "items": items,
+            }
+
+    def get(self, plural: str, namespace: str, name: str) -> dict:
+        with self.lock:
+            return copy.deepcopy(self.objects[plural].get((namespace, name)))
+
+    def create(self, plural: str, namespace: str, obj: dict) -> [int, dict]:
+        with self.lock:
+            key = (namespace, obj["metadata"]["name"])
+            if key in self.objects[plural]:
+                return 409, None
+            obj = copy.deepcopy(obj)
+            obj["metadata"].update(
+                namespace=namespace,
+                uid=str(uuid.uuid4()),
+                resourceVersion=self.next_resource_version(),
+                creationTimestamp=get_now(),
+            )
+            # The status of a new ReplicaSet requires its replicas, no pod exists yet
+            obj.setdefault("status", {"replicas": 0} if plural == "replicasets" else {})
+            self.objects[plural][key] = obj
+            self.emit(plural, "ADDED", obj)
+            return 201, copy.deepcopy(obj)
+
+    def update(self, plural: str, namespace: str, name: str, change) -> [int, dict]:
+        # change gets the stored object and returns the new one, or an HTTP status
+        with self.lock:
+            obj = self.objects[plural].get((namespace, name))
+            if obj is None:
+                return 404, None
+            obj = change(copy.deepcopy(obj))
+            if isinstance(obj, int):
+                return obj, None
+            obj["metadata"]["resourceVersion"] = self.next_resource_version()
+            self.objects[plural][(namespace, name)] = obj
+            self.emit(plural, "MODIFIED", obj)
+            return 200, copy.deepcopy(obj)
+
+    def delete(self, plural: str, namespace: str, name: str) -> [int, dict]:
+        with self.lock:
+            obj = self.objects[plural].pop((namespace, name), None)
+            if obj is None:
+                return 404, None
+            obj["metadata"]["resourceVersion"] = self.next_resource_version()
+            self.emit(plural, "DELETED", obj)
+            self.collect(obj["metadata"]["uid"])
+            return 200, obj
+
+    def collect(self, uid: str):
+        # Background garbage collection of the objects owned by uid
+        dependents = [
+            (plural, namespace, name)
+            for plural, objects in self.objects.items()
+            for (namespace, name), obj in objects.items()
+            if any(
+                owner.get("uid") == uid
+                for owner in obj["metadata"].get("ownerReferences") or []
+            )
+        ]
+        for plural, namespace, name in dependents:
+            self.delete(plural, namespace, name)
+
+    def watch(
+        self, plural: str, namespace: str, selector: str, since: int, timeout: float
+    ):
+        deadline = time.monotonic() + timeout
+        position = 0
+        while True:
+            with self.lock:
+                events = self.events[plural]
+                while position < len(events) and events[position][0] <= since:
+                    position += 1
+                if position == len(events):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.closed:
+                        return
+                    self.lock.wait(min(remaining, 1))
+                    continue
+                batch = events[position:]
+                position = len(events)
+            for resource_version, operation, obj in batch:
+                since = resource_version
+                if namespace and obj["metadata"]["namespace"] != namespace:
+                    continue
+                if not match_labels(obj["metadata"].get("labels") or {}, selector):
+                    continue
+                yield {"type": operation, "object": obj}
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+
+def get_resources(group: str, version: str) -> dict:
+    # Discovery of a group version, every kind is served under every group
+    return {
+        "kind": "APIResourceList",
+        "apiVersion": "v1",
+        "groupVersion": f"{group}/{version}",
+        "resources": [
+            {
+                "name": plural,
+                "singularName": kind.lower(),
+                "namespaced": True,
+                "kind": kind,
+                "verbs": ["get", "list", "watch", "create", "update", "delete"],
+            }
+            for plural, kind in KINDS.items()
+        ],
+    }
+
+
+def get_status(code: int, reason: str) -> dict:
+    return {
+        "kind": "Status",
+        "apiVersion": "v1",
+        "status": "Failure",
+        "code": code,
+        "reason": reason,
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cluster: FakeCluster = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_result(self, code: int, body: dict, reason: str = ""):
+        if body is None:
+            self.send_json(
+                code,
+                get_status(
+                    code, reason or {404: "NotFound", 409: "Conflict"}.get(code, "")
+                ),
+            )
+        else:
+            self.send_json(code, body)
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def parse(self):
+        url = urlparse(self.path)
+        match = PATH.match(url.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return match, query
+
+    def count(self, verb: str, plural: str):
+        with self.cluster.lock:
+            self.cluster.calls[(verb, plural)] += 1
+
+    def do_GET(self):
+        match, query = self.parse()
+        discovery = DISCOVERY.match(urlparse(self.path).path)
+        if discovery:
+            self.count("discovery", discovery["group"])
+            return self.send_json(
+                200, get_resources(discovery["group"], discovery["version"])
+            )
+        if not match:
+            return self.send_result(404, None)
+        plural, namespace, name = match["plural"], match["namespace"], match["name"]
+        if (query.get("watch") or "").lower() in ("true", "1"):
+            self.count("watch", plural)
+            return self.stream(plural, namespace, query)
+        if name:
+            self.count("get", plural)
+            return self.send_result(
+                200 if self.cluster.get(plural, namespace, name) else 404,
+                self.cluster.get(plural, namespace, name),
+            )
+        self.count("list", plural)
+        self.send_json(
+            200, self.cluster.list(plural, namespace, query.get("labelSelector"))
+        )
+
+    def stream(self, plural: str, namespace: str, query: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = self.cluster.watch(
+            plural,
+            namespace,
+            query.get("labelSelector"),
+            int(query.get("resourceVersion") or 0),
+            float(query.get("timeoutSeconds") or 60),
+        )
+        try:
+            for event in events:
+                line = json.dumps(event).encode() + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+                with self.cluster.lock:
+                    self.cluster.watch_events += 1
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_POST(self):
+        match, _ = self.parse()
+        self.count("create", match["plural"])
+        code, obj = self.cluster.create(
+            match["plural"], match["namespace"], self.read_body()
+        )
+        self.send_result(code, obj)
+
+    def do_PUT(self):
+        match, _ = self.parse()
+        self.count("replace", match["plural"])
+        body = self.read_body()
+
+        def replace(obj: dict):
+            expected = body["metadata"].get("resourceVersion")
+            if expected and expected != obj["metadata"]["resourceVersion"]:
+                return 409
+            body["metadata"] = {**obj["metadata"], **body["metadata"]}
+            return body
+
+        code, obj = self.cluster.update(
+            match["plural"], match["namespace"], match["name"], replace
+        )
+        self.send_result(code, obj)
+
+    def do_PATCH(self):
+        match, _ = self.parse()
+        plural, subresource = match["plural"], match["subresource"]
+        self.count(f"patch/{subresource}" if subresource else "patch", plural)
+        patch = self.read_body()
+        code, obj = self.cluster.update(
+            plural,
+            match["namespace"],
+            match["name"],
+            lambda obj: merge_patch(obj, patch),
+        )
+        if subresource == "scale" and obj:
+            obj = {
+                "kind": "Scale",
+                "apiVersion": "autoscaling/v1",
+                "metadata": obj["metadata"],
+                "spec": {"replicas": obj["spec"].get("replicas")},
+                "status": {"replicas": obj["spec"].get("replicas")},
+            }
+        self.send_result(code, obj)
+
+    def do_DELETE(self):
+        match, query = self.parse()
+        plural = match["plural"]
+        self.read_body()
+        if not match["name"]:
+            self.count("deletecollection", plural)
+            items = self.cluster.list(
+                plural, match["namespace"], query.get("labelSelector")
+            )["items"]
+            for item in items:
+                self.cluster.delete(
+                    plural, item["metadata"]["namespace"], item["metadata"]["name"]
+                )
+            return self.send_json(
+                200, {"kind": "Status", "apiVersion": "v1", "status": "Success"}
+            )
+        self.count("delete", plural)
+        code, obj = self.cluster.delete(plural, match["namespace"], match["name"])
+        self.send_result(code, obj)
+
+
+def start_server(cluster: FakeCluster) -> ThreadingHTTPServer:
+    handler = type("BoundHandler", (Handler,), {"cluster": cluster})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-api", daemon=True).start()
+    return server
@@ -0,0 +1,326 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from kubernetes import client
+
+from bench.fake_api import FakeCluster, start_server
+
+NAMESPACE = os.environ.setdefault("NAMESPACE", "bench")
+# The finished Locust objects are deleted at once, the deleted phase measures the handlers
+os.environ.setdefault("LOCUST_DELETE_DELAY_SECONDS", "0")
+WORKERS = 2
+
+
+# Time from a change made by the driver to the last object change it should cause
+class Tracker:
+    def __init__(self, cluster: FakeCluster):
+        self.cluster = cluster
+        self.expected = {}
+        self.pending = {}
+        self.started = {}
+        self.latencies = []
+        self.done = threading.Event()
+        cluster.hooks.append(self.observe)
+
+    def expect(self, key: str, conditions: list):
+        with self.cluster.lock:
+            self.started[key] = time.monotonic()
+            self.pending[key] = set(conditions)
+            for condition in conditions:
+                self.expected[condition] = key
+            self.done.clear()
+
+    def observe(self, plural: str, operation: str, obj: dict):
+        key = self.expected.pop((plural, operation, obj["metadata"]["name"]), None)
+        if key is None:
+            return
+        self.pending[key].discard((plural, operation, obj["metadata"]["name"]))
+        if not self.pending[key]:
+            del self.pending[key]
+            self.latencies.append(time.monotonic() - self.started.pop(key))
+            if not self.pending:
+                self.done.set()
+
+    def reset(self):
+        with self.cluster.lock:
+            self.latencies = []
+
+
+def get_percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def get_rss_mb() -> float:
+    # Peak of the whole process: operator, fake API server and driver
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except Exception:
+        return None
+
+
+def get_locust_body(name: str, schedule: str = "") -> dict:
+    spec = {"workers": WORKERS, "runTime": "1m"}
+    if schedule:
+        spec["schedule"] = schedule
+    return {
+        "apiVersion": "locust-qa.xyz/v1",
+        "kind": "Locust",
+        "metadata": {"name": name},
+        "spec": spec,
+    }
+
+
+def start_operator(args):
+    # Imported once the default configuration points to the fake API server
+    from src.cache import (
+        create_informers,
+        start_informer,
+        use_fast_decode,
+        wait_for_sync,
+    )
+    from src.constants import (
+        CRD_GROUP,
+        CRD_VERSION,
+        CRD_PLURAL,
+        GAUGE_LOCUST_OBJECT,
+        ENUM_LOCUST_OBJECT_STATE,
+        GAUGE_JOB_OBJECT,
+        ENUM_JOB_OBJECT_STATE,
+    )
+    from src.listeners import watch_locust_events, watch_job_events
+    from src.workqueue import WorkQueue, start_workers
+
+    informers = create_informers(CRD_GROUP, CRD_VERSION, [NAMESPACE], CRD_PLURAL)
+    if args.fast_decode:
+        use_fast_decode(informers)
+    queue = WorkQueue(args.reconcile_qps, args.reconcile_burst)
+    watch_job_events(
+        informers["Job"],
+        queue,
+        None,
+        CRD_GROUP,
+        CRD_VERSION,
+        CRD_PLURAL,
+        GAUGE_JOB_OBJECT,
+        ENUM_JOB_OBJECT_STATE,
+    )
+    watch_locust_events(
+        informers["Locust"],
+        queue,
+        None,
+        GAUGE_LOCUST_OBJECT,
+        ENUM_LOCUST_OBJECT_STATE,
+        args.reconcile_workers,
+    )
+    start_workers(queue, args.reconcile_workers)
+    for kind in informers.values():
+        for informer in kind:
+            start_informer(informer)
+    wait_for_sync()
+
+
+def run_phase(name: str, cluster: FakeCluster, tracker: Tracker, args, drive) -> dict:
+    tracker.reset()
+    with cluster.lock:
+        events = cluster.watch_events
+    started = time.monotonic()
+    drive()
+    completed = tracker.done.wait(args.timeout)
+    duration = time.monotonic() - started
+    with cluster.lock:
+        events = cluster.watch_events - events
+        pending = len(tracker.pending)
+    if not completed:
+        logging.warning(f"Phase {name} timed out with {pending} objects pending")
+    return {
+        "seconds": round(duration, 3),
+        "events_per_second": round(events / duration, 1),
+        "p50_latency_ms": round(get_percentile(tracker.latencies, 0.5) * 1000, 1),
+        "p99_latency_ms": round(get_percentile(tracker.latencies, 0.99) * 1000, 1),
+        "pending": pending,
+    }
+
+
+def run(args) -> dict:
+    cluster = FakeCluster()
+    server = start_server(cluster)
+    configuration = client.Configuration()
+    configuration.host = f"http://127.0.0.1:{server.server_address[1]}"
+    client.Configuration.set_default(configuration)
+    start_operator(args)
+    tracker = Tracker(cluster)
+    runs = [f"run-{i}" for i in range(args.locusts)]
+    scheduled = [
+        f"scheduled-{i}" for i in range(int(args.locusts * args.scheduled_ratio))
+    ]
+
+    def add():
+        for name in runs:
+            tracker.expect(
+                name,
+                [
+                    ("jobs", "ADDED", f"job-{name}"),
+                    ("replicasets", "ADDED", f"replicaset-{name}"),
+                    ("services", "ADDED", f"service-{name}"),
+                ],
+            )
+            cluster.create("locusts", NAMESPACE, get_locust_body(name))
+        for name in scheduled:
+            tracker.expect(name, [("cronjobs", "ADDED", f"cronjob-{name}")])
+            cluster.create("locusts", NAMESPACE, get_locust_body(name, "0 0 * * *"))
+
+    def modify():
+        # A new spec for the scheduled tests, a label only change for the others
+        def set_workers(obj: dict) -> dict:
+            obj["spec"]["workers"] = WORKERS + 1
+            return obj
+
+        def set_label(obj: dict) -> dict:
+            obj["metadata"]["labels"] = {"bench": "modified"}
+            return obj
+
+        for name in scheduled:
+            tracker.expect(name, [("cronjobs", "MODIFIED", f"cronjob-{name}")])
+            cluster.update("locusts", NAMESPACE, name, set_workers)
+        for name in runs:
+            cluster.update("locusts", NAMESPACE, name, set_label)
+        if not scheduled:
+            tracker.done.set()
+
+    def delete():
+        # The runs finish, the scheduled tests are deleted
+        def set_succeeded(obj: dict) -> dict:
+            obj["status"] = {"succeeded": 1}
+            return obj
+
+        for name in runs:
+            tracker.expect(
+                name,
+                [
+                    ("locusts", "DELETED", name),
+                    ("jobs", "DELETED", f"job-{name}"),
+                    ("replicasets", "DELETED", f"replicaset-{name}"),
+                    ("services", "DELETED", f"service-{name}"),
+                ],
+            )
+            cluster.update("jobs", NAMESPACE, f"job-{name}", set_succeeded)
+        for name in scheduled:
+            tracker.expect(name, [("cronjobs", "DELETED", f"cronjob-{name}")])
+            cluster.delete("locusts", NAMESPACE, name)
+
+    with cluster.lock:
+        cluster.calls.clear()
+    phases = {
+        "added": run_phase("added", cluster, tracker, args, add),
+        "modified": run_phase("modified", cluster, tracker, args, modify),
+        "deleted": run_phase("deleted", cluster, tracker, args, delete),
+    }
+    with cluster.lock:
+        calls = dict(cluster.calls)
+    cluster.close()
+    total = len(runs) + len(scheduled)
+    api_calls = sum(count for (verb, _), count in calls.items() if verb != "watch")
+    return {
+        "commit": get_commit(),
+        "locusts": total,
+        "reconcile_workers": args.reconcile_workers,
+        "reconcile_qps": args.reconcile_qps,
+        "fast_decode": args.fast_decode,
+        "phases": phases,
+        "api_calls_per_locust": round(api_calls / total, 2),
+        "api_calls": {
+            f"{verb} {plural}": count for (verb, plural), count in sorted(calls.items())
+        },
+        "max_rss_mb": round(get_rss_mb(), 1),
+    }
+
+
+def get_metrics(result: dict) -> dict:
+    metrics = {
+        f"{phase}.{key}": value
+        for phase, values in result["phases"].items()
+        for key, value in values.items()
+    }
+    metrics["api_calls_per_locust"] = result["api_calls_per_locust"]
+    metrics["max_rss_mb"] = result["max_rss_mb"]
+    return metrics
+
+
+def print_comparison(baseline: dict, result: dict):
+    print(
+        f"{'metric':<30} {baseline.get('commit') or 'baseline':>12} {result.get('commit') or 'current':>12}  change"
+    )
+    old, new = get_metrics(baseline), get_metrics(result)
+    for key, value in new.items():
+        before = old.get(key)
+        change = ""
+        if before:
+            change = f"{(value - before) / before * 100:+.1f}%"
+        print(
+            f"{key:<30} {before if before is not None else '-':>12} {value:>12}  {change}"
+        )
+
+
+def get_args():
+    from src.constants import RECONCILE_WORKERS, RECONCILE_QPS, RECONCILE_BURST
+
+    parser = argparse.ArgumentParser(
+        description="Drive Locust objects through the operator against a fake API server"
+    )
+    parser.add_argument(
+        "--locusts", type=int, default=1000, help="Locust objects run once"
+    )
+    parser.add_argument(
+        "--scheduled-ratio",
+        type=float,
+        default=0.1,
+        help="additional scheduled Locust objects, as a ratio of --locusts",
+    )
+    parser.add_argument("--reconcile-workers", type=int, default=RECONCILE_WORKERS)
+    parser.add_argument("--reconcile-qps", type=float, default=RECONCILE_QPS)
+    parser.add_argument("--reconcile-burst", type=int, default=RECONCILE_BURST)
+    parser.add_argument(
+        "--fast-decode",
+        action="store_true",
+        help="decode the watch events without the client models",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="per phase, in seconds"
+    )
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=args.log_level)
+    result = run(args)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            print_comparison(json.load(baseline), result)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
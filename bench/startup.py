@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from kubernetes import client
+
+from bench.fake_api import FakeCluster, start_server
+from bench.run import NAMESPACE, WORKERS, get_commit, get_locust_body
+
+METRICS_PORT = 8000
+
+
+def add_runs(cluster: FakeCluster, count: int):
+    # Running Locust objects with their Job, Service and workers, as the operator
+    # finds them after a restart
+    from src.controller import LocustSpec
+    from src.objects import get_job_body, get_replica_set_body, get_service_body
+
+    api_client = client.ApiClient()
+    for index in range(count):
+        name = f"run-{index}"
+        body = get_locust_body(name)
+        cluster.create("locusts", NAMESPACE, body)
+        spec = LocustSpec.from_dict(body["spec"])
+        for plural, obj in [
+            ("jobs", get_job_body(name, f"job-{name}", spec)),
+            ("services", get_service_body(name, f"service-{name}", f"job-{name}")),
+            (
+                "replicasets",
+                get_replica_set_body(
+                    name, f"replicaset-{name}", f"service-{name}", spec
+                ),
+            ),
+        ]:
+            obj = api_client.sanitize_for_serialization(obj)
+            if plural == "jobs":
+                obj["status"] = {"active": 1}
+            elif plural == "replicasets":
+                obj["status"] = {"replicas": WORKERS, "readyReplicas": WORKERS}
+            cluster.create(plural, NAMESPACE, obj)
+
+
+def get_kubeconfig(host: str) -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "clusters": [{"name": "fake", "cluster": {"server": host}}],
+        "users": [{"name": "fake", "user": {}}],
+        "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+        "current-context": "fake",
+    }
+
+
+def get(path: str) -> [int, bytes]:
+    try:
+        with urllib.request.urlopen(
+            f"http://127.0.0.1:{METRICS_PORT}{path}", timeout=1
+        ) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, b""
+    except OSError:
+        return None, b""
+
+
+def get_startup_gauge(metrics: bytes) -> float:
+    for line in metrics.decode().splitlines():
+        if line.startswith("locust_operator_startup_seconds "):
+            return float(line.split()[1])
+    return None
+
+
+def start_once(args, env: dict) -> dict:
+    # Seconds from the spawn of the operator to its metrics server up, then ready
+    command = [sys.executable, "-m", "src.main"] + args.operator_args
+    started = time.monotonic()
+    process = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {"metrics_up_seconds": None, "ready_seconds": None}
+    try:
+        while time.monotonic() - started < args.timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Operator exited with {process.returncode}")
+            status, _ = get("/readyz")
+            if status and result["metrics_up_seconds"] is None:
+                result["metrics_up_seconds"] = round(time.monotonic() - started, 3)
+            if status == 200:
+                result["ready_seconds"] = round(time.monotonic() - started, 3)
+                gauge = get_startup_gauge(get("/metrics")[1])
+                result["startup_gauge_seconds"] = gauge and round(gauge, 3)
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Time from the start of the operator to its readiness, against a fake API server"
+    )
+    parser.add_argument(
+        "--locusts", type=int, default=500, help="running Locust objects to sync"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120, help="per start")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument(
+        "operator_args",
+        nargs="*",
+        help="arguments of the operator after --, e.g. -- --asyncio --fast-decode",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    cluster = FakeCluster()
+    server = start_server(cluster)
+    add_runs(cluster, args.locusts)
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as kubeconfig:
+        json.dump(
+            get_kubeconfig(f"http://127.0.0.1:{server.server_address[1]}"), kubeconfig
+        )
+        kubeconfig.flush()
+        env = {
+            key: value
+            for key, value in os.environ.items()
+            if not key.startswith("KUBERNETES_")
+        }
+        env.update(KUBECONFIG=kubeconfig.name, NAMESPACE=NAMESPACE, LOG_LEVEL="WARNING")
+        runs = [start_once(args, env) for _ in range(args.repeat)]
+    cluster.close()
+    result = {
+        "commit": get_commit(),
+        "locusts": args.locusts,
+        "operator_args": args.operator_args,
+        "runs": runs,
+        "median_ready_seconds": statistics.median(
+            run["ready_seconds"] for run in runs if run["ready_seconds"] is not None
+        ),
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+    json.dump(result, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import signal
+
+from kubernetes import config as sync_config
+from kubernetes_asyncio import client, config, watch
+
+from src.clients import (
+    instrument_async_rest_client,
+    register_async_pool_metrics,
+    request_metadata_only,
+    set_write_limit,
+    use_event_loop,
+)
+from src.cache import (
+    Informer,
+    create_informers,
+    use_fast_decode,
+)
+from src.constants import (
+    HTTP_STATUS_GONE,
+    CRD_GROUP,
+    CRD_VERSION,
+    WATCH_NAMESPACES,
+    CRD_PLURAL,
+    WATCH_TIMEOUT_SECONDS,
+    WATCH_RETRY_SECONDS,
+    COUNTER_WATCH_RESTARTS,
+    API_POOL_SIZE,
+)
+from src.controller import check_crd
+from src.health import start_metrics_server
+from src.roles import start_loops, watch_events
+from src.sharding import create_sharder
+from src.workqueue import WorkQueue, start_workers
+
+log = logging.getLogger(__name__)
+
+
+class AsyncInformer(Informer):
+    api_exception = client.exceptions.ApiException
+
+    async def list(self) -> [list, str]:
+        if self.decode:
+            raw = await self.list_func(
+                *self.args, _preload_content=False, **self.kwargs
+            )
+            async with raw:
+                response = self.get_list(await raw.read())
+        else:
+            response = await self.list_func(*self.args, **self.kwargs)
+        return self.get_objects(response)
+
+    async def relist(self) -> str:
+        objects, resource_version = await self.list()
+        self.sync(objects)
+        return resource_version
+
+    async def stream(self, resource_version: str):
+        response = await self.list_func(
+            *self.args,
+            watch=True,
+            resource_version=resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=WATCH_TIMEOUT_SECONDS,
+            _preload_content=False,
+            **self.kwargs,
+        )
+        async with response:
+            while line := await response.content.readline():
+                if line.strip():
+                    yield self.decode_event(line)
+
+    async def watch(self, resource_version: str) -> str:
+        if self.decode:
+            async for event in self.stream(resource_version):
+                resource_version = self.handle(event)
+            return resource_version
+        async with watch.Watch() as w:
+            stream = w.stream(
+                self.list_func,
+                *self.args,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                **self.kwargs,
+            )
+            async for event in stream:
+                resource_version = self.handle(event)
+        return resource_version
+
+    async def run(self):
+        log.info(f"Waiting for {self.store.kind} events to come up...")
+        resource_version = None
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = await self.relist()
+                resource_version = await self.watch(resource_version)
+                COUNTER_WATCH_RESTARTS.labels(
+                    kind=self.store.kind, reason="closed"
+                ).inc()
+            except client.exceptions.ApiException as e:
+                if e.status == HTTP_STATUS_GONE:
+                    log.info(f"Watch on {self.store.kind} expired, relisting")
+                    COUNTER_WATCH_RESTARTS.labels(
+                        kind=self.store.kind, reason="expired"
+                    ).inc()
+                    resource_version = None
+                else:
+                    log.warning(f"Watch on {self.store.kind} exception: {e.reason}")
+                    COUNTER_WATCH_RESTARTS.labels(
+                        kind=self.store.kind, reason="error"
+                    ).inc()
+                    await asyncio.sleep(WATCH_RETRY_SECONDS)
+            except Exception:
+                log.exception(f"Watch on {self.store.kind} exception")
+                COUNTER_WATCH_RESTARTS.labels(
+                    kind=self.store.kind, reason="error"
+                ).inc()
+                await asyncio.sleep(WATCH_RETRY_SECONDS)
+
+
+def get_apis(api_client: client.ApiClient, metadata_client: client.ApiClient) -> dict:
+    return {
+        "custom": client.CustomObjectsApi(api_client),
+        "batch": client.BatchV1Api(api_client),
+        "apps": client.AppsV1Api(api_client),
+        "metadata_core": client.CoreV1Api(metadata_client),
+    }
+
+
+async def run(args):
+    # Check if run in k8s cluster and load the kubeconfig
+    if "KUBERNETES_PORT" in os.environ:
+        config.load_incluster_config()
+        sync_config.load_incluster_config()
+    else:
+        await config.load_kube_config()
+        sync_config.load_kube_config()
+    # Up first, the readiness probe fails until the caches are synced
+    start_metrics_server(8001 if args.locusts and not args.jobs else 8000)
+    configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = API_POOL_SIZE
+    # One HTTP client shared by every watch and API call, and one for the metadata only
+    # watches
+    async with client.ApiClient(configuration) as api_client, client.ApiClient(
+        configuration
+    ) as metadata_client:
+        set_write_limit(args.api_qps, args.api_burst)
+        instrument_async_rest_client(api_client.rest_client)
+        register_async_pool_metrics(api_client.rest_client, "main")
+        request_metadata_only(metadata_client.rest_client)
+        instrument_async_rest_client(metadata_client.rest_client)
+        register_async_pool_metrics(metadata_client.rest_client, "metadata")
+        # The informers watch from the event loop. The handlers, reconcile workers and
+        # loops are those of the threaded mode, their API calls run as coroutines of
+        # api_client on the event loop
+        use_event_loop(api_client, asyncio.get_running_loop())
+        informers = create_informers(
+            CRD_GROUP,
+            CRD_VERSION,
+            WATCH_NAMESPACES,
+            CRD_PLURAL,
+            AsyncInformer,
+            get_apis(api_client, metadata_client),
+        )
+        if args.fast_decode:
+            use_fast_decode(informers)
+        queue = WorkQueue(args.reconcile_qps, args.reconcile_burst)
+        await asyncio.to_thread(check_crd, CRD_GROUP, CRD_VERSION, CRD_PLURAL)
+        sharder = create_sharder(args)
+        start_loops(args, sharder)
+        watch_events(args, informers, queue, sharder)
+        start_workers(queue, args.reconcile_workers)
+        # Stop the informers on SIGTERM and hand the Locust objects over to the other
+        # replicas without waiting for the lease to expire
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+        try:
+            await asyncio.gather(
+                *[informer.run() for kind in informers.values() for informer in kind]
+            )
+        except asyncio.CancelledError:
+            if sharder:
+                # The release calls the API through the event loop, off the loop thread
+                await asyncio.to_thread(sharder.release)
@@ -1,5 +1,13 @@
 import argparse
 
+from src.constants import (
+    RECONCILE_WORKERS,
+    RECONCILE_QPS,
+    RECONCILE_BURST,
+    API_QPS,
+    API_BURST,
+)
+
 
 def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Process some integers.")
@@ -7,4 +15,54 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--locusts", action="store_true", help="listen on locust and events"
     )
+    parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="run the watches and API calls as coroutines in one event loop",
+    )
+    parser.add_argument(
+        "--fast-decode",
+        action="store_true",
+        help="decode the lists and watch events without the client models",
+    )
+    parser.add_argument(
+        "--sharding",
+        action="store_true",
+        help="split the Locust objects between the replicas of the operator",
+    )
+    parser.add_argument(
+        "--leader-elect",
+        action="store_true",
+        help="only the leader replica reconciles, the others are warm standbys",
+    )
+    parser.add_argument(
+        "--reconcile-workers",
+        type=int,
+        default=RECONCILE_WORKERS,
+        help="number of reconcile workers",
+    )
+    parser.add_argument(
+        "--reconcile-qps",
+        type=float,
+        default=RECONCILE_QPS,
+        help="maximum reconciles per second (0 for no limit)",
+    )
+    parser.add_argument(
+        "--reconcile-burst",
+        type=int,
+        default=RECONCILE_BURST,
+        help="maximum burst of reconciles",
+    )
+    parser.add_argument(
+        "--api-qps",
+        type=float,
+        default=API_QPS,
+        help="maximum writes to the API server per second (0 for no limit)",
+    )
+    parser.add_argument(
+        "--api-burst",
+        type=int,
+        default=API_BURST,
+        help="maximum burst of writes to the API server",
+    )
     return parser.parse_args()
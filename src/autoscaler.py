@@ -0,0 +1,220 @@
+import json
+import logging
+import math
+import time
+import urllib.request
+from collections import defaultdict, deque
+
+from kubernetes import client
+from kubernetes.utils import parse_quantity
+
+from src.cache import LOCUST_STORE, REPLICA_SET_STORE, get_key, get_locust_label
+from src.clients import get_apps_api, get_custom_api
+from src.constants import (
+    AUTOSCALE_INTERVAL_SECONDS,
+    AUTOSCALE_DOWNSCALE_SECONDS,
+    AUTOSCALE_TOLERANCE,
+    LOCUST_WEB_PORT,
+    GAUGE_AUTOSCALE_WORKERS,
+    GAUGE_AUTOSCALE_WORKER_CPU,
+    GAUGE_WORKER_PROCESSES,
+    GAUGE_DEGRADED_WORKERS,
+)
+from src.controller import Autoscaling, LocustSpec, get_locust_spec
+from src.retention import SERIES_RETENTION
+from src.sharding import Sharder
+from src.status import STATUS_WRITER, update_result
+
+log = logging.getLogger(__name__)
+
+
+def get_master_stats(name: str, namespace: str) -> dict:
+    # Served by the web UI of the master, see get_command_master
+    url = f"http://service-{name}.{namespace}.svc:{LOCUST_WEB_PORT}/stats/requests"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.load(response)
+    except Exception:
+        log.debug(f"Stats of Locust {name} not available")
+        return None
+
+
+def get_worker_cpu(name: str, namespace: str, stats: dict, processes: int = 1) -> float:
+    # Mean CPU usage of the worker processes, in percent of one core
+    if stats and stats.get("workers"):
+        usages = [worker.get("cpu_usage", 0) for worker in stats["workers"]]
+        return sum(usages) / len(usages)
+    # Fallback on the metrics server, the master pod is the one with an app label
+    try:
+        metrics = get_custom_api().list_namespaced_custom_object(
+            "metrics.k8s.io",
+            "v1beta1",
+            namespace,
+            "pods",
+            label_selector=f"locust={name},!app",
+        )
+    except client.exceptions.ApiException:
+        log.debug(f"Pod metrics of Locust {name} not available")
+        return None
+    usages = [
+        sum(parse_quantity(c["usage"]["cpu"]) for c in pod["containers"]) * 100
+        for pod in metrics.get("items", [])
+    ]
+    if not usages:
+        return None
+    return float(sum(usages)) / len(usages) / processes
+
+
+def get_recommendation(
+    autoscaling: Autoscaling, replicas: int, cpu: float, stats: dict, processes: int = 1
+) -> int:
+    # Worker pods, the users and RPS per worker are per worker process
+    recommendations = []
+    if cpu is not None:
+        ratio = cpu / autoscaling.target_cpu
+        if abs(ratio - 1) > AUTOSCALE_TOLERANCE:
+            recommendations.append(math.ceil(replicas * ratio))
+        else:
+            recommendations.append(replicas)
+    if stats and autoscaling.users_per_worker:
+        users = stats.get("user_count", 0)
+        recommendations.append(
+            math.ceil(users / autoscaling.users_per_worker / processes)
+        )
+    if stats and autoscaling.rps_per_worker:
+        rps = stats.get("total_rps", 0)
+        recommendations.append(math.ceil(rps / autoscaling.rps_per_worker / processes))
+    if not recommendations:
+        return replicas
+    return autoscaling.clamp(max(recommendations))
+
+
+def get_worker_processes(stats: dict) -> dict:
+    # Worker processes connected to the master per pod, Locust names its workers
+    # <hostname>_<uuid> and the hostname of a pod is its name
+    processes = defaultdict(int)
+    for worker in stats.get("workers", []):
+        if worker.get("state") != "missing":
+            processes[worker.get("id", "").rsplit("_", 1)[0]] += 1
+    return processes
+
+
+# Resize the worker ReplicaSets during the runs to keep the workers below their CPU
+# target and follow the user and RPS numbers reported by the masters, and check the
+# processes of the multi-process workers
+class Autoscaler:
+    def __init__(self, sharder: Sharder = None):
+        self.sharder = sharder
+        self.recommendations = defaultdict(deque)
+        # namespace/name -> worker pods last seen with missing processes
+        self.degraded = {}
+
+    def get_desired(self, key: str, recommendation: int, replicas: int) -> int:
+        # Scale up at once, scale down to the highest recommendation of the window
+        now = time.monotonic()
+        history = self.recommendations[key]
+        history.append((now, recommendation))
+        while history[0][0] < now - AUTOSCALE_DOWNSCALE_SECONDS:
+            history.popleft()
+        if recommendation >= replicas:
+            return recommendation
+        return min(replicas, max(r for _, r in history))
+
+    def check_processes(
+        self, replica_set, processes: int, name: str, namespace: str, stats: dict
+    ):
+        # Pods running fewer processes than asked, e.g. some of them crashed, the ready
+        # pods with none connected included
+        if not stats or "workers" not in stats:
+            return
+        per_pod = get_worker_processes(stats)
+        ready = replica_set.status.ready_replicas if replica_set.status else None
+        degraded = sorted(pod for pod, count in per_pod.items() if count < processes)
+        missing = max((ready or 0) - len(per_pod), 0)
+        connected = sum(per_pod.values())
+        SERIES_RETENTION.labels(GAUGE_WORKER_PROCESSES, namespace, name).set(connected)
+        SERIES_RETENTION.labels(GAUGE_DEGRADED_WORKERS, namespace, name).set(
+            len(degraded) + missing
+        )
+        STATUS_WRITER.update(
+            namespace,
+            name,
+            workerProcesses=(replica_set.spec.replicas or 0) * processes,
+            workerProcessesReady=connected,
+        )
+        key = get_key(namespace, name)
+        if degraded and degraded != self.degraded.get(key):
+            log.info(
+                f"Locust {name} worker pods with fewer than {processes} processes:"
+                f" {', '.join(degraded)}"
+            )
+        self.degraded[key] = degraded
+
+    def scale(
+        self,
+        replica_set,
+        autoscaling: Autoscaling,
+        processes: int,
+        name: str,
+        namespace: str,
+        stats: dict,
+    ):
+        replicas = replica_set.spec.replicas
+        cpu = get_worker_cpu(name, namespace, stats, processes)
+        if cpu is not None:
+            SERIES_RETENTION.labels(GAUGE_AUTOSCALE_WORKER_CPU, namespace, name).set(
+                cpu
+            )
+        recommendation = get_recommendation(
+            autoscaling, replicas, cpu, stats, processes
+        )
+        desired = self.get_desired(get_key(namespace, name), recommendation, replicas)
+        SERIES_RETENTION.labels(GAUGE_AUTOSCALE_WORKERS, namespace, name).set(desired)
+        if desired == replicas:
+            return
+        get_apps_api().patch_namespaced_replica_set_scale(
+            replica_set.metadata.name, namespace, {"spec": {"replicas": desired}}
+        )
+        log.info(
+            f"Scaled replicaset {replica_set.metadata.name} from {replicas} to {desired}"
+            f" workers (cpu: {cpu}, stats: {stats is not None})"
+        )
+
+    def poll(self, replica_set, spec: LocustSpec, name: str, namespace: str):
+        stats = get_master_stats(name, namespace)
+        update_result(namespace, name, stats)
+        if spec.processes > 1:
+            self.check_processes(replica_set, spec.processes, name, namespace, stats)
+        if spec.autoscaling:
+            self.scale(
+                replica_set, spec.autoscaling, spec.processes, name, namespace, stats
+            )
+
+    def step(self):
+        keys = set()
+        for replica_set in REPLICA_SET_STORE.list():
+            namespace = replica_set.metadata.namespace
+            name = get_locust_label(replica_set)
+            key = get_key(namespace, name)
+            if self.sharder and not self.sharder.owns(key):
+                continue
+            locust_object = LOCUST_STORE.get(namespace, name)
+            spec = get_locust_spec(locust_object) if locust_object else None
+            if not spec or not (spec.autoscaling or spec.processes > 1):
+                continue
+            keys.add(key)
+            try:
+                self.poll(replica_set, spec, name, namespace)
+            except Exception:
+                log.exception(
+                    f"Autoscale replicaset {replica_set.metadata.name} exception"
+                )
+        for key in set(self.recommendations) - keys:
+            del self.recommendations[key]
+        for key in set(self.degraded) - keys:
+            del self.degraded[key]
+
+    def run(self):
+        while True:
+            self.step()
+            time.sleep(AUTOSCALE_INTERVAL_SECONDS)
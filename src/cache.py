@@ -0,0 +1,496 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable
+
+from kubernetes import client, watch
+from kubernetes.watch.watch import iter_resp_lines
+
+from src.clients import (
+    get_batch_api,
+    get_apps_api,
+    get_custom_api,
+    get_metadata_api,
+)
+from src.constants import (
+    HTTP_STATUS_GONE,
+    WATCH_TIMEOUT_SECONDS,
+    WATCH_RETRY_SECONDS,
+    COUNTER_WATCH_RESTARTS,
+)
+from src.views import View, loads
+
+log = logging.getLogger(__name__)
+
+# Jobs created by the operator, from a Locust object or a CronJob
+JOB_SELECTOR = "locust,issued_by"
+
+
+def get_name(obj) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"]["name"]
+    return obj.metadata.name
+
+
+def get_labels(obj) -> dict:
+    if isinstance(obj, dict):
+        return obj["metadata"].get("labels") or {}
+    return obj.metadata.labels or {}
+
+
+def get_locust_label(obj) -> str:
+    return get_labels(obj).get("locust")
+
+
+def get_kind(obj) -> str:
+    if isinstance(obj, dict):
+        return obj.get("kind", "Locust")
+    # Watched objects have no kind, the model class is named after it
+    return obj.kind or type(obj).__name__.removeprefix("V1")
+
+
+def get_namespace(obj) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"].get("namespace")
+    return obj.metadata.namespace
+
+
+def get_key(namespace: str, name: str) -> str:
+    return f"{namespace}/{name}"
+
+
+def get_resource_version(obj) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"].get("resourceVersion")
+    return obj.metadata.resource_version
+
+
+# The handlers never read the pod templates, by far the largest part of these objects,
+# so the stores do not keep them
+def trim_job(job):
+    job.spec = None
+    return job
+
+
+def trim_replica_set(replica_set):
+    replica_set.spec.template = None
+    return replica_set
+
+
+def trim_cronjob(cronjob):
+    cronjob.spec.job_template.spec = None
+    return cronjob
+
+
+def get_items(response) -> [list, str]:
+    if isinstance(response, dict):
+        return response.get("items", []), get_resource_version(response)
+    return response.items, response.metadata.resource_version
+
+
+# Thread safe local copy of the objects of one kind, indexed by namespace/name and by
+# namespace/Locust name
+class Store:
+    def __init__(self, kind: str, index: Callable = get_locust_label):
+        self.kind = kind
+        self.index = index
+        self.synced = threading.Event()
+        self._lock = threading.RLock()
+        self._objects = {}
+        self._by_locust = defaultdict(set)
+        self._unsynced_scopes = set()
+
+    def add_scope(self, scope: str):
+        # The store is synced once every informer filling it has listed its scope
+        with self._lock:
+            self._unsynced_scopes.add(scope)
+
+    def replace(self, objects: list, scope: str = None):
+        with self._lock:
+            for obj in self.list(scope):
+                self.delete(obj)
+            for obj in objects:
+                self.upsert(obj)
+            self._unsynced_scopes.discard(scope)
+            if not self._unsynced_scopes:
+                self.synced.set()
+
+    def upsert(self, obj):
+        namespace = get_namespace(obj)
+        key = get_key(namespace, get_name(obj))
+        with self._lock:
+            self._objects[key] = obj
+            locust_name = self.index(obj)
+            if locust_name:
+                self._by_locust[get_key(namespace, locust_name)].add(key)
+
+    def delete(self, obj):
+        namespace = get_namespace(obj)
+        key = get_key(namespace, get_name(obj))
+        with self._lock:
+            self._objects.pop(key, None)
+            locust_key = get_key(namespace, self.index(obj))
+            if locust_key in self._by_locust:
+                self._by_locust[locust_key].discard(key)
+                if not self._by_locust[locust_key]:
+                    del self._by_locust[locust_key]
+
+    def get_locust_key(self, obj) -> str:
+        # namespace/name of the Locust object managing obj
+        return get_key(get_namespace(obj), self.index(obj) or get_name(obj))
+
+    def get(self, namespace: str, name: str):
+        with self._lock:
+            return self._objects.get(get_key(namespace, name))
+
+    def by_locust(self, namespace: str, locust_name: str) -> list:
+        with self._lock:
+            return [
+                self._objects[key]
+                for key in self._by_locust.get(get_key(namespace, locust_name), ())
+            ]
+
+    def list(self, namespace: str = None) -> list:
+        with self._lock:
+            if namespace is None:
+                return list(self._objects.values())
+            return [
+                obj
+                for key, obj in self._objects.items()
+                if key.startswith(f"{namespace}/")
+            ]
+
+
+# List then watch one kind of object, keep its Store up to date and call the handlers on each event
+class Informer:
+    api_exception = client.exceptions.ApiException
+
+    def __init__(
+        self,
+        store: Store,
+        list_func: Callable,
+        *args,
+        scope: str = None,
+        transform: Callable = None,
+        **kwargs,
+    ):
+        # scope is the watched namespace, None when watching all namespaces
+        self.scope = scope
+        # Applied to every listed and watched object before it is stored
+        self.transform = transform
+        # Set by use_fast_decode: the responses are read raw and their objects passed
+        # to decode instead of being deserialized into the client models
+        self.decode = None
+        self.store = store
+        self.store.add_scope(scope)
+        self.list_func = list_func
+        self.args = args
+        self.kwargs = kwargs
+        self.handlers = []
+
+    def add_handler(self, handler: Callable):
+        self.handlers.append(handler)
+
+    def dispatch(self, operation: str, obj):
+        for handler in self.handlers:
+            try:
+                handler(operation, obj)
+            except Exception:
+                log.exception(
+                    f"Handle {operation} on {self.store.kind} object {get_name(obj)} exception"
+                )
+
+    def get_objects(self, response) -> [list, str]:
+        objects, resource_version = get_items(response)
+        if self.decode:
+            objects = [self.decode(obj) for obj in objects]
+        if self.transform:
+            objects = [self.transform(obj) for obj in objects]
+        return objects, resource_version
+
+    def get_list(self, data: bytes) -> dict:
+        response = loads(data)
+        # Unlike the watched objects, the items of a list have no kind
+        for item in response.get("items") or []:
+            item.setdefault("kind", self.store.kind)
+        return response
+
+    def decode_event(self, line) -> dict:
+        event = loads(line)
+        obj = event["object"]
+        if event["type"] == "ERROR":
+            raise self.api_exception(status=obj.get("code"), reason=obj.get("reason"))
+        event["raw_object"] = obj
+        if event["type"] != "BOOKMARK":
+            event["object"] = self.decode(obj)
+        return event
+
+    def list(self) -> [list, str]:
+        if self.decode:
+            raw = self.list_func(*self.args, _preload_content=False, **self.kwargs)
+            response = self.get_list(raw.data)
+        else:
+            response = self.list_func(*self.args, **self.kwargs)
+        return self.get_objects(response)
+
+    def sync(self, objects: list):
+        known = {}
+        if self.store.synced.is_set():
+            known = {
+                get_key(get_namespace(obj), get_name(obj)): obj
+                for obj in self.store.list(self.scope)
+            }
+        self.store.replace(objects, self.scope)
+        # Only replay what changed since the last known state
+        for obj in objects:
+            old = known.pop(get_key(get_namespace(obj), get_name(obj)), None)
+            if old is None:
+                self.dispatch("ADDED", obj)
+            elif get_resource_version(old) != get_resource_version(obj):
+                self.dispatch("MODIFIED", obj)
+        for obj in known.values():
+            self.dispatch("DELETED", obj)
+
+    def handle(self, event: dict) -> str:
+        operation = event.get("type")
+        if operation == "BOOKMARK":
+            return event["raw_object"]["metadata"]["resourceVersion"]
+        obj = event.get("object")
+        if self.transform:
+            obj = self.transform(obj)
+        if operation == "DELETED":
+            self.store.delete(obj)
+        else:
+            self.store.upsert(obj)
+        self.dispatch(operation, obj)
+        return get_resource_version(obj)
+
+    def relist(self) -> str:
+        objects, resource_version = self.list()
+        self.sync(objects)
+        return resource_version
+
+    def stream(self, resource_version: str):
+        response = self.list_func(
+            *self.args,
+            watch=True,
+            resource_version=resource_version,
+            allow_watch_bookmarks=True,
+            timeout_seconds=WATCH_TIMEOUT_SECONDS,
+            _preload_content=False,
+            **self.kwargs,
+        )
+        try:
+            for line in iter_resp_lines(response):
+                if line:
+                    yield self.decode_event(line)
+        finally:
+            response.close()
+
+    def watch(self, resource_version: str) -> str:
+        if self.decode:
+            stream = self.stream(resource_version)
+        else:
+            stream = watch.Watch().stream(
+                self.list_func,
+                *self.args,
+                resource_version=resource_version,
+                allow_watch_bookmarks=True,
+                timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                **self.kwargs,
+            )
+        for event in stream:
+            resource_version = self.handle(event)
+        return resource_version
+
+    def run(self):
+        log.info(f"Waiting for {self.store.kind} events to come up...")
+        resource_version = None
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = self.relist()
+                # Resume from the last seen resourceVersion when the stream ends
+                resource_version = self.watch(resource_version)
+                COUNTER_WATCH_RESTARTS.labels(
+                    kind=self.store.kind, reason="closed"
+                ).inc()
+            except client.exceptions.ApiException as e:
+                if e.status == HTTP_STATUS_GONE:
+                    log.info(f"Watch on {self.store.kind} expired, relisting")
+                    COUNTER_WATCH_RESTARTS.labels(
+                        kind=self.store.kind, reason="expired"
+                    ).inc()
+                    resource_version = None
+                else:
+                    log.warning(f"Watch on {self.store.kind} exception: {e.reason}")
+                    COUNTER_WATCH_RESTARTS.labels(
+                        kind=self.store.kind, reason="error"
+                    ).inc()
+                    time.sleep(WATCH_RETRY_SECONDS)
+            except Exception:
+                log.exception(f"Watch on {self.store.kind} exception")
+                COUNTER_WATCH_RESTARTS.labels(
+                    kind=self.store.kind, reason="error"
+                ).inc()
+                time.sleep(WATCH_RETRY_SECONDS)
+
+
+def start_informer(informer: Informer) -> threading.Thread:
+    t = threading.Thread(target=informer.run, name=informer.store.kind)
+    t.daemon = True
+    t.start()
+    return t
+
+
+def run_informers(informers: list):
+    threads = [start_informer(informer) for informer in informers]
+    for t in threads:
+        t.join()
+
+
+LOCUST_STORE = Store("Locust", index=get_name)
+JOB_STORE = Store("Job")
+REPLICA_SET_STORE = Store("ReplicaSet")
+SERVICE_STORE = Store("Service")
+CRONJOB_STORE = Store("CronJob")
+STORES = [LOCUST_STORE, JOB_STORE, REPLICA_SET_STORE, SERVICE_STORE, CRONJOB_STORE]
+
+
+def wait_for_sync(timeout: float = None) -> bool:
+    return all(store.synced.wait(timeout) for store in STORES)
+
+
+def use_fast_decode(informers: dict):
+    for kind, kind_informers in informers.items():
+        for informer in kind_informers:
+            # The custom objects are plain dicts in both cases
+            informer.decode = dict if kind == "Locust" else View
+
+
+def get_apis() -> dict:
+    return {
+        "custom": get_custom_api(),
+        "batch": get_batch_api(),
+        "apps": get_apps_api(),
+        "metadata_core": get_metadata_api(client.CoreV1Api),
+    }
+
+
+def create_informers(
+    group: str,
+    version: str,
+    namespaces: list,
+    plural: str,
+    informer_class: type = Informer,
+    apis: dict = None,
+) -> dict:
+    # The API groups listing and watching each kind, see get_apis, those of the sync
+    # client by default
+    apis = apis or get_apis()
+    custom_api = apis["custom"]
+    batch_api = apis["batch"]
+    apps_api = apis["apps"]
+    metadata_core_api = apis["metadata_core"]
+    if namespaces == ["*"]:
+        # One watch per kind for the whole cluster
+        return {
+            "Locust": [
+                informer_class(
+                    LOCUST_STORE,
+                    custom_api.list_cluster_custom_object,
+                    group,
+                    version,
+                    plural,
+                )
+            ],
+            "Job": [
+                informer_class(
+                    JOB_STORE,
+                    batch_api.list_job_for_all_namespaces,
+                    label_selector=JOB_SELECTOR,
+                    transform=trim_job,
+                )
+            ],
+            "ReplicaSet": [
+                informer_class(
+                    REPLICA_SET_STORE,
+                    apps_api.list_replica_set_for_all_namespaces,
+                    label_selector="locust",
+                    transform=trim_replica_set,
+                )
+            ],
+            "Service": [
+                informer_class(
+                    SERVICE_STORE,
+                    metadata_core_api.list_service_for_all_namespaces,
+                    label_selector="locust",
+                )
+            ],
+            "CronJob": [
+                informer_class(
+                    CRONJOB_STORE,
+                    batch_api.list_cron_job_for_all_namespaces,
+                    label_selector="locust",
+                    transform=trim_cronjob,
+                )
+            ],
+        }
+    return {
+        "Locust": [
+            informer_class(
+                LOCUST_STORE,
+                custom_api.list_namespaced_custom_object,
+                group,
+                version,
+                namespace,
+                plural,
+                scope=namespace,
+            )
+            for namespace in namespaces
+        ],
+        "Job": [
+            informer_class(
+                JOB_STORE,
+                batch_api.list_namespaced_job,
+                namespace,
+                label_selector=JOB_SELECTOR,
+                scope=namespace,
+                transform=trim_job,
+            )
+            for namespace in namespaces
+        ],
+        "ReplicaSet": [
+            informer_class(
+                REPLICA_SET_STORE,
+                apps_api.list_namespaced_replica_set,
+                namespace,
+                label_selector="locust",
+                scope=namespace,
+                transform=trim_replica_set,
+            )
+            for namespace in namespaces
+        ],
+        "Service": [
+            informer_class(
+                SERVICE_STORE,
+                metadata_core_api.list_namespaced_service,
+                namespace,
+                label_selector="locust",
+                scope=namespace,
+            )
+            for namespace in namespaces
+        ],
+        "CronJob": [
+            informer_class(
+                CRONJOB_STORE,
+                batch_api.list_namespaced_cron_job,
+                namespace,
+                label_selector="locust",
+                scope=namespace,
+                transform=trim_cronjob,
+            )
+            for namespace in namespaces
+        ],
+    }
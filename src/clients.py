@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import re
+import socket
+import sys
+import time
+from functools import lru_cache
+
+from kubernetes import client
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import HTTPError
+
+from src.constants import (
+    API_POOL_SIZE,
+    GAUGE_API_POOL_SIZE,
+    GAUGE_API_POOL_IN_USE,
+    GAUGE_API_POOL_IDLE,
+    GAUGE_API_POOL_CONNECTIONS,
+    HISTOGRAM_API_SECONDS,
+    COUNTER_API_ERRORS,
+    API_QPS,
+    API_BURST,
+    API_RETRIES,
+    API_RETRY_BASE_SECONDS,
+    API_RETRY_MAX_SECONDS,
+)
+from src.ratelimit import TokenBucket, get_backoff
+
+log = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Shared by every write of the sync and asyncio clients, see set_write_limit
+_write_limiter = TokenBucket(API_QPS, API_BURST)
+
+# Lists and watches answered with the metadata of the objects only, or with the full
+# objects by API servers without the PartialObjectMetadata transformation
+METADATA_ACCEPT = "application/json;as={kind};g=meta.k8s.io;v=v1,application/json"
+API_PATH = re.compile(
+    r"/(?:api/v1|apis/[^/]+/[^/]+)(?:/namespaces/[^/]+)?/(?P<resource>[^/?]+)"
+    r"(?:/(?P<name>[^/?]+)(?:/(?P<subresource>[^/?]+))?)?"
+)
+
+
+def get_socket_options() -> list:
+    options = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+        ]
+    return options
+
+
+# Must be called after the kubeconfig is loaded, the client is shared by every API group
+@lru_cache(maxsize=None)
+def get_api_client() -> client.ApiClient:
+    configuration = client.Configuration.get_default_copy()
+    # Watches hold a connection each, the pool must be larger than the concurrent calls
+    # or urllib3 opens (and handshakes) a throwaway connection for every extra call
+    configuration.connection_pool_maxsize = API_POOL_SIZE
+    configuration.socket_options = get_socket_options()
+    api_client = client.ApiClient(configuration)
+    # In the asyncio mode the calls go through the pools of the asyncio clients, this
+    # one only serializes the bodies
+    if not _event_loop:
+        register_pool_metrics(api_client, "main")
+    instrument_rest_client(api_client.rest_client)
+    return api_client
+
+
+# For the informers of the kinds the operator only needs the names, labels, annotations
+# and owners of, its own pool keeps their watches apart from the other calls
+@lru_cache(maxsize=None)
+def get_metadata_api_client() -> client.ApiClient:
+    configuration = get_api_client().configuration
+    api_client = client.ApiClient(configuration)
+    request_metadata_only(api_client.rest_client)
+    register_pool_metrics(api_client, "metadata")
+    instrument_rest_client(api_client.rest_client)
+    return api_client
+
+
+@lru_cache(maxsize=None)
+def get_metadata_api(api_class: type):
+    return api_class(get_metadata_api_client())
+
+
+# Set by use_event_loop in the asyncio mode: the asyncio client and its event loop
+_event_loop = None
+
+
+# An API group of the asyncio client, called from the threads of the asyncio mode: each
+# call runs as a coroutine on the event loop and the thread waits for its result, so the
+# handlers and helpers are the same in both modes. Never called from the event loop
+# itself, the call would wait for itself
+class LoopApi:
+    def __init__(self, api, loop: asyncio.AbstractEventLoop):
+        from kubernetes_asyncio.client.exceptions import ApiException
+
+        self._api = api
+        self._loop = loop
+        self._api_exception = ApiException
+
+    def __getattr__(self, attribute: str):
+        method = getattr(self._api, attribute)
+
+        def call(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(
+                method(*args, **kwargs), self._loop
+            )
+            try:
+                return future.result()
+            except self._api_exception as e:
+                # The callers catch the exceptions of the sync client
+                error = client.exceptions.ApiException(status=e.status, reason=e.reason)
+                error.body, error.headers = e.body, e.headers
+                raise error from e
+
+        return call
+
+
+def use_event_loop(api_client, loop: asyncio.AbstractEventLoop):
+    # The API getters return the groups of api_client from then on
+    global _event_loop
+    _event_loop = (api_client, loop)
+    for getter in API_GETTERS:
+        getter.cache_clear()
+
+
+def get_api(api_class: str):
+    if _event_loop:
+        from kubernetes_asyncio import client as async_client
+
+        api_client, loop = _event_loop
+        return LoopApi(getattr(async_client, api_class)(api_client), loop)
+    return getattr(client, api_class)(get_api_client())
+
+
+# The client imports an API group on first use, the annotations are quoted so that only
+# the groups a role calls are imported, when it calls them
+@lru_cache(maxsize=None)
+def get_core_api() -> "client.CoreV1Api":
+    return get_api("CoreV1Api")
+
+
+@lru_cache(maxsize=None)
+def get_batch_api() -> "client.BatchV1Api":
+    return get_api("BatchV1Api")
+
+
+@lru_cache(maxsize=None)
+def get_apps_api() -> "client.AppsV1Api":
+    return get_api("AppsV1Api")
+
+
+@lru_cache(maxsize=None)
+def get_coordination_api() -> "client.CoordinationV1Api":
+    return get_api("CoordinationV1Api")
+
+
+@lru_cache(maxsize=None)
+def get_custom_api() -> "client.CustomObjectsApi":
+    return get_api("CustomObjectsApi")
+
+
+API_GETTERS = [
+    get_core_api,
+    get_batch_api,
+    get_apps_api,
+    get_coordination_api,
+    get_custom_api,
+]
+
+
+def get_pools(api_client: client.ApiClient) -> list:
+    pools = api_client.rest_client.pool_manager.pools
+    return [pools[key] for key in pools.keys()]
+
+
+def register_pool_metrics(api_client: client.ApiClient, name: str):
+    def pool_size():
+        return sum(pool.pool.maxsize for pool in get_pools(api_client) if pool.pool)
+
+    def in_use():
+        return sum(
+            pool.pool.maxsize - pool.pool.qsize()
+            for pool in get_pools(api_client)
+            if pool.pool
+        )
+
+    def idle():
+        return sum(
+            sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            for pool in get_pools(api_client)
+            if pool.pool
+        )
+
+    def connections():
+        return sum(pool.num_connections for pool in get_pools(api_client))
+
+    GAUGE_API_POOL_SIZE.labels(client=name).set_function(pool_size)
+    GAUGE_API_POOL_IN_USE.labels(client=name).set_function(in_use)
+    GAUGE_API_POOL_IDLE.labels(client=name).set_function(idle)
+    GAUGE_API_POOL_CONNECTIONS.labels(client=name).set_function(connections)
+
+
+def register_async_pool_metrics(rest_client, name: str):
+    # The same gauges for the aiohttp connector of an asyncio client
+    import aiohttp
+
+    session = rest_client.pool_manager
+    connector = session.connector
+    opened = [0]
+
+    async def on_connection_create_end(*_):
+        opened[0] += 1
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.freeze()
+    session.trace_configs.append(trace_config)
+    GAUGE_API_POOL_SIZE.labels(client=name).set_function(lambda: connector.limit)
+    GAUGE_API_POOL_IN_USE.labels(client=name).set_function(
+        lambda: len(connector._acquired)
+    )
+    GAUGE_API_POOL_IDLE.labels(client=name).set_function(
+        lambda: sum(len(conns) for conns in list(connector._conns.values()))
+    )
+    GAUGE_API_POOL_CONNECTIONS.labels(client=name).set_function(lambda: opened[0])
+
+
+def get_api_labels(method: str, url: str, query_params=None) -> [str, str]:
+    match = API_PATH.search(url)
+    if not match:
+        return method.lower(), "other"
+    resource = match["resource"]
+    if match["subresource"]:
+        resource = f"{resource}/{match['subresource']}"
+    watch = "watch=true" in url.lower() or ("watch", True) in (query_params or [])
+    verbs = {
+        "GET": "watch" if watch else "get" if match["name"] else "list",
+        "POST": "create",
+        "PUT": "replace",
+        "PATCH": "patch",
+        "DELETE": "delete" if match["name"] else "deletecollection",
+    }
+    return verbs.get(method, method.lower()), resource
+
+
+def observe_api_call(verb: str, resource: str, started: float, error: str = None):
+    HISTOGRAM_API_SECONDS.labels(verb=verb, resource=resource).observe(
+        time.monotonic() - started
+    )
+    if error:
+        COUNTER_API_ERRORS.labels(verb=verb, resource=resource, code=error).inc()
+
+
+def get_error(status: int) -> str:
+    # HTTP status of the errors, "connection" when the API server was not reached
+    if not status:
+        return "connection"
+    return str(status) if status >= 400 else None
+
+
+def get_connection_errors() -> tuple:
+    # aiohttp is only imported by the asyncio mode, its errors cannot happen otherwise
+    aiohttp = sys.modules.get("aiohttp")
+    return (HTTPError, asyncio.TimeoutError) + (
+        (aiohttp.ClientError,) if aiohttp else ()
+    )
+
+
+def is_retryable(error: Exception = None, status: int = None) -> bool:
+    # Throttled, failed on the server side or not answered, the object helpers raise
+    # these once the retries are exhausted so that the reconcile is requeued
+    if error is not None:
+        if isinstance(error, get_connection_errors()):
+            return True
+        status = getattr(error, "status", None)
+    return status == 0 or status in RETRYABLE_STATUSES
+
+
+def get_retry_delay(response, failures: int) -> float:
+    retry_after = (getattr(response, "headers", None) or {}).get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), API_RETRY_MAX_SECONDS)
+    return get_backoff(failures, API_RETRY_BASE_SECONDS, API_RETRY_MAX_SECONDS)
+
+
+def set_write_limit(qps: float, burst: int):
+    global _write_limiter
+    _write_limiter = TokenBucket(qps, burst)
+
+
+def request_metadata_only(rest_client):
+    # Lists return a PartialObjectMetadataList, watches PartialObjectMetadata events.
+    # Works for both clients, the coroutine of the asyncio one is returned as is
+    request = rest_client.request
+
+    def metadata_only(method, url, *args, **kwargs):
+        verb, _ = get_api_labels(method, url, kwargs.get("query_params"))
+        kind = (
+            "PartialObjectMetadataList" if verb == "list" else "PartialObjectMetadata"
+        )
+        kwargs["headers"] = {
+            **(kwargs.get("headers") or {}),
+            "Accept": METADATA_ACCEPT.format(kind=kind),
+        }
+        return request(method, url, *args, **kwargs)
+
+    rest_client.request = metadata_only
+
+
+def instrument_rest_client(rest_client):
+    # Every call of every API group goes through rest_client.request: writes are rate
+    # limited, throttled and failed calls are retried with backoff
+    request = rest_client.request
+
+    def instrumented(method, url, *args, **kwargs):
+        verb, resource = get_api_labels(method, url, kwargs.get("query_params"))
+        for failures in range(API_RETRIES + 1):
+            if method in WRITE_METHODS:
+                _write_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = request(method, url, *args, **kwargs)
+                error = None
+            except Exception as e:
+                response = error = e
+            status = getattr(response, "status", 0)
+            observe_api_call(verb, resource, started, get_error(status))
+            # The informers restart their watches themselves
+            if verb == "watch" or not is_retryable(error, status):
+                break
+            if failures < API_RETRIES:
+                delay = get_retry_delay(response, failures)
+                log.info(f"Retry {verb} {resource} in {delay:.1f}s after {status}")
+                time.sleep(delay)
+        if error:
+            raise error
+        return response
+
+    rest_client.request = instrumented
+
+
+def instrument_async_rest_client(rest_client):
+    request = rest_client.request
+
+    async def instrumented(method, url, *args, **kwargs):
+        verb, resource = get_api_labels(method, url, kwargs.get("query_params"))
+        for failures in range(API_RETRIES + 1):
+            if method in WRITE_METHODS:
+                await asyncio.sleep(_write_limiter.reserve())
+            started = time.monotonic()
+            try:
+                response = await request(method, url, *args, **kwargs)
+                error = None
+            except Exception as e:
+                response = error = e
+            status = getattr(response, "status", 0)
+            observe_api_call(verb, resource, started, get_error(status))
+            if verb == "watch" or not is_retryable(error, status):
+                break
+            if failures < API_RETRIES:
+                delay = get_retry_delay(response, failures)
+                log.info(f"Retry {verb} {resource} in {delay:.1f}s after {status}")
+                await asyncio.sleep(delay)
+        if error:
+            raise error
+        return response
+
+    rest_client.request = instrumented
@@ -1,33 +1,199 @@
 import os
+import socket
 
-from prometheus_client import Gauge, Enum
+from prometheus_client import Counter, Gauge, Enum, Histogram
 
 CRD_GROUP = "locust-qa.xyz"
 CRD_VERSION = "v1"
 CRD_PLURAL = "locusts"
 CRD_NAME = "Locust"
 NAMESPACE = os.getenv("NAMESPACE", "locust")
+# Comma separated list of namespaces, or * for the whole cluster
+WATCH_NAMESPACES = os.getenv("WATCH_NAMESPACES", NAMESPACE).split(",")
+POD_NAME = os.getenv("POD_NAME", socket.gethostname())
+SPEC_HASH_ANNOTATION = f"{CRD_GROUP}/spec-hash"
+# Part of the spec hash, bump it when the operator renders the objects differently, e.g.
+# new Locust flags, so that the CronJobs and ReplicaSets already created are updated
+TEMPLATE_VERSION = 2
+SPEC_CACHE_SIZE = 1024
+TEMPLATE_CACHE_SIZE = 256
+HTTP_STATUS_NOT_FOUND = 404
+HTTP_STATUS_CONFLICT = 409
+HTTP_STATUS_GONE = 410
 PREFIX_STATS = "locust_operator"
 GAUGE_LOCUST_OBJECT = Gauge(
     f"{PREFIX_STATS}_locust_object_gauge",
     "Gauge Locust object",
-    labelnames=["operation", "name"],
+    labelnames=["namespace", "name", "operation"],
 )
 ENUM_LOCUST_OBJECT_STATE = Enum(
     f"{PREFIX_STATS}_locust_object_state",
     "State of Locust object",
     states=["starting", "running", "stopped"],
-    labelnames=["name"],
+    labelnames=["namespace", "name"],
 )
 GAUGE_JOB_OBJECT = Gauge(
     f"{PREFIX_STATS}_job_object_gauge",
     "Gauge Job object",
-    labelnames=["operation", "name", "job_name"],
+    labelnames=["namespace", "name", "job_name", "operation"],
 )
 ENUM_JOB_OBJECT_STATE = Enum(
     f"{PREFIX_STATS}_job_object_state",
     "State of Job object",
     states=["starting", "running", "stopped"],
-    labelnames=["name", "job_name", "status"],
+    labelnames=["namespace", "name", "job_name", "status"],
 )
 ADDITIONAL_ACTIVE_DEADLINE_MINUTES = 5
+WATCH_TIMEOUT_SECONDS = int(os.getenv("WATCH_TIMEOUT_SECONDS", 300))
+WATCH_RETRY_SECONDS = 5
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", 4))
+RECONCILE_QPS = float(os.getenv("RECONCILE_QPS", 20))
+RECONCILE_BURST = int(os.getenv("RECONCILE_BURST", 50))
+# Failed reconciles of a Locust object retried before its events are dropped, until the
+# next event or resync
+RECONCILE_MAX_REQUEUES = int(os.getenv("RECONCILE_MAX_REQUEUES", 10))
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", 32))
+# Writes to the API server per second, shared by all the threads and coroutines
+API_QPS = float(os.getenv("API_QPS", 50))
+API_BURST = int(os.getenv("API_BURST", 100))
+# Retries of a call answered 429 or 5xx, or without an answer, before it fails
+API_RETRIES = int(os.getenv("API_RETRIES", 4))
+API_RETRY_BASE_SECONDS = 0.5
+API_RETRY_MAX_SECONDS = 30
+GAUGE_API_POOL_SIZE = Gauge(
+    f"{PREFIX_STATS}_api_pool_size",
+    "Maximum number of kept-alive connections to the API server",
+    labelnames=["client"],
+)
+GAUGE_API_POOL_IN_USE = Gauge(
+    f"{PREFIX_STATS}_api_pool_in_use",
+    "Connections to the API server currently used by a request or a watch",
+    labelnames=["client"],
+)
+GAUGE_API_POOL_IDLE = Gauge(
+    f"{PREFIX_STATS}_api_pool_idle",
+    "Kept-alive connections to the API server waiting for a request",
+    labelnames=["client"],
+)
+GAUGE_API_POOL_CONNECTIONS = Gauge(
+    f"{PREFIX_STATS}_api_pool_connections",
+    "Connections opened to the API server since the start",
+    labelnames=["client"],
+)
+SHARD_LEASE_LABEL = f"{CRD_GROUP}/shard"
+SHARD_LEASE_SECONDS = 15
+SHARD_RENEW_SECONDS = 5
+SHARD_VIRTUAL_NODES = 64
+# The Leases of the replicas gone for this many lease durations are deleted, pod names
+# change on every rollout
+SHARD_LEASE_GC_DURATIONS = 4
+GAUGE_SHARD_MEMBERS = Gauge(
+    f"{PREFIX_STATS}_shard_members",
+    "Operator replicas sharing the Locust objects",
+)
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", 15))
+LEADER_RENEW_SECONDS = 2
+GAUGE_LEADER = Gauge(
+    f"{PREFIX_STATS}_leader",
+    "1 when this replica is the leader, 0 when it is a standby",
+)
+GAUGE_LEADER_FAILOVER_SECONDS = Gauge(
+    f"{PREFIX_STATS}_leader_failover_seconds",
+    "Time between the last renewal of the previous leader and the takeover",
+)
+GAUGE_STARTUP_SECONDS = Gauge(
+    f"{PREFIX_STATS}_startup_seconds",
+    "Time from the start of the process to the caches synced and the operator ready",
+)
+AUTOSCALE_INTERVAL_SECONDS = int(os.getenv("AUTOSCALE_INTERVAL_SECONDS", 15))
+# Scale down only when every recommendation of this window agrees
+AUTOSCALE_DOWNSCALE_SECONDS = int(os.getenv("AUTOSCALE_DOWNSCALE_SECONDS", 60))
+AUTOSCALE_TOLERANCE = 0.1
+LOCUST_WEB_PORT = 8089
+# The master serves its final stats this long after the end of the run, then quits
+LOCUST_AUTOQUIT_SECONDS = int(os.getenv("LOCUST_AUTOQUIT_SECONDS", 10))
+# Time a finished Locust object is kept with its final status before it is deleted
+LOCUST_DELETE_DELAY_SECONDS = float(os.getenv("LOCUST_DELETE_DELAY_SECONDS", 30))
+GAUGE_AUTOSCALE_WORKERS = Gauge(
+    f"{PREFIX_STATS}_autoscale_workers",
+    "Workers recommended by the autoscaler",
+    labelnames=["namespace", "name"],
+)
+GAUGE_AUTOSCALE_WORKER_CPU = Gauge(
+    f"{PREFIX_STATS}_autoscale_worker_cpu",
+    "Mean CPU usage of the workers in percent of one core",
+    labelnames=["namespace", "name"],
+)
+# First Locust version with --processes
+MIN_PROCESSES_VERSION = (2, 17)
+GAUGE_WORKER_PROCESSES = Gauge(
+    f"{PREFIX_STATS}_worker_processes",
+    "Worker processes connected to the master, with several processes per worker pod",
+    labelnames=["namespace", "name"],
+)
+GAUGE_DEGRADED_WORKERS = Gauge(
+    f"{PREFIX_STATS}_degraded_workers",
+    "Worker pods with fewer processes connected to the master than asked",
+    labelnames=["namespace", "name"],
+)
+POOL_LABEL = f"{CRD_GROUP}/pool"
+POOL_IDLE_LABEL = f"{CRD_GROUP}/idle-pool"
+POOL_CLAIM_ANNOTATION = f"{CRD_GROUP}/claimed-by"
+POOL_RELEASE_ANNOTATION = f"{CRD_GROUP}/released-at"
+# Idle pools are deleted after this time without a run
+WORKER_POOL_TTL_SECONDS = int(os.getenv("WORKER_POOL_TTL_SECONDS", 1800))
+WORKER_POOL_REAP_SECONDS = 60
+HISTOGRAM_CREATE_STEP_SECONDS = Histogram(
+    f"{PREFIX_STATS}_create_step_seconds",
+    "Duration of each step creating the objects of a run",
+    labelnames=["step"],
+)
+# Directory where the stats of the runs are streamed, the collector is off without it
+RESULTS_DIR = os.getenv("RESULTS_DIR")
+RESULTS_INTERVAL_SECONDS = int(os.getenv("RESULTS_INTERVAL_SECONDS", 5))
+# Time window of the response time histograms of the results
+RESULTS_WINDOW_SECONDS = int(os.getenv("RESULTS_WINDOW_SECONDS", 60))
+HISTOGRAM_RECONCILE_SECONDS = Histogram(
+    f"{PREFIX_STATS}_reconcile_seconds",
+    "Time from the reception of an event to the end of its handling",
+    labelnames=["kind", "operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+HISTOGRAM_API_SECONDS = Histogram(
+    f"{PREFIX_STATS}_api_seconds",
+    "Duration of the calls to the API server, until the headers for the watches",
+    labelnames=["verb", "resource"],
+)
+COUNTER_API_ERRORS = Counter(
+    f"{PREFIX_STATS}_api_errors",
+    "Calls to the API server answered with an error",
+    labelnames=["verb", "resource", "code"],
+)
+COUNTER_WATCH_RESTARTS = Counter(
+    f"{PREFIX_STATS}_watch_restarts",
+    "Watches started again, after a timeout (closed), an expired resourceVersion or an error",
+    labelnames=["kind", "reason"],
+)
+GAUGE_QUEUE_DEPTH = Gauge(
+    f"{PREFIX_STATS}_queue_depth",
+    "Locust objects with events waiting to be reconciled",
+)
+HISTOGRAM_TIME_TO_WORKERS_SECONDS = Histogram(
+    f"{PREFIX_STATS}_time_to_workers_seconds",
+    "Time from the start of a run to all its worker pods ready",
+    buckets=(1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600),
+)
+# Series of the finished runs are dropped after this time, or beyond the last runs of
+# each Locust object (0 for no limit)
+METRICS_RETENTION_SECONDS = int(os.getenv("METRICS_RETENTION_SECONDS", 3600))
+METRICS_RETENTION_RUNS = int(os.getenv("METRICS_RETENTION_RUNS", 10))
+METRICS_EXPIRY_INTERVAL_SECONDS = 60
+GAUGE_METRIC_SERIES = Gauge(
+    f"{PREFIX_STATS}_metric_series",
+    "Label sets kept by the metrics labelled per Locust object or run",
+    labelnames=["metric"],
+)
+# Status changes of a Locust object are written at most once per interval
+STATUS_INTERVAL_SECONDS = float(os.getenv("STATUS_INTERVAL_SECONDS", 5))
+STATUS_QPS = float(os.getenv("STATUS_QPS", 10))
+STATUS_BURST = 20
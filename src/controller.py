@@ -1,11 +1,27 @@
+import hashlib
+import json
 import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 
 from kubernetes import client
 
+from src.clients import get_custom_api
+from src.constants import (
+    MIN_PROCESSES_VERSION,
+    SPEC_HASH_ANNOTATION,
+    SPEC_CACHE_SIZE,
+    TEMPLATE_VERSION,
+)
+
 log = logging.getLogger(__name__)
 
 
 def process_spec(spec: dict) -> dict:
+    # Work on a copy, the spec may be shared with the Locust store
+    spec = dict(spec)
     if "workers" not in spec:
         spec["workers"] = 1
     if "image" not in spec:
@@ -28,14 +44,193 @@ def process_spec(spec: dict) -> dict:
         spec["runTime"] = "5m"
     if "schedule" not in spec:
         spec["schedule"] = ""
+    if "autoscaling" not in spec:
+        spec["autoscaling"] = None
+    if "workerPool" not in spec:
+        spec["workerPool"] = False
+    if "processes" not in spec:
+        spec["processes"] = 1
+    return spec
+
+
+# Added after the first release, left out of the hash when unset: a new field does not
+# change the manifests of the existing Locust objects, a TEMPLATE_VERSION bump does
+OPTIONAL_FIELDS = ("autoscaling", "workerPool", "processes")
+
+
+def get_spec_hash(spec: dict) -> str:
+    # spec must be the output of process_spec, so defaults do not change the hash
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()[:16]
+
+
+def get_pool_name(spec: dict) -> str:
+    # Workers can be shared by the runs with the same image and locustfile config
+    pool_spec = {
+        key: spec[key]
+        for key in (
+            "image",
+            "imagePullSecret",
+            "command",
+            "configMapRef",
+            "secretRef",
+            "mountExternalConfig",
+            "mountExternalSecret",
+        )
+    }
+    # Pods running several processes make another pool, the existing pools keep their name
+    if spec["processes"] != 1:
+        pool_spec["processes"] = spec["processes"]
+    return f"locust-pool-{get_spec_hash(pool_spec)}"
+
+
+def get_image_version(image: str) -> tuple:
+    # (major, minor) of a tag like 2.8.5, None for latest, a digest or a custom tag
+    tag = image.rsplit("/", 1)[-1].partition("@")[0].partition(":")[2]
+    match = re.match(r"(\d+)\.(\d+)", tag)
+    return (int(match[1]), int(match[2])) if match else None
+
+
+def get_processes(spec: dict) -> int:
+    # Older images fail on --processes, their workers run one process
+    version = get_image_version(spec["image"])
+    if spec["processes"] > 1 and version and version < MIN_PROCESSES_VERSION:
+        log.warning(
+            f"processes ignored, image {spec['image']} is older than Locust "
+            f"{'.'.join(map(str, MIN_PROCESSES_VERSION))}"
+        )
+        return 1
+    return spec["processes"]
+
+
+@dataclass(frozen=True, slots=True)
+class Autoscaling:
+    min_workers: int
+    max_workers: int
+    # Percent of the one core a Locust worker process can use
+    target_cpu: int
+    users_per_worker: int
+    rps_per_worker: float
+
+    @classmethod
+    def from_dict(cls, autoscaling: dict, workers: int) -> "Autoscaling":
+        min_workers = autoscaling.get("minWorkers", 1)
+        return cls(
+            min_workers=min_workers,
+            max_workers=max(autoscaling.get("maxWorkers", workers), min_workers),
+            target_cpu=autoscaling.get("targetCpu", 75),
+            users_per_worker=autoscaling.get("usersPerWorker"),
+            rps_per_worker=autoscaling.get("rpsPerWorker"),
+        )
+
+    def clamp(self, workers: int) -> int:
+        return min(max(workers, self.min_workers), self.max_workers)
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class LocustSpec:
+    workers: int
+    image: str
+    image_pull_secret: str
+    command: tuple
+    configmap: str
+    secret: str
+    mount_external_config: dict
+    mount_external_secret: dict
+    run_time: str
+    schedule: str
+    autoscaling: Autoscaling
+    worker_pool: str
+    # Locust worker processes per worker pod
+    processes: int
+    spec_hash: str
+
+    # Two specs rendering the same manifests are the same spec
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LocustSpec) and self.spec_hash == other.spec_hash
+
+    def __hash__(self) -> int:
+        return hash(self.spec_hash)
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "LocustSpec":
+        unset = [key for key in OPTIONAL_FIELDS if key not in spec]
+        spec = process_spec(spec)
+        spec["processes"] = get_processes(spec)
+        autoscaling = None
+        workers = spec["workers"]
+        if spec["autoscaling"]:
+            autoscaling = Autoscaling.from_dict(spec["autoscaling"], workers)
+            # Start within the bounds, the autoscaler takes over during the run
+            workers = autoscaling.clamp(workers)
+        return cls(
+            workers=workers,
+            image=spec["image"],
+            image_pull_secret=spec["imagePullSecret"],
+            command=tuple(spec["command"]) if spec["command"] else None,
+            configmap=spec["configMapRef"],
+            secret=spec["secretRef"],
+            mount_external_config=spec["mountExternalConfig"],
+            mount_external_secret=spec["mountExternalSecret"],
+            run_time=spec["runTime"],
+            schedule=spec["schedule"],
+            autoscaling=autoscaling,
+            worker_pool=get_pool_name(spec) if spec["workerPool"] else None,
+            processes=spec["processes"],
+            spec_hash=get_spec_hash(
+                {
+                    **{key: value for key, value in spec.items() if key not in unset},
+                    "templateVersion": TEMPLATE_VERSION,
+                }
+            ),
+        )
+
+
+_specs = OrderedDict()
+_specs_lock = threading.Lock()
+
+
+def get_locust_spec(obj: dict) -> LocustSpec:
+    # Parsed once per resourceVersion of the Locust object, the least recently used
+    # are dropped
+    metadata = obj["metadata"]
+    key = (metadata.get("uid") or metadata["name"], metadata.get("resourceVersion"))
+    with _specs_lock:
+        spec = _specs.get(key)
+        if spec is not None:
+            _specs.move_to_end(key)
+    if spec is None:
+        if not obj.get("spec"):
+            return None
+        spec = LocustSpec.from_dict(obj["spec"])
+        with _specs_lock:
+            _specs[key] = spec
+            if len(_specs) > SPEC_CACHE_SIZE:
+                _specs.popitem(last=False)
     return spec
 
 
-def check_crd(group: str, version: str, namespace: str, plural: str):
-    api_client = client.ApiClient()
-    custom_api = client.CustomObjectsApi(api_client)
+def get_annotation(obj, key: str) -> str:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        annotations = obj["metadata"].get("annotations")
+    else:
+        annotations = obj.metadata.annotations
+    return (annotations or {}).get(key)
+
+
+def is_up_to_date(obj, spec_hash: str) -> bool:
+    return get_annotation(obj, SPEC_HASH_ANNOTATION) == spec_hash
+
+
+def check_crd(group: str, version: str, plural: str):
+    # Discovery of the group version, instead of a list of every Locust object
     try:
-        custom_api.list_namespaced_custom_object(group, version, namespace, plural)
+        resources = get_custom_api().get_api_resources(group, version).resources
     except client.exceptions.ApiException:
+        resources = []
+    if not any(resource.name == plural for resource in resources or []):
         log.critical("Locust CRD not installed")
         exit(1)
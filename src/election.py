@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from kubernetes import client
+
+from src.clients import get_coordination_api
+from src.constants import (
+    HTTP_STATUS_NOT_FOUND,
+    HTTP_STATUS_CONFLICT,
+    LEADER_LEASE_SECONDS,
+    LEADER_RENEW_SECONDS,
+    GAUGE_LEADER,
+    GAUGE_LEADER_FAILOVER_SECONDS,
+)
+
+log = logging.getLogger(__name__)
+
+
+# Only the holder of the Lease reconciles, the standby replicas keep their watches and
+# stores warm to take over as soon as the Lease expires. Same interface as the Sharder,
+# the leader owns every key.
+class LeaderElector:
+    def __init__(self, identity: str, lease_name: str, namespace: str):
+        self.identity = identity
+        self.lease_name = lease_name
+        self.namespace = namespace
+        self.handlers = []
+        self.renewed_at = None
+        # Last record seen from another holder, expiry is measured on our own clock
+        self._observed = None
+        self._observed_at = None
+        # Set on shutdown, the lease is not renewed any more
+        self.released = False
+        self._lock = threading.Lock()
+
+    def add_handler(self, handler: Callable):
+        self.handlers.append(handler)
+
+    def is_leader(self) -> bool:
+        return (
+            self.renewed_at is not None
+            and time.monotonic() - self.renewed_at < LEADER_LEASE_SECONDS
+        )
+
+    def owns(self, key: str) -> bool:
+        return self.is_leader()
+
+    def get_lease_spec(self, now: datetime, transitions: int) -> client.V1LeaseSpec:
+        return client.V1LeaseSpec(
+            holder_identity=self.identity,
+            lease_duration_seconds=LEADER_LEASE_SECONDS,
+            acquire_time=now,
+            renew_time=now,
+            lease_transitions=transitions,
+        )
+
+    def observe(self, lease: client.V1Lease, started: float) -> bool:
+        # True when the other holder has not renewed for a whole lease duration
+        record = (lease.spec.holder_identity, lease.spec.renew_time)
+        if record != self._observed:
+            self._observed = record
+            self._observed_at = started
+        duration = lease.spec.lease_duration_seconds or LEADER_LEASE_SECONDS
+        return not lease.spec.holder_identity or started - self._observed_at > duration
+
+    def try_acquire(self) -> bool:
+        api_instance = get_coordination_api()
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        try:
+            lease = api_instance.read_namespaced_lease(self.lease_name, self.namespace)
+        except client.exceptions.ApiException as e:
+            if e.status != HTTP_STATUS_NOT_FOUND:
+                raise
+            body = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.lease_name),
+                spec=self.get_lease_spec(now, 0),
+            )
+            api_instance.create_namespaced_lease(self.namespace, body)
+            self.renewed_at = started
+            return True
+        if lease.spec.holder_identity == self.identity:
+            lease.spec.renew_time = now
+        elif self.observe(lease, started):
+            previous = lease.spec.renew_time
+            lease.spec = self.get_lease_spec(
+                now, (lease.spec.lease_transitions or 0) + 1
+            )
+            if previous:
+                GAUGE_LEADER_FAILOVER_SECONDS.set((now - previous).total_seconds())
+        else:
+            return False
+        # The resourceVersion of the read makes a concurrent takeover fail with a conflict
+        api_instance.replace_namespaced_lease(self.lease_name, self.namespace, lease)
+        self.renewed_at = started
+        return True
+
+    def clear_holder(self):
+        api_instance = get_coordination_api()
+        try:
+            lease = api_instance.read_namespaced_lease(self.lease_name, self.namespace)
+            if lease.spec.holder_identity != self.identity:
+                return
+            lease.spec.holder_identity = None
+            api_instance.replace_namespaced_lease(
+                self.lease_name, self.namespace, lease
+            )
+            log.info(f"Released the leadership of {self.lease_name}")
+        except client.exceptions.ApiException as e:
+            log.info(f"Release leader lease {self.lease_name} exception: {e.reason}")
+
+    def release(self):
+        # On shutdown: a standby takes over at its next renewal instead of once the
+        # lease expires
+        with self._lock:
+            self.released = True
+            if self.is_leader():
+                self.renewed_at = None
+                GAUGE_LEADER.set(0)
+                self.clear_holder()
+
+    def step(self):
+        was_leader = self.is_leader()
+        try:
+            is_leader = self.try_acquire()
+        except client.exceptions.ApiException as e:
+            if e.status != HTTP_STATUS_CONFLICT:
+                raise
+            log.info(f"Lease {self.lease_name} taken by another replica")
+            is_leader = False
+        if not is_leader:
+            self.renewed_at = None
+        GAUGE_LEADER.set(1 if is_leader else 0)
+        if is_leader and not was_leader:
+            log.info(f"Became the leader of {self.lease_name}, replaying the stores")
+            for handler in self.handlers:
+                handler(self.owns)
+        elif was_leader and not is_leader:
+            log.warning(f"Lost the leadership of {self.lease_name}")
+
+    def run(self):
+        while True:
+            with self._lock:
+                if self.released:
+                    return
+                try:
+                    self.step()
+                except Exception:
+                    log.exception(f"Renew leader lease {self.lease_name} exception")
+            time.sleep(LEADER_RENEW_SECONDS)
@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from prometheus_client import make_wsgi_app
+
+from src.cache import STORES, wait_for_sync
+from src.constants import GAUGE_STARTUP_SECONDS
+
+log = logging.getLogger(__name__)
+
+_imported_at = time.monotonic()
+
+
+def is_ready() -> bool:
+    # Every kind listed once, the handlers see the whole state from then on
+    return all(store.synced.is_set() for store in STORES)
+
+
+def get_uptime() -> float:
+    # Seconds since the start of the process, the imports included, or since the import
+    # of this module where /proc is not available
+    try:
+        with open("/proc/self/stat") as stat:
+            started = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            return float(uptime.read().split()[0]) - started / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+
+def observe_startup():
+    wait_for_sync()
+    seconds = get_uptime()
+    GAUGE_STARTUP_SECONDS.set(seconds)
+    log.info(f"Caches synced, ready {seconds:.2f}s after the start")
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def get_app():
+    metrics = make_wsgi_app()
+
+    def app(environ, start_response):
+        if environ.get("PATH_INFO") != "/readyz":
+            return metrics(environ, start_response)
+        ready = is_ready()
+        start_response(
+            "200 OK" if ready else "503 Service Unavailable",
+            [("Content-Type", "text/plain")],
+        )
+        return [b"ok\n" if ready else b"caches not synced\n"]
+
+    return app
+
+
+def start_metrics_server(port: int):
+    # The metrics of start_http_server, plus /readyz answering 200 once the caches are
+    # synced
+    server = make_server(
+        "", port, get_app(), ThreadingWSGIServer, handler_class=SilentHandler
+    )
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    threading.Thread(target=observe_startup, name="startup", daemon=True).start()
@@ -0,0 +1,95 @@
+import math
+from collections import defaultdict
+
+# Every bucket holds the values within 1% of its center, whatever their magnitude
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Values below, in milliseconds, are counted as zero
+MIN_VALUE = 0.001
+
+
+def get_index(value: float) -> int:
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+
+def get_value(index: int) -> float:
+    # Center of the bucket, at most RELATIVE_ACCURACY away from the values it holds
+    return 2 * GAMMA**index / (GAMMA + 1)
+
+
+# Log-bucketed histogram of response times: two histograms merge by adding their counts,
+# so percentiles over many workers, windows or runs keep the accuracy of one histogram
+class LogHistogram:
+    def __init__(self, bins: dict = None, zero: float = 0):
+        self.bins = defaultdict(float, bins or {})
+        self.zero = zero
+
+    @property
+    def count(self) -> float:
+        return self.zero + sum(self.bins.values())
+
+    def add(self, value: float, count: float = 1):
+        if value < MIN_VALUE:
+            self.zero += count
+        else:
+            self.bins[get_index(value)] += count
+
+    def add_range(self, low: float, high: float, count: float):
+        # Spread count log-uniformly between low and high
+        if high <= low or high < MIN_VALUE:
+            self.add(high, count)
+            return
+        low = max(low, MIN_VALUE)
+        first, last = get_index(low), get_index(high)
+        span = math.log(high) - math.log(low)
+        for index in range(first, last + 1):
+            start = max(math.log(low), (index - 1) * LOG_GAMMA)
+            end = min(math.log(high), index * LOG_GAMMA)
+            if end > start:
+                self.bins[index] += count * (end - start) / span
+
+    def add_anchors(self, count: float, anchors: list):
+        # Rebuild count values from known percentiles, [(0, min), (0.5, median), ...]
+        anchors = sorted((q, v) for q, v in anchors if v is not None)
+        if not anchors:
+            return
+        if len(anchors) == 1:
+            self.add(anchors[0][1], count)
+            return
+        for (q_low, low), (q_high, high) in zip(anchors, anchors[1:]):
+            if q_high > q_low:
+                self.add_range(low, high, count * (q_high - q_low))
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        for index, count in other.bins.items():
+            self.bins[index] += count
+        self.zero += other.zero
+        return self
+
+    def quantile(self, q: float) -> float:
+        total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = self.zero
+        if seen >= rank and self.zero:
+            return 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen >= rank:
+                return get_value(index)
+        return get_value(max(self.bins))
+
+    def to_dict(self) -> dict:
+        return {
+            "zero": self.zero,
+            "bins": {str(index): count for index, count in self.bins.items() if count},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogHistogram":
+        return cls(
+            {int(index): count for index, count in data.get("bins", {}).items()},
+            data.get("zero", 0),
+        )
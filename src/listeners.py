@@ -1,237 +1,472 @@
 import logging
 import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from typing import Callable
 
-from kubernetes import client, watch
+from kubernetes import client
 from prometheus_client import Gauge, Enum
 
+from src.cache import (
+    Informer,
+    Store,
+    LOCUST_STORE,
+    JOB_STORE,
+    REPLICA_SET_STORE,
+    SERVICE_STORE,
+    CRONJOB_STORE,
+    get_locust_label,
+    get_name,
+)
 from src.controller import (
-    process_spec,
+    LocustSpec,
+    get_locust_spec,
+    is_up_to_date,
+)
+from src.constants import (
+    CRD_NAME,
+    LOCUST_DELETE_DELAY_SECONDS,
+    POOL_LABEL,
+    HISTOGRAM_TIME_TO_WORKERS_SECONDS,
 )
+from src.pools import claim_pool, release_pool
+from src.retention import SERIES_RETENTION
+from src.status import STATUS_WRITER, get_job_status, get_workers_status
+from src.sharding import Sharder
+from src.timeline import Timeline
+from src.workqueue import WorkQueue
 from src.objects import (
     get_locust_object,
     delete_locust_object,
     delete_service,
     delete_replica_set,
-    delete_cronjob,
     update_cronjob,
     delete_job,
+    delete_collection,
     create_cronjob,
     create_job,
     create_service,
     create_replica_set,
+    get_locust_owner,
+    get_job_owner,
 )
 
 log = logging.getLogger(__name__)
 
 
-def watch_locust_events(
-    group: str,
-    version: str,
+def create_workers(
+    name: str, job_name: str, namespace: str, spec: LocustSpec, owner: list = None
+):
+    if spec.worker_pool and REPLICA_SET_STORE.get(namespace, f"replicaset-{name}"):
+        # The pool was used by another run when the run was created, claiming it now
+        # would double the workers
+        log.info(f"Locust {name} runs on its own workers instead of a worker pool")
+    elif spec.worker_pool and claim_pool(name, job_name, namespace, spec):
+        log.info(f"Locust {name} runs on worker pool {spec.worker_pool}")
+    else:
+        create_replica_set(
+            name, f"replicaset-{name}", f"service-{name}", namespace, spec, owner
+        )
+
+
+def needs_delete(obj, namespace: str) -> bool:
+    # The garbage collector deletes the owned objects, except those owned by a Locust
+    # object that remains, e.g. the workers of a run whose Job was deleted by hand
+    if not obj:
+        return False
+    for owner in obj.metadata.owner_references or []:
+        if owner.kind != CRD_NAME or not LOCUST_STORE.get(namespace, owner.name):
+            return False
+    return True
+
+
+# Stores of the kinds labelled with the name of their Locust object
+TEARDOWN_STORES = {
+    "Job": JOB_STORE,
+    "CronJob": CRONJOB_STORE,
+    "ReplicaSet": REPLICA_SET_STORE,
+    "Service": SERVICE_STORE,
+}
+
+
+def get_teardown(name: str, namespace: str) -> dict:
+    # Kind -> names of the objects of the Locust object left to delete
+    teardown = {}
+    for kind, store in TEARDOWN_STORES.items():
+        objects = store.by_locust(namespace, name)
+        if any(needs_delete(obj, namespace) for obj in objects):
+            teardown[kind] = sorted(get_name(obj) for obj in objects)
+    return teardown
+
+
+def log_teardown(name: str, teardown: dict):
+    if teardown:
+        deleted = "; ".join(
+            f"{kind} {', '.join(names)}" for kind, names in teardown.items()
+        )
+        log.info(f"Teardown of Locust {name}: {deleted}")
+
+
+def teardown_locust(name: str, namespace: str, executor: ThreadPoolExecutor) -> dict:
+    # One deletecollection by label per kind, in parallel, instead of a delete per object
+    teardown = get_teardown(name, namespace)
+    futures = [
+        executor.submit(delete_collection, kind, namespace, f"locust={name}")
+        for kind in teardown
+    ]
+    wait(futures)
+    for future in futures:
+        future.result()
+    log_teardown(name, teardown)
+    return teardown
+
+
+def create_run(
+    name: str,
     namespace: str,
-    plural: str,
+    spec: LocustSpec,
+    owner: list,
+    executor: ThreadPoolExecutor,
+):
+    # The Job is not created yet, the Service and workers are owned by the Locust object
+    # Submit the Service, master Job and workers together instead of waiting for the
+    # Job watch to create the Service and workers
+    timeline = Timeline(name)
+
+    def run_step(step: str, func: Callable, *args):
+        with timeline.step(step):
+            func(*args)
+
+    futures = [
+        executor.submit(
+            run_step,
+            "service",
+            create_service,
+            name,
+            f"service-{name}",
+            f"job-{name}",
+            namespace,
+            owner,
+        ),
+        executor.submit(
+            run_step, "job", create_job, name, f"job-{name}", namespace, spec, owner
+        ),
+        executor.submit(
+            run_step,
+            "workers",
+            create_workers,
+            name,
+            f"job-{name}",
+            namespace,
+            spec,
+            owner,
+        ),
+    ]
+    wait(futures)
+    timeline.log()
+    for future in futures:
+        future.result()
+
+
+def handle_locust_event(
+    operation: str,
+    obj: dict,
     gauge: Gauge,
     enum: Enum,
+    executor: ThreadPoolExecutor,
 ):
-    api_client = client.ApiClient()
-    custom_api = client.CustomObjectsApi(api_client)
-    log.info("Waiting for Locust events to come up...")
-    while True:
-        stream = watch.Watch().stream(
-            custom_api.list_namespaced_custom_object,
-            group,
-            version,
-            namespace,
-            plural,
-        )
-        for event in stream:
-            obj = event.get("object")
-            operation = event.get("type")
-            metadata = obj.get("metadata")
-            name = metadata.get("name")
-            spec = obj.get("spec")
-            if not spec:
-                log.warning(f"Locust object {name} does not contain a spec")
-                continue
-            spec = process_spec(spec)
-            log.info(f"Handling {operation} on Locust object {name}")
-            if operation == "ADDED":
-                gauge.labels(operation=operation, name=name).inc()
-                enum.labels(name=name).state("starting")
-                if spec["schedule"]:
-                    create_cronjob(
-                        name,
-                        f"cronjob-{name}",
-                        f"job-{name}",
-                        namespace,
-                        spec["workers"],
-                        spec["image"],
-                        spec["imagePullSecret"],
-                        spec["command"],
-                        spec["configMapRef"],
-                        spec["secretRef"],
-                        spec["mountExternalConfig"],
-                        spec["mountExternalSecret"],
-                        spec["runTime"],
-                        spec["schedule"],
-                    )
-                else:
-                    create_job(
-                        name,
-                        f"job-{name}",
-                        namespace,
-                        spec["workers"],
-                        spec["image"],
-                        spec["imagePullSecret"],
-                        spec["command"],
-                        spec["configMapRef"],
-                        spec["secretRef"],
-                        spec["mountExternalConfig"],
-                        spec["mountExternalSecret"],
-                        spec["runTime"],
-                    )
-                enum.labels(name=name).state("running")
-            elif operation == "DELETED":
-                enum.labels(name=name).state("stopped")
-                gauge.labels(operation=operation, name=name).dec()
-                if spec["schedule"]:
-                    delete_cronjob(f"cronjob-{name}", namespace)
-                else:
-                    delete_job(f"job-{name}", namespace)
-            elif operation == "MODIFIED":
-                if spec["schedule"]:
-                    update_cronjob(
-                        name,
-                        f"cronjob-{name}",
-                        f"job-{name}",
-                        namespace,
-                        spec["workers"],
-                        spec["image"],
-                        spec["imagePullSecret"],
-                        spec["command"],
-                        spec["configMapRef"],
-                        spec["secretRef"],
-                        spec["mountExternalConfig"],
-                        spec["mountExternalSecret"],
-                        spec["runTime"],
-                        spec["schedule"],
-                    )
+    name = obj["metadata"]["name"]
+    namespace = obj["metadata"]["namespace"]
+    spec = get_locust_spec(obj)
+    if not spec:
+        log.warning(f"Locust object {name} does not contain a spec")
+        return
+    cronjob = CRONJOB_STORE.get(namespace, f"cronjob-{name}")
+    log.info(f"Handling {operation} on Locust object {name}")
+    if operation == "ADDED":
+        SERIES_RETENTION.start(namespace, name)
+        SERIES_RETENTION.labels(gauge, namespace, name, operation).inc()
+        SERIES_RETENTION.labels(enum, namespace, name).state("starting")
+        if spec.schedule and cronjob:
+            # Replayed after a restart of the operator, only update it if needed
+            operation = "MODIFIED"
+        elif spec.schedule:
+            create_cronjob(
+                name,
+                f"cronjob-{name}",
+                f"job-{name}",
+                namespace,
+                spec,
+                get_locust_owner(obj),
+            )
+            STATUS_WRITER.update(namespace, name, phase="Scheduled")
+        elif JOB_STORE.get(namespace, f"job-{name}"):
+            log.info(f"Job job-{name} already exists")
+        else:
+            STATUS_WRITER.update(
+                namespace, name, phase="Pending", jobName=f"job-{name}"
+            )
+            create_run(name, namespace, spec, get_locust_owner(obj), executor)
+        SERIES_RETENTION.labels(enum, namespace, name).state("running")
+    if operation == "DELETED":
+        SERIES_RETENTION.labels(enum, namespace, name).state("stopped")
+        SERIES_RETENTION.labels(gauge, namespace, name, operation).dec()
+        SERIES_RETENTION.finish(namespace, name)
+        STATUS_WRITER.forget(namespace, name)
+        # Only the objects created before the owner references are left to delete
+        teardown_locust(name, namespace, executor)
+    elif operation == "MODIFIED":
+        if spec.schedule and is_up_to_date(cronjob, spec.spec_hash):
+            # Only metadata or status changed
+            log.info(f"Cronjob cronjob-{name} is up to date")
+        elif spec.schedule:
+            update_cronjob(
+                name,
+                f"cronjob-{name}",
+                f"job-{name}",
+                namespace,
+                spec,
+                get_locust_owner(obj),
+            )
 
 
-def watch_job_events(
+def handle_job_event(
+    operation: str,
+    obj: client.V1Job,
     group: str,
     version: str,
-    namespace: str,
     plural: str,
     gauge: Gauge,
     enum: Enum,
 ):
-    api_client = client.BatchV1Api()
-    log.info("Waiting for Jobs events to come up...")
-    while True:
-        for event in watch.Watch().stream(api_client.list_namespaced_job, namespace):
-            obj = event.get("object")
-            operation = event.get("type")
-            job_name: str = obj.metadata.name
-            if (
-                "locust" not in obj.metadata.labels
-                or "issued_by" not in obj.metadata.labels
-            ):
-                log.info(
-                    f"Job object {job_name} does not contain a label locust or issued_by: {obj.metadata.labels}"
-                )
-                continue
-            locust_name: str = obj.metadata.labels.get("locust")
-            issued_by: str = obj.metadata.labels.get("issued_by")
-            log.info(
-                f"Handling {operation} on Job object {job_name} managed by "
-                f"Locust {locust_name} and issued by {issued_by}"
+    job_name: str = obj.metadata.name
+    namespace: str = obj.metadata.namespace
+    labels = obj.metadata.labels or {}
+    if "locust" not in labels or "issued_by" not in labels:
+        log.info(
+            f"Job object {job_name} does not contain a label locust or issued_by: {labels}"
+        )
+        return
+    locust_name: str = labels.get("locust")
+    issued_by: str = labels.get("issued_by")
+    log.info(
+        f"Handling {operation} on Job object {job_name} managed by "
+        f"Locust {locust_name} and issued by {issued_by}"
+    )
+    if operation == "ADDED":
+        locust_object = LOCUST_STORE.get(namespace, locust_name)
+        if not locust_object:
+            # The Locust watch may lag behind the Job watch
+            locust_object = get_locust_object(
+                group, version, namespace, plural, locust_name
             )
-            if operation == "ADDED":
-                locust_object = get_locust_object(
-                    group, version, namespace, plural, locust_name
+        if locust_object:
+            SERIES_RETENTION.start(namespace, locust_name, job_name)
+            SERIES_RETENTION.labels(
+                gauge, namespace, locust_name, job_name, operation
+            ).inc()
+            SERIES_RETENTION.labels(enum, namespace, locust_name, job_name, "").state(
+                "starting"
+            )
+            spec = get_locust_spec(locust_object)
+            # Deleting the Job of a scheduled run deletes its Service and workers
+            owner = get_job_owner(obj)
+            if not SERVICE_STORE.get(namespace, f"service-{locust_name}"):
+                create_service(
+                    locust_name,
+                    f"service-{locust_name}",
+                    f"job-{locust_name}",
+                    namespace,
+                    owner,
                 )
-                if locust_object:
-                    gauge.labels(
-                        name=locust_name, operation=operation, job_name=job_name
-                    ).inc()
-                    enum.labels(name=locust_name, job_name=job_name, status="").state(
-                        "starting"
-                    )
-                    spec = process_spec(locust_object["spec"])
-                    create_service(
-                        locust_name,
-                        f"service-{locust_name}",
-                        f"job-{locust_name}",
-                        namespace,
-                    )
-                    create_replica_set(
-                        locust_name,
-                        f"replicaset-{locust_name}",
-                        f"service-{locust_name}",
-                        namespace,
-                        spec["workers"],
-                        spec["image"],
-                        spec["imagePullSecret"],
-                        spec["command"],
-                        spec["configMapRef"],
-                        spec["secretRef"],
-                        spec["mountExternalConfig"],
-                        spec["mountExternalSecret"],
-                    )
-                    enum.labels(name=locust_name, job_name=job_name, status="").state(
-                        "running"
-                    )
-            if (
-                operation == "MODIFIED"
-                and obj.status.failed == 1
-                or obj.status.succeeded == 1
+            if spec.worker_pool:
+                # No-op when create_run already claimed the pool for this run or gave
+                # it its own workers
+                create_workers(locust_name, f"job-{locust_name}", namespace, spec)
+            elif is_up_to_date(
+                REPLICA_SET_STORE.get(namespace, f"replicaset-{locust_name}"),
+                spec.spec_hash,
             ):
-                if obj.status.succeeded == 1:
-                    log.info(f"Job {job_name} finished with status succeeded")
-                    enum.labels(
-                        name=locust_name, job_name=job_name, status="succeeded"
-                    ).state("stopped")
-                else:
-                    log.info(f"Job {job_name} finished with status failed")
-                    enum.labels(
-                        name=locust_name, job_name=job_name, status="failed"
-                    ).state("stopped")
-                if issued_by == "locust":
-                    delete_locust_object(
-                        group,
-                        version,
-                        namespace,
-                        plural,
-                        locust_name,
-                    )
-                else:
-                    delete_job(job_name, namespace)
-            if operation == "DELETED":
-                gauge.labels(
-                    name=locust_name, operation=operation, job_name=job_name
-                ).dec()
-                delete_replica_set(f"replicaset-{locust_name}", namespace)
-                delete_service(f"service-{locust_name}", namespace)
-
-
-def watch_job_via_thread(
+                log.info(f"ReplicaSet replicaset-{locust_name} already exists")
+            else:
+                create_workers(
+                    locust_name, f"job-{locust_name}", namespace, spec, owner
+                )
+            SERIES_RETENTION.labels(enum, namespace, locust_name, job_name, "").state(
+                "running"
+            )
+    if operation != "DELETED":
+        STATUS_WRITER.update(namespace, locust_name, **get_job_status(obj))
+    if operation == "MODIFIED" and obj.status.failed == 1 or obj.status.succeeded == 1:
+        if obj.status.succeeded == 1:
+            log.info(f"Job {job_name} finished with status succeeded")
+            SERIES_RETENTION.labels(
+                enum, namespace, locust_name, job_name, "succeeded"
+            ).state("stopped")
+        else:
+            log.info(f"Job {job_name} finished with status failed")
+            SERIES_RETENTION.labels(
+                enum, namespace, locust_name, job_name, "failed"
+            ).state("stopped")
+        if labels.get(POOL_LABEL):
+            release_pool(labels[POOL_LABEL], locust_name, namespace)
+        if issued_by == "locust":
+            # The final status is written before the Locust object is deleted
+            STATUS_WRITER.write(namespace, locust_name)
+            delete_locust_object_later(group, version, namespace, plural, locust_name)
+        else:
+            delete_job(job_name, namespace)
+    if operation == "DELETED":
+        SERIES_RETENTION.labels(
+            gauge, namespace, locust_name, job_name, operation
+        ).dec()
+        SERIES_RETENTION.finish(namespace, locust_name, job_name)
+        if labels.get(POOL_LABEL):
+            release_pool(labels[POOL_LABEL], locust_name, namespace)
+        replica_set = REPLICA_SET_STORE.get(namespace, f"replicaset-{locust_name}")
+        if needs_delete(replica_set, namespace):
+            delete_replica_set(f"replicaset-{locust_name}", namespace)
+        service = SERVICE_STORE.get(namespace, f"service-{locust_name}")
+        if needs_delete(service, namespace):
+            delete_service(f"service-{locust_name}", namespace)
+
+
+def delete_locust_object_later(
+    group: str, version: str, namespace: str, plural: str, name: str
+):
+    # Kept with its final status for the clients waiting for it, e.g. kubectl wait. After
+    # a restart during the delay, the finished Job listed again deletes it
+    def delete():
+        try:
+            delete_locust_object(group, version, namespace, plural, name)
+        except Exception:
+            # Logged by delete_locust_object
+            pass
+
+    if not LOCUST_DELETE_DELAY_SECONDS:
+        delete_locust_object(group, version, namespace, plural, name)
+        return
+    t = threading.Timer(LOCUST_DELETE_DELAY_SECONDS, delete)
+    t.daemon = True
+    t.start()
+
+
+def get_run_start(namespace: str, locust_name: str) -> datetime:
+    # Creation of the Locust object, or of the latest Job of a scheduled one
+    starts = [
+        job.metadata.creation_timestamp
+        for job in JOB_STORE.by_locust(namespace, locust_name)
+        if job.metadata.creation_timestamp
+    ]
+    locust_object = LOCUST_STORE.get(namespace, locust_name)
+    if locust_object and locust_object["metadata"].get("creationTimestamp"):
+        created = locust_object["metadata"]["creationTimestamp"].replace("Z", "+00:00")
+        starts.append(datetime.fromisoformat(created))
+    return max(starts, default=None)
+
+
+_ready_replica_sets = set()
+
+
+def handle_replica_set_event(
+    operation: str, obj: client.V1ReplicaSet, sharder: Sharder, informer: Informer
+):
+    uid = obj.metadata.uid
+    if operation == "DELETED":
+        _ready_replica_sets.discard(uid)
+        return
+    key = informer.store.get_locust_key(obj)
+    owned = sharder is None or sharder.owns(key)
+    locust_name = get_locust_label(obj)
+    if locust_name and owned:
+        STATUS_WRITER.update(
+            obj.metadata.namespace, locust_name, **get_workers_status(obj)
+        )
+    ready = obj.status.ready_replicas if obj.status else None
+    if uid in _ready_replica_sets or (ready or 0) < (obj.spec.replicas or 1):
+        return
+    # Recorded by every replica, a shard taken over later has no sample to observe
+    _ready_replica_sets.add(uid)
+    # Ready ReplicaSets listed at startup come as ADDED, they are not new runs
+    if operation != "MODIFIED" or not owned:
+        return
+    start = get_run_start(obj.metadata.namespace, locust_name)
+    if start:
+        HISTOGRAM_TIME_TO_WORKERS_SECONDS.observe(
+            (datetime.now(timezone.utc) - start).total_seconds()
+        )
+
+
+def watch_replica_set_events(informers: list, sharder: Sharder):
+    for informer in informers:
+        informer.add_handler(
+            partial(handle_replica_set_event, sharder=sharder, informer=informer)
+        )
+
+
+def get_enqueue(
+    queue: WorkQueue, sharder: Sharder, handler: Callable, informer: Informer
+) -> Callable:
+    def enqueue(operation: str, obj):
+        # Jobs are queued under their Locust object, so a Locust object and its Jobs
+        # are never reconciled concurrently
+        key = informer.store.get_locust_key(obj)
+        if sharder is None or sharder.owns(key):
+            queue.add(key, handler, operation, obj)
+
+    return enqueue
+
+
+def get_resync(
+    queue: WorkQueue, handler: Callable, operation: str, store: Store
+) -> Callable:
+    def resync(is_new_key: Callable):
+        # Replay the objects of the shards taken over from another replica
+        for obj in store.list():
+            key = store.get_locust_key(obj)
+            if is_new_key(key):
+                queue.add(key, handler, operation, obj)
+
+    return resync
+
+
+def watch_locust_events(
+    informers: list,
+    queue: WorkQueue,
+    sharder: Sharder,
+    gauge: Gauge,
+    enum: Enum,
+    reconcile_workers: int,
+):
+    # Shared by the reconcile workers, each run submits its three creations at once
+    executor = ThreadPoolExecutor(max_workers=3 * reconcile_workers)
+    handler = partial(handle_locust_event, gauge=gauge, enum=enum, executor=executor)
+    for informer in informers:
+        informer.add_handler(get_enqueue(queue, sharder, handler, informer))
+    if sharder:
+        sharder.add_handler(get_resync(queue, handler, "ADDED", LOCUST_STORE))
+
+
+def watch_job_events(
+    informers: list,
+    queue: WorkQueue,
+    sharder: Sharder,
     group: str,
     version: str,
-    namespace: str,
     plural: str,
     gauge: Gauge,
     enum: Enum,
 ):
-    t = threading.Thread(
-        target=watch_job_events,
-        args=(
-            group,
-            version,
-            namespace,
-            plural,
-            gauge,
-            enum,
-        ),
+    handler = partial(
+        handle_job_event,
+        group=group,
+        version=version,
+        plural=plural,
+        gauge=gauge,
+        enum=enum,
     )
-    t.daemon = True
-    t.start()
+    for informer in informers:
+        informer.add_handler(get_enqueue(queue, sharder, handler, informer))
+    if sharder:
+        sharder.add_handler(get_resync(queue, handler, "MODIFIED", JOB_STORE))
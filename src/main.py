@@ -1,78 +1,63 @@
+import asyncio
 import logging
 import os
+import signal
+import sys
 
 from kubernetes import config
-from prometheus_client import start_http_server
 
 from src.args import get_args
-from src.constants import (
-    CRD_GROUP,
-    CRD_VERSION,
-    NAMESPACE,
-    CRD_PLURAL,
-    GAUGE_LOCUST_OBJECT,
-    ENUM_LOCUST_OBJECT_STATE,
-    GAUGE_JOB_OBJECT,
-    ENUM_JOB_OBJECT_STATE,
-)
+from src.constants import CRD_GROUP, CRD_VERSION, WATCH_NAMESPACES, CRD_PLURAL
+from src.cache import create_informers, run_informers, use_fast_decode
+from src.clients import set_write_limit
 from src.controller import check_crd
-from src.listeners import watch_locust_events, watch_job_via_thread, watch_job_events
+from src.health import start_metrics_server
+from src.roles import start_loops, watch_events
+from src.sharding import create_sharder
+from src.workqueue import WorkQueue, start_workers
 
 logging.basicConfig(
     format="%(levelname)s: %(message)s", level=os.getenv("LOG_LEVEL", logging.INFO)
 )
 
 
+def release_and_exit(sharder):
+    sharder.release()
+    sys.exit(0)
+
+
 def main():
     args = get_args()
+    if args.asyncio:
+        from src.aio import run
+
+        asyncio.run(run(args))
+        return
     # Check if run in k8s cluster and load the kubeconfig
     if "KUBERNETES_PORT" in os.environ:
         config.load_incluster_config()
     else:
         config.load_kube_config()
+    # Up first, the readiness probe fails until the caches are synced
+    start_metrics_server(8001 if args.locusts and not args.jobs else 8000)
     # Run the controller
-    check_crd(CRD_GROUP, CRD_VERSION, NAMESPACE, CRD_PLURAL)
-    if args.jobs:
-        # Start up the server to expose the metrics.
-        start_http_server(8000)
-        watch_job_events(
-            CRD_GROUP,
-            CRD_VERSION,
-            NAMESPACE,
-            CRD_PLURAL,
-            GAUGE_JOB_OBJECT,
-            ENUM_JOB_OBJECT_STATE,
-        )
-    elif args.locusts:
-        # Start up the server to expose the metrics.
-        start_http_server(8001)
-        watch_locust_events(
-            CRD_GROUP,
-            CRD_VERSION,
-            NAMESPACE,
-            CRD_PLURAL,
-            GAUGE_LOCUST_OBJECT,
-            ENUM_LOCUST_OBJECT_STATE,
-        )
-    else:
-        # Start up the server to expose the metrics.
-        start_http_server(8000)
-        watch_job_via_thread(
-            CRD_GROUP,
-            CRD_VERSION,
-            NAMESPACE,
-            CRD_PLURAL,
-            GAUGE_JOB_OBJECT,
-            ENUM_JOB_OBJECT_STATE,
-        )
-        watch_locust_events(
-            CRD_GROUP,
-            CRD_VERSION,
-            NAMESPACE,
-            CRD_PLURAL,
-            GAUGE_LOCUST_OBJECT,
-            ENUM_LOCUST_OBJECT_STATE,
-        )
+    set_write_limit(args.api_qps, args.api_burst)
+    informers = create_informers(CRD_GROUP, CRD_VERSION, WATCH_NAMESPACES, CRD_PLURAL)
+    if args.fast_decode:
+        use_fast_decode(informers)
+    queue = WorkQueue(args.reconcile_qps, args.reconcile_burst)
+    check_crd(CRD_GROUP, CRD_VERSION, CRD_PLURAL)
+    sharder = create_sharder(args)
+    if sharder:
+        # Hand the Locust objects over to the other replicas without waiting for the
+        # lease to expire
+        signal.signal(signal.SIGTERM, lambda *_: release_and_exit(sharder))
+    start_loops(args, sharder)
+    watch_events(args, informers, queue, sharder)
+    start_workers(queue, args.reconcile_workers)
+    # One list+watch per kind and namespace, the handlers read the other kinds from
+    # the stores
+    run_informers([informer for kind in informers.values() for informer in kind])
 
 
 if __name__ == "__main__":
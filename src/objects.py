@@ -1,10 +1,31 @@
 import logging
 from datetime import timedelta
+from functools import lru_cache
+from typing import Callable
 
 from durationpy import from_str
 from kubernetes import client
 
-from src.constants import ADDITIONAL_ACTIVE_DEADLINE_MINUTES
+from src.clients import (
+    get_api_client,
+    get_core_api,
+    get_batch_api,
+    get_apps_api,
+    get_custom_api,
+    is_retryable,
+)
+from src.constants import (
+    ADDITIONAL_ACTIVE_DEADLINE_MINUTES,
+    CRD_GROUP,
+    CRD_VERSION,
+    CRD_NAME,
+    LOCUST_AUTOQUIT_SECONDS,
+    POOL_LABEL,
+    POOL_IDLE_LABEL,
+    SPEC_HASH_ANNOTATION,
+    TEMPLATE_CACHE_SIZE,
+)
+from src.controller import LocustSpec
 
 log = logging.getLogger(__name__)
 
@@ -21,19 +42,48 @@ def get_image_pull_secret(image_pull_secret: str):
 
 
 def get_command_master(workers: int):
+    # Started at once like with --headless, but with the web UI up: the operator polls
+    # its /stats/requests during the run. --headful overrides the LOCUST_HEADLESS of the
+    # user config, which would skip --autostart and the web UI, and --print-stats keeps
+    # the stats printed to the console like a headless run
     return [
         "--master",
-        "--headless",
+        "--headful",
+        "--autostart",
+        "--print-stats",
+        f"--autoquit={LOCUST_AUTOQUIT_SECONDS}",
         f"--expect-workers={workers}",
     ]
 
 
-def get_command_worker(name: str):
-    return [
+def get_command_worker(name: str, processes: int = 1):
+    command = [
         "--worker",
         "--headless",
         f"--master-host={name}",
     ]
+    if processes > 1:
+        # Forked by the worker, each one connects to the master on its own
+        command.append(f"--processes={processes}")
+    return command
+
+
+def get_command_pool(command: tuple) -> list:
+    # Keep the pod when the worker quits with its master, it reconnects to the next one
+    return [
+        "sh",
+        "-c",
+        'while true; do "$@"; sleep 1; done',
+        "sh",
+        *(command or ["locust"]),
+    ]
+
+
+def get_job_labels(name: str, issued_by: str, spec: LocustSpec) -> dict:
+    labels = {"locust": name, "issued_by": issued_by}
+    if spec.worker_pool:
+        labels[POOL_LABEL] = spec.worker_pool
+    return labels
 
 
 def get_env_from(secret: str, configmap: str):
@@ -93,143 +143,354 @@ def get_volumes(
     return volumes, volume_mounts
 
 
-def create_service(name, service_name, job_name, namespace):
-    try:
-        api_instance = client.CoreV1Api()
-        body = client.V1Service(
-            api_version="v1",
-            kind="Service",
-            metadata=client.V1ObjectMeta(name=service_name, labels={"locust": name}),
-            spec=client.V1ServiceSpec(
-                selector={"app": job_name, "locust": name},
-                ports=[
-                    client.V1ServicePort(
-                        name="master", protocol="TCP", port=5557, target_port=5557
-                    ),
-                    client.V1ServicePort(
-                        name="metrics", protocol="TCP", port=8089, target_port=8089
-                    ),
-                ],
-            ),
+def get_delete_options() -> client.V1DeleteOptions:
+    # The garbage collector deletes the dependents after the response
+    return client.V1DeleteOptions(propagation_policy="Background")
+
+
+def get_owner_references(
+    api_version: str, kind: str, name: str, uid: str
+) -> list[client.V1OwnerReference]:
+    if not uid:
+        return None
+    return [
+        client.V1OwnerReference(
+            api_version=api_version, kind=kind, name=name, uid=uid, controller=True
         )
+    ]
+
+
+def get_locust_owner(obj: dict) -> list[client.V1OwnerReference]:
+    return get_owner_references(
+        f"{CRD_GROUP}/{CRD_VERSION}",
+        CRD_NAME,
+        obj["metadata"]["name"],
+        obj["metadata"].get("uid"),
+    )
+
+
+def get_job_owner(job: client.V1Job) -> list[client.V1OwnerReference]:
+    return get_owner_references("batch/v1", "Job", job.metadata.name, job.metadata.uid)
+
+
+def get_replace_patch(obj) -> dict:
+    # Strategic merge patch replacing the whole spec, without the resourceVersion
+    # conflicts of a replace
+    body = get_api_client().sanitize_for_serialization(obj)
+    return {
+        "metadata": {
+            "labels": body["metadata"].get("labels"),
+            "annotations": body["metadata"].get("annotations"),
+            # Adopts the objects created before the owner references
+            "ownerReferences": body["metadata"].get("ownerReferences"),
+        },
+        "spec": {**body["spec"], "$patch": "replace"},
+    }
+
+
+def get_service_body(
+    name: str, service_name: str, job_name: str, owner: list = None
+) -> client.V1Service:
+    return client.V1Service(
+        api_version="v1",
+        kind="Service",
+        metadata=client.V1ObjectMeta(
+            name=service_name, labels={"locust": name}, owner_references=owner
+        ),
+        spec=client.V1ServiceSpec(
+            selector={"app": job_name, "locust": name},
+            ports=[
+                client.V1ServicePort(
+                    name="master", protocol="TCP", port=5557, target_port=5557
+                ),
+                client.V1ServicePort(
+                    name="metrics", protocol="TCP", port=8089, target_port=8089
+                ),
+            ],
+        ),
+    )
+
+
+# The pod templates are the costly part of the manifests, they are rendered once per
+# distinct spec and shared by the Job, CronJob and ReplicaSet bodies
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_master_template(
+    name: str, job_name: str, spec: LocustSpec
+) -> client.V1PodTemplateSpec:
+    volumes, volume_mounts = get_volumes(
+        spec.mount_external_config, spec.mount_external_secret
+    )
+    container = client.V1Container(
+        name="locust",
+        image=spec.image,
+        command=list(spec.command) if spec.command else None,
+        args=get_command_master(spec.workers * spec.processes),
+        ports=[
+            client.V1ContainerPort(host_port=5557, container_port=5557, name="master"),
+            client.V1ContainerPort(host_port=8089, container_port=8089, name="metrics"),
+        ],
+        env_from=get_env_from(spec.secret, spec.configmap),
+        env=[client.V1EnvVar(name="LOCUST_RUN_TIME", value=spec.run_time)],
+        volume_mounts=volume_mounts,
+    )
+    return client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(
+            name=job_name, labels={"app": job_name, "locust": name}
+        ),
+        spec=client.V1PodSpec(
+            restart_policy="Never",
+            containers=[container],
+            volumes=volumes,
+            image_pull_secrets=get_image_pull_secret(spec.image_pull_secret),
+        ),
+    )
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_worker_template(
+    name: str, replicaset_name: str, service_name: str, spec: LocustSpec
+) -> client.V1PodTemplateSpec:
+    volumes, volume_mounts = get_volumes(
+        spec.mount_external_config, spec.mount_external_secret
+    )
+    container = client.V1Container(
+        name="locust",
+        image=spec.image,
+        command=list(spec.command) if spec.command else None,
+        args=get_command_worker(service_name, spec.processes),
+        env_from=get_env_from(spec.secret, spec.configmap),
+        volume_mounts=volume_mounts,
+    )
+    return client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(name=replicaset_name, labels={"locust": name}),
+        spec=client.V1PodSpec(
+            containers=[container],
+            volumes=volumes,
+            image_pull_secrets=get_image_pull_secret(spec.image_pull_secret),
+        ),
+    )
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_pool_worker_template(
+    pool_name: str, spec: LocustSpec
+) -> client.V1PodTemplateSpec:
+    volumes, volume_mounts = get_volumes(
+        spec.mount_external_config, spec.mount_external_secret
+    )
+    container = client.V1Container(
+        name="locust",
+        image=spec.image,
+        command=get_command_pool(spec.command),
+        args=get_command_worker(pool_name, spec.processes),
+        env_from=get_env_from(spec.secret, spec.configmap),
+        volume_mounts=volume_mounts,
+    )
+    return client.V1PodTemplateSpec(
+        metadata=client.V1ObjectMeta(name=pool_name, labels={POOL_LABEL: pool_name}),
+        spec=client.V1PodSpec(
+            containers=[container],
+            volumes=volumes,
+            image_pull_secrets=get_image_pull_secret(spec.image_pull_secret),
+        ),
+    )
+
+
+def get_job_spec(name: str, job_name: str, spec: LocustSpec) -> client.V1JobSpec:
+    return client.V1JobSpec(
+        template=get_master_template(name, job_name, spec),
+        backoff_limit=0,
+        completions=1,
+        parallelism=1,
+        active_deadline_seconds=get_seconds(spec.run_time),
+    )
+
+
+def get_job_body(
+    name: str, job_name: str, spec: LocustSpec, owner: list = None
+) -> client.V1Job:
+    return client.V1Job(
+        api_version="batch/v1",
+        kind="Job",
+        metadata=client.V1ObjectMeta(
+            name=job_name,
+            labels=get_job_labels(name, "locust", spec),
+            annotations={SPEC_HASH_ANNOTATION: spec.spec_hash},
+            owner_references=owner,
+        ),
+        spec=get_job_spec(name, job_name, spec),
+    )
+
+
+def get_cronjob_body(
+    name: str, cronjob_name: str, job_name: str, spec: LocustSpec, owner: list = None
+) -> client.V1CronJob:
+    spec_job_template = client.V1JobTemplateSpec(
+        spec=get_job_spec(name, job_name, spec),
+        metadata=client.V1ObjectMeta(
+            name=job_name,
+            labels=get_job_labels(name, "cronjob", spec),
+            annotations={SPEC_HASH_ANNOTATION: spec.spec_hash},
+        ),
+    )
+    spec_cronjob = client.V1CronJobSpec(
+        concurrency_policy="Forbid",
+        job_template=spec_job_template,
+        schedule=spec.schedule,
+        suspend=False,
+        failed_jobs_history_limit=1,
+        successful_jobs_history_limit=1,
+    )
+    return client.V1CronJob(
+        api_version="batch/v1",
+        kind="CronJob",
+        metadata=client.V1ObjectMeta(
+            name=cronjob_name,
+            labels={"locust": name},
+            annotations={SPEC_HASH_ANNOTATION: spec.spec_hash},
+            owner_references=owner,
+        ),
+        spec=spec_cronjob,
+    )
+
+
+def get_replica_set_body(
+    name: str,
+    replicaset_name: str,
+    service_name: str,
+    spec: LocustSpec,
+    owner: list = None,
+) -> client.V1ReplicaSet:
+    return client.V1ReplicaSet(
+        api_version="apps/v1",
+        kind="ReplicaSet",
+        metadata=client.V1ObjectMeta(
+            name=replicaset_name,
+            labels={"locust": name},
+            annotations={SPEC_HASH_ANNOTATION: spec.spec_hash},
+            owner_references=owner,
+        ),
+        spec=client.V1ReplicaSetSpec(
+            selector=client.V1LabelSelector(match_labels={"locust": name}),
+            replicas=spec.workers,
+            template=get_worker_template(name, replicaset_name, service_name, spec),
+        ),
+    )
+
+
+def get_pool_replica_set_body(pool_name: str, spec: LocustSpec) -> client.V1ReplicaSet:
+    return client.V1ReplicaSet(
+        api_version="apps/v1",
+        kind="ReplicaSet",
+        metadata=client.V1ObjectMeta(name=pool_name, labels={POOL_LABEL: pool_name}),
+        spec=client.V1ReplicaSetSpec(
+            selector=client.V1LabelSelector(match_labels={POOL_LABEL: pool_name}),
+            replicas=spec.workers,
+            template=get_pool_worker_template(pool_name, spec),
+        ),
+    )
+
+
+def get_pool_service_body(pool_name: str, selector: dict) -> client.V1Service:
+    # The workers of the pool reach the master selected by this Service
+    return client.V1Service(
+        api_version="v1",
+        kind="Service",
+        metadata=client.V1ObjectMeta(name=pool_name, labels={POOL_LABEL: pool_name}),
+        spec=client.V1ServiceSpec(
+            selector=selector,
+            ports=[
+                client.V1ServicePort(
+                    name="master", protocol="TCP", port=5557, target_port=5557
+                ),
+            ],
+        ),
+    )
+
+
+def get_idle_selector(pool_name: str) -> dict:
+    # Selects no pod, the workers wait for the next master
+    return {POOL_IDLE_LABEL: pool_name}
+
+
+def create_service(name, service_name, job_name, namespace, owner: list = None):
+    try:
+        api_instance = get_core_api()
+        body = get_service_body(name, service_name, job_name, owner)
         api_instance.create_namespaced_service(namespace=namespace, body=body)
         log.info(f"Service created for {service_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Create service {service_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Create service {service_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Create service {service_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def delete_service(service_name: str, namespace: str):
     try:
-        api_instance = client.CoreV1Api()
+        api_instance = get_core_api()
         api_instance.delete_namespaced_service(
             name=service_name,
             namespace=namespace,
-            body=client.V1DeleteOptions(
-                propagation_policy="Foreground", grace_period_seconds=0
-            ),
+            body=get_delete_options(),
         )
         log.info(f"Service deleted for {service_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Delete service {service_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Delete service {service_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Delete service {service_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def create_job(
-    name: str,
-    job_name: str,
-    namespace: str,
-    workers: int,
-    image: str,
-    image_pull_secret: str,
-    command: str,
-    configmap: str,
-    secret: str,
-    mount_external_config: dict,
-    mount_external_secret: dict,
-    run_time: str,
+    name: str, job_name: str, namespace: str, spec: LocustSpec, owner: list = None
 ):
     try:
-        volumes, volume_mounts = get_volumes(
-            mount_external_config, mount_external_secret
-        )
-        container = client.V1Container(
-            name="locust",
-            image=image,
-            command=command,
-            args=get_command_master(workers),
-            ports=[
-                client.V1ContainerPort(
-                    host_port=5557, container_port=5557, name="master"
-                ),
-                client.V1ContainerPort(
-                    host_port=8089, container_port=8089, name="metrics"
-                ),
-            ],
-            env_from=get_env_from(secret, configmap),
-            env=[client.V1EnvVar(name="LOCUST_RUN_TIME", value=run_time)],
-            volume_mounts=volume_mounts,
-        )
-        template = client.V1PodTemplateSpec(
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"app": job_name, "locust": name}
-            ),
-            spec=client.V1PodSpec(
-                restart_policy="Never",
-                containers=[container],
-                volumes=volumes,
-                image_pull_secrets=get_image_pull_secret(image_pull_secret),
-            ),
-        )
-        spec = client.V1JobSpec(
-            template=template,
-            backoff_limit=0,
-            completions=1,
-            parallelism=1,
-            active_deadline_seconds=get_seconds(run_time),
-        )
-        job = client.V1Job(
-            api_version="batch/v1",
-            kind="Job",
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"locust": name, "issued_by": "locust"}
-            ),
-            spec=spec,
-        )
-        api_instance = client.BatchV1Api()
+        job = get_job_body(name, job_name, spec, owner)
+        api_instance = get_batch_api()
         api_instance.create_namespaced_job(body=job, namespace=namespace)
         log.info(f"Job created for {job_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Create job {job_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Create job {job_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Create job {job_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def delete_job(job_name: str, namespace: str):
     try:
-        api_instance = client.BatchV1Api()
+        api_instance = get_batch_api()
         api_instance.delete_namespaced_job(
             name=job_name,
             namespace=namespace,
-            body=client.V1DeleteOptions(
-                propagation_policy="Foreground", grace_period_seconds=0
-            ),
+            body=get_delete_options(),
         )
         log.info(f"Job deleted for {job_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Delete job {job_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Delete job {job_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Delete job {job_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def create_cronjob(
@@ -237,85 +498,24 @@ def create_cronjob(
     cronjob_name: str,
     job_name: str,
     namespace: str,
-    workers: int,
-    image: str,
-    image_pull_secret: str,
-    command: str,
-    configmap: str,
-    secret: str,
-    mount_external_config: dict,
-    mount_external_secret: dict,
-    run_time: str,
-    schedule: str,
+    spec: LocustSpec,
+    owner: list = None,
 ):
     try:
-        volumes, volume_mounts = get_volumes(
-            mount_external_config, mount_external_secret
-        )
-        container = client.V1Container(
-            name="locust",
-            image=image,
-            command=command,
-            args=get_command_master(workers),
-            ports=[
-                client.V1ContainerPort(
-                    host_port=5557, container_port=5557, name="master"
-                ),
-                client.V1ContainerPort(
-                    host_port=8089, container_port=8089, name="metrics"
-                ),
-            ],
-            env_from=get_env_from(secret, configmap),
-            env=[client.V1EnvVar(name="LOCUST_RUN_TIME", value=run_time)],
-            volume_mounts=volume_mounts,
-        )
-        template = client.V1PodTemplateSpec(
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"app": job_name, "locust": name}
-            ),
-            spec=client.V1PodSpec(
-                restart_policy="Never",
-                containers=[container],
-                volumes=volumes,
-                image_pull_secrets=get_image_pull_secret(image_pull_secret),
-            ),
-        )
-        spec = client.V1JobSpec(
-            template=template,
-            backoff_limit=0,
-            completions=1,
-            parallelism=1,
-            active_deadline_seconds=get_seconds(run_time),
-        )
-        spec_job_template = client.V1JobTemplateSpec(
-            spec=spec,
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"locust": name, "issued_by": "cronjob"}
-            ),
-        )
-        spec_cronjob = client.V1CronJobSpec(
-            concurrency_policy="Forbid",
-            job_template=spec_job_template,
-            schedule=schedule,
-            suspend=False,
-            failed_jobs_history_limit=1,
-            successful_jobs_history_limit=1,
-        )
-        cronjob = client.V1CronJob(
-            api_version="batch/v1",
-            kind="CronJob",
-            metadata=client.V1ObjectMeta(name=cronjob_name, labels={"locust": name}),
-            spec=spec_cronjob,
-        )
-        api_instance = client.BatchV1Api()
+        cronjob = get_cronjob_body(name, cronjob_name, job_name, spec, owner)
+        api_instance = get_batch_api()
         api_instance.create_namespaced_cron_job(body=cronjob, namespace=namespace)
         log.info(f"Cronjob created  for {cronjob_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Create cronjob {cronjob_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Create cronjob {cronjob_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Create cronjob {cronjob_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def update_cronjob(
@@ -323,106 +523,47 @@ def update_cronjob(
     cronjob_name: str,
     job_name: str,
     namespace: str,
-    workers: int,
-    image: str,
-    image_pull_secret: str,
-    command: str,
-    configmap: str,
-    secret: str,
-    mount_external_config: dict,
-    mount_external_secret: dict,
-    run_time: str,
-    schedule: str,
+    spec: LocustSpec,
+    owner: list = None,
 ):
     try:
-        volumes, volume_mounts = get_volumes(
-            mount_external_config, mount_external_secret
-        )
-        container = client.V1Container(
-            name="locust",
-            image=image,
-            command=command,
-            args=get_command_master(workers),
-            ports=[
-                client.V1ContainerPort(
-                    host_port=5557, container_port=5557, name="master"
-                ),
-                client.V1ContainerPort(
-                    host_port=8089, container_port=8089, name="metrics"
-                ),
-            ],
-            env_from=get_env_from(secret, configmap),
-            env=[client.V1EnvVar(name="LOCUST_RUN_TIME", value=run_time)],
-            volume_mounts=volume_mounts,
-        )
-        template = client.V1PodTemplateSpec(
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"app": job_name, "locust": name}
-            ),
-            spec=client.V1PodSpec(
-                restart_policy="Never",
-                containers=[container],
-                volumes=volumes,
-                image_pull_secrets=get_image_pull_secret(image_pull_secret),
-            ),
-        )
-        spec = client.V1JobSpec(
-            template=template,
-            backoff_limit=0,
-            completions=1,
-            parallelism=1,
-            active_deadline_seconds=get_seconds(run_time),
-        )
-        spec_job_template = client.V1JobTemplateSpec(
-            spec=spec,
-            metadata=client.V1ObjectMeta(
-                name=job_name, labels={"locust": name, "issued_by": "cronjob"}
-            ),
-        )
-        spec_cronjob = client.V1CronJobSpec(
-            concurrency_policy="Forbid",
-            failed_jobs_history_limit=1,
-            successful_jobs_history_limit=1,
-            job_template=spec_job_template,
-            schedule=schedule,
-            suspend=False,
-        )
-        cronjob = client.V1CronJob(
-            api_version="batch/v1",
-            kind="CronJob",
-            metadata=client.V1ObjectMeta(name=cronjob_name, labels={"locust": name}),
-            spec=spec_cronjob,
-        )
-        api_instance = client.BatchV1Api()
-        api_instance.replace_namespaced_cron_job(
-            name=cronjob_name, body=cronjob, namespace=namespace
+        cronjob = get_cronjob_body(name, cronjob_name, job_name, spec, owner)
+        api_instance = get_batch_api()
+        api_instance.patch_namespaced_cron_job(
+            name=cronjob_name, body=get_replace_patch(cronjob), namespace=namespace
         )
         log.info(f"Cronjob updated for {cronjob_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Update cronjob {cronjob_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Update cronjob {cronjob_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Update cronjob {cronjob_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def delete_cronjob(cronjob_name: str, namespace: str):
     try:
-        api_instance = client.BatchV1Api()
+        api_instance = get_batch_api()
         api_instance.delete_namespaced_cron_job(
             name=cronjob_name,
             namespace=namespace,
-            body=client.V1DeleteOptions(
-                propagation_policy="Foreground", grace_period_seconds=0
-            ),
+            body=get_delete_options(),
         )
         log.info(f"Cronjob deleted for {cronjob_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Delete cronjob {cronjob_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Delete cronjob {cronjob_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Delete cronjob {cronjob_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def create_replica_set(
@@ -430,76 +571,76 @@ def create_replica_set(
     replicaset_name: str,
     service_name: str,
     namespace: str,
-    workers: int,
-    image: str,
-    image_pull_secret: str,
-    command: str,
-    configmap: str,
-    secret: str,
-    mount_external_config: dict,
-    mount_external_secret: dict,
+    spec: LocustSpec,
+    owner: list = None,
 ):
     try:
-        volumes, volume_mounts = get_volumes(
-            mount_external_config, mount_external_secret
-        )
-        container = client.V1Container(
-            name="locust",
-            image=image,
-            command=command,
-            args=get_command_worker(service_name),
-            env_from=get_env_from(secret, configmap),
-            volume_mounts=volume_mounts,
-        )
-        template = client.V1PodTemplateSpec(
-            metadata=client.V1ObjectMeta(name=replicaset_name, labels={"locust": name}),
-            spec=client.V1PodSpec(
-                containers=[container],
-                volumes=volumes,
-                image_pull_secrets=get_image_pull_secret(image_pull_secret),
-            ),
+        replica_set = get_replica_set_body(
+            name, replicaset_name, service_name, spec, owner
         )
-        spec = client.V1ReplicaSetSpec(
-            selector=client.V1LabelSelector(match_labels={"locust": name}),
-            replicas=workers,
-            template=template,
-        )
-        replica_set = client.V1ReplicaSet(
-            api_version="apps/v1",
-            kind="ReplicaSet",
-            metadata=client.V1ObjectMeta(name=replicaset_name, labels={"locust": name}),
-            spec=spec,
-        )
-        api_instance = client.AppsV1Api()
+        api_instance = get_apps_api()
         api_instance.create_namespaced_replica_set(
             body=replica_set, namespace=namespace
         )
         log.info(f"ReplicaSet created for {replicaset_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Create replicaset {replicaset_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Create replicaset {replicaset_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Create replicaset {replicaset_name} exception")
+        if is_retryable(e):
+            raise
 
 
 def delete_replica_set(replicaset_name: str, namespace: str):
     try:
-        api_instance = client.AppsV1Api()
+        api_instance = get_apps_api()
         api_instance.delete_namespaced_replica_set(
             name=replicaset_name,
             namespace=namespace,
-            body=client.V1DeleteOptions(
-                propagation_policy="Foreground", grace_period_seconds=0
-            ),
+            body=get_delete_options(),
         )
         log.info(f"ReplicaSet deleted for {replicaset_name}")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Delete replicaset {replicaset_name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Delete replicaset {replicaset_name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Delete replicaset {replicaset_name} exception")
+        if is_retryable(e):
+            raise
+
+
+def get_delete_collection(kind: str) -> Callable:
+    return {
+        "Job": get_batch_api().delete_collection_namespaced_job,
+        "CronJob": get_batch_api().delete_collection_namespaced_cron_job,
+        "ReplicaSet": get_apps_api().delete_collection_namespaced_replica_set,
+        "Service": get_core_api().delete_collection_namespaced_service,
+    }[kind]
+
+
+def delete_collection(kind: str, namespace: str, label_selector: str):
+    try:
+        get_delete_collection(kind)(
+            namespace, label_selector=label_selector, body=get_delete_options()
+        )
+        log.info(f"{kind} objects deleted for {label_selector}")
+    except client.exceptions.ApiException as e:
+        log.info(f"Delete {kind} objects {label_selector} exception")
+        if log.getEffectiveLevel() == logging.DEBUG:
+            log.exception(f"Delete {kind} objects {label_selector} exception")
+        if is_retryable(e):
+            raise
+    except Exception as e:
+        log.exception(f"Delete {kind} objects {label_selector} exception")
+        if is_retryable(e):
+            raise
 
 
 def delete_locust_object(
@@ -509,8 +650,7 @@ def delete_locust_object(
     plural: str,
     name: str,
 ):
-    api_client = client.ApiClient()
-    custom_api = client.CustomObjectsApi(api_client)
+    custom_api = get_custom_api()
     try:
         custom_api.delete_namespaced_custom_object(
             group,
@@ -520,12 +660,16 @@ def delete_locust_object(
             name,
         )
         log.info(f"Locust object {name} deleted.")
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Delete Locust object {name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Delete Locust object {name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Delete Locust object {name} exception")
+        if is_retryable(e):
+            raise
 
 
 def get_locust_object(
@@ -535,8 +679,7 @@ def get_locust_object(
     plural: str,
     name: str,
 ):
-    api_client = client.ApiClient()
-    custom_api = client.CustomObjectsApi(api_client)
+    custom_api = get_custom_api()
     try:
         api_response = custom_api.get_namespaced_custom_object(
             group,
@@ -547,9 +690,13 @@ def get_locust_object(
         )
         log.info(f"Locust object {name} retrieved.")
         return api_response
-    except client.exceptions.ApiException:
+    except client.exceptions.ApiException as e:
         log.info(f"Retrieve Locust object {name} exception")
         if log.getEffectiveLevel() == logging.DEBUG:
             log.exception(f"Retrieve Locust object {name} exception")
-    except Exception:
+        if is_retryable(e):
+            raise
+    except Exception as e:
         log.exception(f"Retrieve Locust object {name} exception")
+        if is_retryable(e):
+            raise
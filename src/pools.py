@@ -0,0 +1,171 @@
+import logging
+import time
+from datetime import datetime, timezone
+
+from kubernetes import client
+
+from src.cache import get_key
+from src.clients import get_core_api, get_apps_api, is_retryable
+from src.constants import (
+    HTTP_STATUS_NOT_FOUND,
+    HTTP_STATUS_CONFLICT,
+    POOL_LABEL,
+    POOL_CLAIM_ANNOTATION,
+    POOL_RELEASE_ANNOTATION,
+    WORKER_POOL_TTL_SECONDS,
+    WORKER_POOL_REAP_SECONDS,
+)
+from src.controller import LocustSpec, get_annotation
+from src.objects import (
+    get_delete_options,
+    get_idle_selector,
+    get_pool_replica_set_body,
+    get_pool_service_body,
+)
+from src.sharding import Sharder
+
+log = logging.getLogger(__name__)
+
+
+def read_pool_service(pool_name: str, namespace: str) -> client.V1Service:
+    try:
+        return get_core_api().read_namespaced_service(pool_name, namespace)
+    except client.exceptions.ApiException as e:
+        if e.status != HTTP_STATUS_NOT_FOUND:
+            raise
+        return None
+
+
+def claim_pool(name: str, job_name: str, namespace: str, spec: LocustSpec) -> bool:
+    # Point the idle workers of the pool to the master of job_name, False when the pool
+    # is used by another run
+    pool_name = spec.worker_pool
+    core_api = get_core_api()
+    apps_api = get_apps_api()
+    selector = {"app": job_name, "locust": name}
+    try:
+        service = read_pool_service(pool_name, namespace)
+        if service is None:
+            service = get_pool_service_body(pool_name, selector)
+            service.metadata.annotations = {POOL_CLAIM_ANNOTATION: name}
+            core_api.create_namespaced_service(namespace, service)
+        else:
+            claimed_by = get_annotation(service, POOL_CLAIM_ANNOTATION)
+            if claimed_by and claimed_by != name:
+                log.info(f"Worker pool {pool_name} is used by Locust {claimed_by}")
+                return False
+            if claimed_by == name and service.spec.selector == selector:
+                return True
+            service.metadata.annotations = {
+                **(service.metadata.annotations or {}),
+                POOL_CLAIM_ANNOTATION: name,
+            }
+            service.spec.selector = selector
+            # Fails with a conflict when another run claimed it since the read
+            core_api.replace_namespaced_service(pool_name, namespace, service)
+        try:
+            apps_api.create_namespaced_replica_set(
+                namespace, get_pool_replica_set_body(pool_name, spec)
+            )
+            log.info(f"Worker pool {pool_name} created for Locust {name}")
+        except client.exceptions.ApiException as e:
+            if e.status != HTTP_STATUS_CONFLICT:
+                raise
+            apps_api.patch_namespaced_replica_set_scale(
+                pool_name, namespace, {"spec": {"replicas": spec.workers}}
+            )
+            log.info(f"Worker pool {pool_name} claimed by Locust {name}")
+        return True
+    except client.exceptions.ApiException as e:
+        log.info(f"Claim worker pool {pool_name} exception: {e.reason}")
+        if log.getEffectiveLevel() == logging.DEBUG:
+            log.exception(f"Claim worker pool {pool_name} exception")
+        # The run gets its own workers only when the pool was deleted or claimed by
+        # another run since the read, the reconcile is requeued on any other error
+        if is_retryable(e) or e.status not in (
+            HTTP_STATUS_NOT_FOUND,
+            HTTP_STATUS_CONFLICT,
+        ):
+            raise
+    except Exception:
+        log.exception(f"Claim worker pool {pool_name} exception")
+        raise
+    return False
+
+
+def release_pool(pool_name: str, name: str, namespace: str):
+    # Return the workers to the pool instead of deleting them
+    try:
+        service = read_pool_service(pool_name, namespace)
+        if get_annotation(service, POOL_CLAIM_ANNOTATION) != name:
+            return
+        annotations = dict(service.metadata.annotations or {})
+        annotations.pop(POOL_CLAIM_ANNOTATION, None)
+        annotations[POOL_RELEASE_ANNOTATION] = datetime.now(timezone.utc).isoformat()
+        service.metadata.annotations = annotations
+        service.spec.selector = get_idle_selector(pool_name)
+        get_core_api().replace_namespaced_service(pool_name, namespace, service)
+        log.info(f"Worker pool {pool_name} released by Locust {name}")
+    except client.exceptions.ApiException:
+        log.info(f"Release worker pool {pool_name} exception")
+        if log.getEffectiveLevel() == logging.DEBUG:
+            log.exception(f"Release worker pool {pool_name} exception")
+    except Exception:
+        log.exception(f"Release worker pool {pool_name} exception")
+
+
+def is_expired(service: client.V1Service, now: datetime) -> bool:
+    if get_annotation(service, POOL_CLAIM_ANNOTATION):
+        return False
+    released_at = get_annotation(service, POOL_RELEASE_ANNOTATION)
+    if not released_at:
+        return False
+    idle = now - datetime.fromisoformat(released_at)
+    return idle.total_seconds() > WORKER_POOL_TTL_SECONDS
+
+
+def reap_pools(namespaces: list, sharder: Sharder = None):
+    core_api = get_core_api()
+    apps_api = get_apps_api()
+    now = datetime.now(timezone.utc)
+    if namespaces == ["*"]:
+        services = core_api.list_service_for_all_namespaces(
+            label_selector=POOL_LABEL
+        ).items
+    else:
+        services = [
+            service
+            for namespace in namespaces
+            for service in core_api.list_namespaced_service(
+                namespace, label_selector=POOL_LABEL
+            ).items
+        ]
+    for service in services:
+        pool_name = service.metadata.name
+        namespace = service.metadata.namespace
+        if sharder and not sharder.owns(get_key(namespace, pool_name)):
+            continue
+        if not is_expired(service, now):
+            continue
+        log.info(f"Worker pool {pool_name} idle for too long, deleting it")
+        # The precondition fails if a run claimed the pool since the list
+        body = get_delete_options()
+        body.preconditions = client.V1Preconditions(
+            resource_version=service.metadata.resource_version
+        )
+        try:
+            core_api.delete_namespaced_service(pool_name, namespace, body=body)
+            apps_api.delete_namespaced_replica_set(
+                pool_name, namespace, body=get_delete_options()
+            )
+        except client.exceptions.ApiException:
+            log.info(f"Delete worker pool {pool_name} exception")
+
+
+def run_reaper(namespaces: list, sharder: Sharder = None):
+    while True:
+        try:
+            reap_pools(namespaces, sharder)
+        except Exception:
+            log.exception("Reap worker pools exception")
+        time.sleep(WORKER_POOL_REAP_SECONDS)
@@ -0,0 +1,33 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, qps: float, burst: int):
+        self.qps = qps
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # Take a token and return how long to wait before using it
+        if self.qps <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.qps)
+            self._last = now
+            self._tokens -= 1
+            return -self._tokens / self.qps if self._tokens < 0 else 0
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+def get_backoff(failures: int, base: float, maximum: float) -> float:
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(maximum, base * 2**failures))
@@ -0,0 +1,314 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.autoscaler import get_master_stats
+from src.cache import JOB_STORE, get_key, get_locust_label
+from src.constants import RESULTS_INTERVAL_SECONDS, RESULTS_WINDOW_SECONDS
+from src.histogram import LogHistogram
+from src.sharding import Sharder
+from src.status import update_result
+
+log = logging.getLogger(__name__)
+
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("run", pa.string()),
+        ("method", pa.string()),
+        ("name", pa.string()),
+        ("num_requests", pa.int64()),
+        ("num_failures", pa.int64()),
+        ("avg_response_time", pa.float64()),
+        ("min_response_time", pa.float64()),
+        ("max_response_time", pa.float64()),
+        ("median_response_time", pa.float64()),
+        ("ninetieth_response_time", pa.float64()),
+        ("ninety_ninth_response_time", pa.float64()),
+        ("current_rps", pa.float64()),
+        ("current_fail_per_sec", pa.float64()),
+        ("user_count", pa.int64()),
+    ]
+)
+
+PERCENTILE_FIELDS = [
+    (0, "min_response_time"),
+    (0.5, "median_response_time"),
+    (0.9, "ninetieth_response_time"),
+    (0.99, "ninety_ninth_response_time"),
+    (1, "max_response_time"),
+]
+
+
+def get_anchors(row: dict) -> list:
+    # The named percentiles, and the response_time_percentile_<q> of the newer Locust
+    # versions, e.g. the 95th
+    anchors = [(q, row.get(field)) for q, field in PERCENTILE_FIELDS]
+    for field, value in row.items():
+        if field.startswith("response_time_percentile_"):
+            anchors.append((float(field.rsplit("_", 1)[1]), value))
+    return anchors
+
+
+def get_run_dir(results_dir: str, namespace: str, name: str) -> str:
+    return os.path.join(results_dir, namespace, name)
+
+
+def get_batch(run: str, stats: dict, now: datetime) -> pa.RecordBatch:
+    rows = stats.get("stats", [])
+    columns = {
+        "timestamp": [now] * len(rows),
+        "run": [run] * len(rows),
+        "user_count": [stats.get("user_count")] * len(rows),
+    }
+    for field in SCHEMA:
+        if field.name not in columns:
+            columns[field.name] = [row.get(field.name) for row in rows]
+    return pa.RecordBatch.from_pydict(columns, schema=SCHEMA)
+
+
+# One Arrow IPC stream per run, every poll of the master appends one record batch
+class ResultsWriter:
+    def __init__(self, results_dir: str, namespace: str, name: str, run: str):
+        run_dir = get_run_dir(results_dir, namespace, name)
+        os.makedirs(run_dir, exist_ok=True)
+        # A restarted operator starts a new segment instead of rewriting the stream
+        segment = 0
+        while os.path.exists(os.path.join(run_dir, f"{run}.{segment}.arrows")):
+            segment += 1
+        self.path = os.path.join(run_dir, f"{run}.{segment}.arrows")
+        self.run = run
+        self._sink = pa.OSFile(self.path, "wb")
+        self._writer = pa.ipc.new_stream(self._sink, SCHEMA)
+        self._histogram_file = open(
+            os.path.join(run_dir, f"{run}.{segment}.histograms.jsonl"), "w"
+        )
+        # The first poll of a restarted operator only sets the request counts
+        self._requests = None if segment else {}
+        self._histograms = defaultdict(LogHistogram)
+        self._window_start = None
+
+    def write(self, stats: dict, now: datetime):
+        batch = get_batch(self.run, stats, now)
+        if batch.num_rows:
+            self._writer.write_batch(batch)
+            self._sink.flush()
+        self.add_histograms(stats.get("stats", []), now)
+
+    def add_histograms(self, rows: list, now: datetime):
+        if self._window_start is None:
+            self._window_start = now
+        elif (now - self._window_start).total_seconds() >= RESULTS_WINDOW_SECONDS:
+            self.flush_histograms(now)
+        requests = {}
+        for row in rows:
+            key = (row.get("method"), row.get("name"))
+            requests[key] = row.get("num_requests") or 0
+            if self._requests is None:
+                continue
+            count = requests[key] - self._requests.get(key, 0)
+            if count > 0:
+                # Locust reports percentiles, not samples, the new requests are spread
+                # along them
+                self._histograms[key].add_anchors(count, get_anchors(row))
+        self._requests = requests
+
+    def flush_histograms(self, now: datetime):
+        for (method, name), histogram in self._histograms.items():
+            line = {
+                "run": self.run,
+                "method": method,
+                "name": name,
+                "start": self._window_start.isoformat(),
+                "end": now.isoformat(),
+                **histogram.to_dict(),
+            }
+            self._histogram_file.write(json.dumps(line) + "\n")
+        self._histogram_file.flush()
+        self._histograms.clear()
+        self._window_start = now
+
+    def close(self):
+        self.flush_histograms(datetime.now(timezone.utc))
+        self._histogram_file.close()
+        self._writer.close()
+        self._sink.close()
+
+
+# Stream the per-endpoint stats of the running masters into the results directory
+class Collector:
+    def __init__(self, results_dir: str, sharder: Sharder = None):
+        self.results_dir = results_dir
+        self.sharder = sharder
+        self.writers = {}
+
+    def get_running_jobs(self) -> dict:
+        jobs = {}
+        for job in JOB_STORE.list():
+            name = get_locust_label(job)
+            namespace = job.metadata.namespace
+            if not name or not job.status or not job.status.active:
+                continue
+            if self.sharder and not self.sharder.owns(get_key(namespace, name)):
+                continue
+            jobs[job.metadata.uid] = (namespace, name, job.metadata.name)
+        return jobs
+
+    def step(self):
+        jobs = self.get_running_jobs()
+        for uid in set(self.writers) - set(jobs):
+            self.writers.pop(uid).close()
+        now = datetime.now(timezone.utc)
+        for uid, (namespace, name, job_name) in jobs.items():
+            stats = get_master_stats(name, namespace)
+            if not stats:
+                continue
+            update_result(namespace, name, stats)
+            if uid not in self.writers:
+                self.writers[uid] = ResultsWriter(
+                    self.results_dir, namespace, name, job_name
+                )
+                log.info(
+                    f"Collecting the stats of {job_name} in {self.writers[uid].path}"
+                )
+            try:
+                self.writers[uid].write(stats, now)
+            except Exception:
+                log.exception(f"Write stats of {job_name} exception")
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                log.exception("Collect stats exception")
+            time.sleep(RESULTS_INTERVAL_SECONDS)
+
+
+def read_segment(path: str):
+    # Tolerates the last batch of a stream still being written
+    with pa.OSFile(path, "rb") as source:
+        try:
+            reader = pa.ipc.open_stream(source)
+            while True:
+                yield reader.read_next_batch()
+        except (StopIteration, pa.ArrowInvalid):
+            return
+
+
+def get_utc(moment: datetime) -> datetime:
+    if moment and moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def query(
+    results_dir: str,
+    namespace: str,
+    name: str,
+    start: datetime = None,
+    end: datetime = None,
+    run: str = None,
+):
+    # Yield the record batches of a time range one at a time, runs are never loaded whole
+    start, end = get_utc(start), get_utc(end)
+    run_dir = get_run_dir(results_dir, namespace, name)
+    if not os.path.isdir(run_dir):
+        return
+    for filename in sorted(os.listdir(run_dir)):
+        if not filename.endswith(".arrows"):
+            continue
+        if run and filename.rsplit(".", 2)[0] != run:
+            continue
+        for batch in read_segment(os.path.join(run_dir, filename)):
+            timestamps = batch.column("timestamp")
+            if start and pc.max(timestamps).as_py() < start:
+                continue
+            if end and pc.min(timestamps).as_py() > end:
+                # Batches are appended in time order
+                break
+            mask = pc.and_(
+                pc.greater_equal(timestamps, start or timestamps[0]),
+                pc.less_equal(timestamps, end or timestamps[-1]),
+            )
+            batch = batch.filter(mask)
+            if batch.num_rows:
+                yield batch
+
+
+def get_histograms(
+    results_dir: str,
+    namespace: str,
+    name: str,
+    start: datetime = None,
+    end: datetime = None,
+    run: str = None,
+) -> dict:
+    # Merge the windows within the time range, per endpoint, e.g. over all the runs of
+    # a month
+    start, end = get_utc(start), get_utc(end)
+    histograms = defaultdict(LogHistogram)
+    run_dir = get_run_dir(results_dir, namespace, name)
+    if not os.path.isdir(run_dir):
+        return histograms
+    for filename in sorted(os.listdir(run_dir)):
+        if not filename.endswith(".histograms.jsonl"):
+            continue
+        if run and filename.rsplit(".", 3)[0] != run:
+            continue
+        with open(os.path.join(run_dir, filename)) as lines:
+            for line in lines:
+                window = json.loads(line)
+                if start and datetime.fromisoformat(window["end"]) < start:
+                    continue
+                if end and datetime.fromisoformat(window["start"]) > end:
+                    continue
+                key = (window["method"], window["name"])
+                histograms[key].merge(LogHistogram.from_dict(window))
+    return histograms
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Query the stats of the Locust runs")
+    parser.add_argument("namespace")
+    parser.add_argument("name", help="name of the Locust object")
+    parser.add_argument("--results-dir", default=os.getenv("RESULTS_DIR", "."))
+    parser.add_argument("--run", help="name of the Job of one run")
+    parser.add_argument("--start", type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument(
+        "--percentiles",
+        action="store_true",
+        help="print the percentiles of the merged response times per endpoint",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    writer = csv.writer(sys.stdout)
+    if args.percentiles:
+        writer.writerow(["method", "name", "num_requests", "p50", "p95", "p99"])
+        histograms = get_histograms(
+            args.results_dir, args.namespace, args.name, args.start, args.end, args.run
+        )
+        for (method, name), histogram in sorted(histograms.items(), key=str):
+            writer.writerow(
+                [method, name, round(histogram.count)]
+                + [histogram.quantile(q) for q in (0.5, 0.95, 0.99)]
+            )
+    else:
+        writer.writerow(SCHEMA.names)
+        for batch in query(
+            args.results_dir, args.namespace, args.name, args.start, args.end, args.run
+        ):
+            writer.writerows(zip(*(column.to_pylist() for column in batch.columns)))
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from prometheus_client.metrics import MetricWrapperBase
+
+from src.constants import (
+    GAUGE_LOCUST_OBJECT,
+    ENUM_LOCUST_OBJECT_STATE,
+    GAUGE_JOB_OBJECT,
+    ENUM_JOB_OBJECT_STATE,
+    GAUGE_AUTOSCALE_WORKERS,
+    GAUGE_AUTOSCALE_WORKER_CPU,
+    GAUGE_WORKER_PROCESSES,
+    GAUGE_DEGRADED_WORKERS,
+    GAUGE_METRIC_SERIES,
+    METRICS_RETENTION_SECONDS,
+    METRICS_RETENTION_RUNS,
+    METRICS_EXPIRY_INTERVAL_SECONDS,
+)
+
+log = logging.getLogger(__name__)
+
+
+def remove_series(series: set):
+    for metric, label_values in series:
+        try:
+            metric.remove(*label_values)
+        except KeyError:
+            pass
+
+
+# Drop the label sets of the finished runs from the registry, after a TTL or once a
+# Locust object has more finished runs than it keeps. The metrics are labelled through
+# labels() so that the label sets to remove are known
+class SeriesRetention:
+    def __init__(
+        self,
+        object_metrics: list,
+        run_metrics: list,
+        ttl_seconds: int = METRICS_RETENTION_SECONDS,
+        runs: int = METRICS_RETENTION_RUNS,
+    ):
+        self.object_metrics = object_metrics
+        self.run_metrics = run_metrics
+        self.ttl_seconds = ttl_seconds
+        self.runs = runs
+        self._lock = threading.Lock()
+        # (namespace, Locust name) -> {job name: finished at}, in the order the runs
+        # finished
+        self._finished_runs = defaultdict(OrderedDict)
+        # (namespace, Locust name) -> deleted at
+        self._deleted_objects = {}
+        # (namespace, Locust name) -> {job name, None for the object metrics:
+        # {(metric, label values)}}
+        self._series = defaultdict(lambda: defaultdict(set))
+        for metric in object_metrics + run_metrics:
+            GAUGE_METRIC_SERIES.labels(metric=metric.describe()[0].name).set_function(
+                lambda metric=metric: self.get_series_count(metric)
+            )
+
+    def labels(self, metric: MetricWrapperBase, *label_values: str):
+        # The label names of the metrics start with namespace and name, then job_name
+        # for the run metrics, the full label set is removed once expired
+        namespace, name = label_values[:2]
+        job_name = label_values[2] if metric in self.run_metrics else None
+        with self._lock:
+            self._series[(namespace, name)][job_name].add((metric, label_values))
+        return metric.labels(*label_values)
+
+    def get_series_count(self, metric: MetricWrapperBase) -> int:
+        with self._lock:
+            return sum(
+                series_metric is metric
+                for runs in self._series.values()
+                for series in runs.values()
+                for series_metric, _ in series
+            )
+
+    def start(self, namespace: str, name: str, job_name: str = None):
+        # A Locust object or Job created again with the same name keeps its series
+        with self._lock:
+            if job_name:
+                self._finished_runs[(namespace, name)].pop(job_name, None)
+            else:
+                self._deleted_objects.pop((namespace, name), None)
+
+    def finish(self, namespace: str, name: str, job_name: str = None):
+        with self._lock:
+            if not job_name:
+                self._deleted_objects[(namespace, name)] = time.monotonic()
+                return
+            runs = self._finished_runs[(namespace, name)]
+            runs[job_name] = time.monotonic()
+            runs.move_to_end(job_name)
+            dropped = []
+            while self.runs and len(runs) > self.runs:
+                dropped.append(runs.popitem(last=False)[0])
+        for job_name in dropped:
+            self.remove_run(namespace, name, job_name)
+
+    def remove_run(self, namespace: str, name: str, job_name: str):
+        with self._lock:
+            runs = self._series.get((namespace, name), {})
+            series = runs.pop(job_name, set())
+            if not runs:
+                self._series.pop((namespace, name), None)
+        remove_series(series)
+
+    def remove_object(self, namespace: str, name: str):
+        with self._lock:
+            runs = self._series.pop((namespace, name), {})
+        remove_series(set().union(*runs.values()))
+
+    def expire(self):
+        if not self.ttl_seconds:
+            return
+        deadline = time.monotonic() - self.ttl_seconds
+        with self._lock:
+            runs = [
+                (key, job_name)
+                for key, finished in self._finished_runs.items()
+                for job_name, finished_at in finished.items()
+                if finished_at < deadline
+            ]
+            for key, job_name in runs:
+                del self._finished_runs[key][job_name]
+            objects = [
+                key
+                for key, deleted_at in self._deleted_objects.items()
+                if deleted_at < deadline
+            ]
+            for key in objects:
+                del self._deleted_objects[key]
+                self._finished_runs.pop(key, None)
+            for key in [key for key, runs in self._finished_runs.items() if not runs]:
+                del self._finished_runs[key]
+        for (namespace, name), job_name in runs:
+            self.remove_run(namespace, name, job_name)
+        for namespace, name in objects:
+            self.remove_object(namespace, name)
+        if runs or objects:
+            log.debug(
+                f"Dropped the series of {len(runs)} runs and {len(objects)} Locust objects"
+            )
+
+    def run(self):
+        while True:
+            try:
+                self.expire()
+            except Exception:
+                log.exception("Expire metric series exception")
+            time.sleep(METRICS_EXPIRY_INTERVAL_SECONDS)
+
+
+SERIES_RETENTION = SeriesRetention(
+    [
+        GAUGE_LOCUST_OBJECT,
+        ENUM_LOCUST_OBJECT_STATE,
+        GAUGE_AUTOSCALE_WORKERS,
+        GAUGE_AUTOSCALE_WORKER_CPU,
+        GAUGE_WORKER_PROCESSES,
+        GAUGE_DEGRADED_WORKERS,
+    ],
+    [GAUGE_JOB_OBJECT, ENUM_JOB_OBJECT_STATE],
+)
@@ -0,0 +1,83 @@
+import threading
+from typing import Callable
+
+from src.autoscaler import Autoscaler
+from src.constants import (
+    CRD_GROUP,
+    CRD_VERSION,
+    CRD_PLURAL,
+    WATCH_NAMESPACES,
+    RESULTS_DIR,
+    GAUGE_LOCUST_OBJECT,
+    ENUM_LOCUST_OBJECT_STATE,
+    GAUGE_JOB_OBJECT,
+    ENUM_JOB_OBJECT_STATE,
+)
+from src.listeners import (
+    watch_locust_events,
+    watch_job_events,
+    watch_replica_set_events,
+)
+from src.pools import run_reaper
+from src.retention import SERIES_RETENTION
+from src.sharding import Sharder
+from src.status import STATUS_WRITER
+from src.workqueue import WorkQueue
+
+# What the jobs and locusts roles run, the same in the threaded and asyncio modes
+
+
+def is_jobs_role(args) -> bool:
+    return args.jobs or not args.locusts
+
+
+def is_locusts_role(args) -> bool:
+    return args.locusts or not args.jobs
+
+
+def start_thread(target: Callable, *args, name: str) -> threading.Thread:
+    t = threading.Thread(target=target, args=args, name=name)
+    t.daemon = True
+    t.start()
+    return t
+
+
+def start_loops(args, sharder: Sharder):
+    # Loops that never return, each on its own thread
+    if sharder:
+        start_thread(sharder.run, name="sharder")
+    start_thread(SERIES_RETENTION.run, name="retention")
+    start_thread(STATUS_WRITER.run, sharder, name="status")
+    if is_jobs_role(args):
+        # The jobs role manages the worker ReplicaSets
+        start_thread(Autoscaler(sharder).run, name="autoscaler")
+        start_thread(run_reaper, WATCH_NAMESPACES, sharder, name="reaper")
+    if RESULTS_DIR and is_jobs_role(args):
+        # pyarrow is only needed with a results directory
+        from src.results import Collector
+
+        start_thread(Collector(RESULTS_DIR, sharder).run, name="collector")
+
+
+def watch_events(args, informers: dict, queue: WorkQueue, sharder: Sharder):
+    if is_jobs_role(args):
+        watch_job_events(
+            informers["Job"],
+            queue,
+            sharder,
+            CRD_GROUP,
+            CRD_VERSION,
+            CRD_PLURAL,
+            GAUGE_JOB_OBJECT,
+            ENUM_JOB_OBJECT_STATE,
+        )
+        watch_replica_set_events(informers["ReplicaSet"], sharder)
+    if is_locusts_role(args):
+        watch_locust_events(
+            informers["Locust"],
+            queue,
+            sharder,
+            GAUGE_LOCUST_OBJECT,
+            ENUM_LOCUST_OBJECT_STATE,
+            args.reconcile_workers,
+        )
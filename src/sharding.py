@@ -0,0 +1,206 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Callable
+
+from kubernetes import client
+
+from src.clients import get_coordination_api
+from src.election import LeaderElector
+from src.constants import (
+    HTTP_STATUS_NOT_FOUND,
+    HTTP_STATUS_CONFLICT,
+    NAMESPACE,
+    POD_NAME,
+    SHARD_LEASE_LABEL,
+    SHARD_LEASE_SECONDS,
+    SHARD_LEASE_GC_DURATIONS,
+    SHARD_RENEW_SECONDS,
+    SHARD_VIRTUAL_NODES,
+    GAUGE_SHARD_MEMBERS,
+)
+
+log = logging.getLogger(__name__)
+
+
+def get_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+# Consistent hashing: when a replica comes or goes only its share of the keys moves
+class HashRing:
+    def __init__(self, members: list, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self._ring = sorted(
+            (get_hash(f"{member}#{i}"), member)
+            for member in members
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in self._ring]
+
+    def get(self, key: str) -> str:
+        if not self._ring:
+            return None
+        i = bisect.bisect(self._hashes, get_hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+
+def is_expired(lease: client.V1Lease, now: datetime, durations: int = 1) -> bool:
+    renew_time = lease.spec.renew_time or lease.spec.acquire_time
+    if not renew_time:
+        return True
+    duration = lease.spec.lease_duration_seconds or SHARD_LEASE_SECONDS
+    return renew_time + timedelta(seconds=duration * durations) < now
+
+
+# Split the Locust objects between the operator replicas, every replica holds a Lease
+# and the live ones form the hash ring
+class Sharder:
+    def __init__(self, identity: str, lease_name: str, namespace: str):
+        self.identity = identity
+        self.lease_name = lease_name
+        self.namespace = namespace
+        self.members = [identity]
+        self.ring = HashRing(self.members)
+        self.handlers = []
+        self.renewed_at = None
+        # Set on shutdown, the lease is not renewed any more
+        self.released = False
+        self._lock = threading.Lock()
+
+    def add_handler(self, handler: Callable):
+        self.handlers.append(handler)
+
+    def owns(self, key: str) -> bool:
+        # Without a live lease the other replicas may already have taken our keys
+        if (
+            self.renewed_at is None
+            or time.monotonic() - self.renewed_at > SHARD_LEASE_SECONDS
+        ):
+            return False
+        return self.ring.get(key) == self.identity
+
+    def set_members(self, members: list, force: bool = False) -> Callable:
+        # Returns whether a key is newly owned, for replay once the lease is renewed,
+        # None when the ring did not change
+        members = sorted(set(members) | {self.identity})
+        if members == self.members and not force:
+            return None
+        old_ring = None if force else self.ring
+        self.members = members
+        self.ring = HashRing(members)
+        GAUGE_SHARD_MEMBERS.set(len(members))
+        log.info(f"Shards rebalanced between {members}")
+        return lambda key: self.owns(key) and (
+            old_ring is None or old_ring.get(key) != self.identity
+        )
+
+    def replay(self, is_new_key: Callable):
+        for handler in self.handlers:
+            handler(is_new_key)
+
+    def get_lease_body(self, now: datetime) -> client.V1Lease:
+        return client.V1Lease(
+            metadata=client.V1ObjectMeta(
+                name=self.lease_name, labels={SHARD_LEASE_LABEL: "true"}
+            ),
+            spec=client.V1LeaseSpec(
+                holder_identity=self.identity,
+                lease_duration_seconds=SHARD_LEASE_SECONDS,
+                renew_time=now,
+            ),
+        )
+
+    def heartbeat(self):
+        api_instance = get_coordination_api()
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        body = self.get_lease_body(now)
+        try:
+            api_instance.patch_namespaced_lease(self.lease_name, self.namespace, body)
+        except client.exceptions.ApiException as e:
+            if e.status != HTTP_STATUS_NOT_FOUND:
+                raise
+            api_instance.create_namespaced_lease(self.namespace, body)
+        # Keys were dropped while the lease was not held, replay all the owned ones
+        lapsed = (
+            self.renewed_at is None or started - self.renewed_at > SHARD_LEASE_SECONDS
+        )
+        leases = api_instance.list_namespaced_lease(
+            self.namespace, label_selector=SHARD_LEASE_LABEL
+        )
+        # The ring is up to date before the keys are owned again, or for one heartbeat
+        # a lone member would own them all
+        is_new_key = self.set_members(
+            [
+                lease.spec.holder_identity
+                for lease in leases.items
+                if lease.spec.holder_identity and not is_expired(lease, now)
+            ],
+            force=lapsed,
+        )
+        self.renewed_at = started
+        if is_new_key:
+            self.replay(is_new_key)
+        for lease in leases.items:
+            if is_expired(lease, now, SHARD_LEASE_GC_DURATIONS):
+                self.delete_lease(lease)
+
+    def delete_lease(self, lease: client.V1Lease):
+        # Fails with a conflict when the replica renewed it since the list, or with a
+        # not found when another replica deleted it first
+        name = lease.metadata.name
+        try:
+            get_coordination_api().delete_namespaced_lease(
+                name,
+                self.namespace,
+                body=client.V1DeleteOptions(
+                    preconditions=client.V1Preconditions(
+                        resource_version=lease.metadata.resource_version
+                    )
+                ),
+            )
+            log.info(f"Deleted the expired shard lease {name}")
+        except client.exceptions.ApiException as e:
+            if e.status not in (HTTP_STATUS_NOT_FOUND, HTTP_STATUS_CONFLICT):
+                raise
+
+    def release(self):
+        # On shutdown: the other replicas take over our keys at their next heartbeat
+        # instead of once the lease expires
+        with self._lock:
+            self.released = True
+            self.renewed_at = None
+            try:
+                get_coordination_api().delete_namespaced_lease(
+                    self.lease_name, self.namespace
+                )
+                log.info(f"Deleted the shard lease {self.lease_name}")
+            except client.exceptions.ApiException as e:
+                if e.status != HTTP_STATUS_NOT_FOUND:
+                    log.info(
+                        f"Delete shard lease {self.lease_name} exception: {e.reason}"
+                    )
+
+    def run(self):
+        while True:
+            with self._lock:
+                if self.released:
+                    return
+                try:
+                    self.heartbeat()
+                except Exception:
+                    log.exception(f"Renew shard lease {self.lease_name} exception")
+            time.sleep(SHARD_RENEW_SECONDS)
+
+
+def create_sharder(args):
+    # Decides which Locust objects this replica reconciles, None for all of them
+    role = "jobs" if args.jobs else "locusts" if args.locusts else "all"
+    if args.sharding:
+        return Sharder(POD_NAME, f"locust-operator-{POD_NAME}-{role}", NAMESPACE)
+    if args.leader_elect:
+        return LeaderElector(POD_NAME, f"locust-operator-{role}", NAMESPACE)
+    return None
@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from kubernetes import client
+
+from src.cache import LOCUST_STORE, get_key
+from src.clients import get_custom_api
+from src.constants import (
+    HTTP_STATUS_NOT_FOUND,
+    CRD_GROUP,
+    CRD_VERSION,
+    CRD_PLURAL,
+    STATUS_INTERVAL_SECONDS,
+    STATUS_QPS,
+    STATUS_BURST,
+)
+from src.ratelimit import TokenBucket
+from src.sharding import Sharder
+
+log = logging.getLogger(__name__)
+
+
+def get_time(moment: datetime = None) -> str:
+    return (moment or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def get_result(stats: dict) -> dict:
+    # Totals of the run so far, from the Aggregated row of the master stats
+    for row in stats.get("stats", []):
+        if row.get("name") == "Aggregated":
+            return {
+                "numRequests": row.get("num_requests"),
+                "numFailures": row.get("num_failures"),
+                "failRatio": stats.get("fail_ratio"),
+                "avgResponseTime": row.get("avg_response_time"),
+                "p90ResponseTime": row.get("ninetieth_response_time"),
+                "p99ResponseTime": row.get("ninety_ninth_response_time"),
+                "userCount": stats.get("user_count"),
+            }
+    return None
+
+
+def get_completion_time(job_status) -> datetime:
+    # Failed Jobs have no completionTime, their Failed condition tells when they failed
+    if job_status.completion_time:
+        return job_status.completion_time
+    for condition in job_status.conditions or []:
+        if condition.type == "Failed" and condition.status == "True":
+            return condition.last_transition_time
+    return None
+
+
+def get_job_status(job) -> dict:
+    # Status of the Locust object during the run of job
+    status = {
+        "jobName": job.metadata.name,
+        "startTime": get_time(job.metadata.creation_timestamp),
+    }
+    job_status = job.status
+    if job_status and (job_status.succeeded or job_status.failed):
+        status["phase"] = "Succeeded" if job_status.succeeded else "Failed"
+        completion_time = get_completion_time(job_status)
+        if completion_time:
+            status["completionTime"] = get_time(completion_time)
+    elif job_status and job_status.active:
+        status["phase"] = "Running"
+    else:
+        # A new run of a scheduled Locust object, the previous run is cleared
+        status.update(
+            phase="Pending",
+            completionTime=None,
+            result=None,
+            workerProcessesReady=None,
+        )
+    return status
+
+
+def get_workers_status(replica_set) -> dict:
+    ready = replica_set.status.ready_replicas if replica_set.status else None
+    return {"workers": replica_set.spec.replicas, "workersReady": ready or 0}
+
+
+# Coalesce the status changes of the Locust objects, each one gets at most one patch of
+# its status subresource per interval, whatever the number of Job and pod transitions
+class StatusWriter:
+    def __init__(
+        self,
+        interval: float = STATUS_INTERVAL_SECONDS,
+        qps: float = STATUS_QPS,
+        burst: int = STATUS_BURST,
+    ):
+        self.interval = interval
+        self.limiter = TokenBucket(qps, burst)
+        self.sharder = None
+        self._lock = threading.Lock()
+        # namespace/name -> fields changed since the last patch
+        self._pending = {}
+        # namespace/name -> status written
+        self._written = {}
+
+    def update(self, namespace: str, name: str, **status):
+        key = get_key(namespace, name)
+        with self._lock:
+            # The status read by the watch, and the writes it may not show yet
+            locust_object = LOCUST_STORE.get(namespace, name) or {}
+            written = {
+                **(locust_object.get("status") or {}),
+                **self._written.get(key, {}),
+            }
+            pending = self._pending.get(key, {})
+            for field, value in status.items():
+                if written.get(field) == value:
+                    pending.pop(field, None)
+                else:
+                    pending[field] = value
+            if pending:
+                self._pending[key] = pending
+            else:
+                self._pending.pop(key, None)
+
+    def forget(self, namespace: str, name: str):
+        key = get_key(namespace, name)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._written.pop(key, None)
+
+    def patch(self, key: str, status: dict):
+        namespace, name = key.split("/", 1)
+        self.limiter.acquire()
+        try:
+            get_custom_api().patch_namespaced_custom_object_status(
+                CRD_GROUP, CRD_VERSION, namespace, CRD_PLURAL, name, {"status": status}
+            )
+        except client.exceptions.ApiException as e:
+            if e.status == HTTP_STATUS_NOT_FOUND:
+                self.forget(namespace, name)
+                return
+            log.info(f"Update status of Locust {name} exception: {e.reason}")
+            with self._lock:
+                # Written again with the next changes
+                self._pending[key] = {**status, **self._pending.get(key, {})}
+            return
+        with self._lock:
+            self._written.setdefault(key, {}).update(status)
+
+    def write(self, namespace: str, name: str):
+        # Patch the pending changes at once, e.g. the end of a run before its Locust
+        # object is deleted
+        key = get_key(namespace, name)
+        with self._lock:
+            status = self._pending.pop(key, None)
+        if status:
+            self.patch(key, status)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for key, status in pending.items():
+            if self.sharder and not self.sharder.owns(key):
+                continue
+            self.patch(key, status)
+
+    def run(self, sharder: Sharder = None):
+        self.sharder = sharder
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Update status exception")
+
+
+STATUS_WRITER = StatusWriter()
+
+
+def update_result(namespace: str, name: str, stats: dict):
+    result = get_result(stats) if stats else None
+    if result:
+        STATUS_WRITER.update(namespace, name, result=result)
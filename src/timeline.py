@@ -0,0 +1,32 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from src.constants import HISTOGRAM_CREATE_STEP_SECONDS
+
+log = logging.getLogger(__name__)
+
+
+# Start and end of each step creating the objects of a run, relative to its start
+class Timeline:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.steps = []
+
+    @contextmanager
+    def step(self, step: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            HISTOGRAM_CREATE_STEP_SECONDS.labels(step=step).observe(end - start)
+            self.steps.append((step, start - self.started, end - self.started))
+
+    def log(self):
+        steps = ", ".join(
+            f"{step} {start:.3f}s-{end:.3f}s"
+            for step, start, end in sorted(self.steps, key=lambda s: s[1])
+        )
+        log.info(f"Timeline of Locust {self.name}: {steps}")
@@ -0,0 +1,78 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parses the raw lists and watch events, orjson when installed
+loads = orjson.loads if orjson else json.loads
+
+# Read as datetimes, like the client models do
+TIMESTAMPS = {
+    "creationTimestamp",
+    "deletionTimestamp",
+    "startTime",
+    "completionTime",
+    "lastScheduleTime",
+    "lastSuccessfulTime",
+    "lastTransitionTime",
+    "lastProbeTime",
+    "lastUpdateTime",
+}
+# Maps of strings, read as plain dicts
+MAPS = {"labels", "annotations"}
+
+
+@lru_cache(maxsize=None)
+def get_field(attribute: str) -> str:
+    # owner_references -> ownerReferences
+    first, *others = attribute.split("_")
+    return first + "".join(word.capitalize() for word in others)
+
+
+def get_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def get_value(value):
+    if isinstance(value, dict):
+        return View(value)
+    if isinstance(value, list):
+        return [get_value(item) for item in value]
+    return value
+
+
+# Stand-in of the client models over a decoded JSON object: only the fields
+# the handlers read are converted, when they read them. Unknown fields are None, as the
+# unset fields of the models
+class View:
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        object.__setattr__(self, "_data", data)
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+        field = get_field(attribute)
+        value = self._data.get(field)
+        if value is None or field in MAPS:
+            return value
+        if field in TIMESTAMPS:
+            return get_timestamp(value)
+        return get_value(value)
+
+    def __setattr__(self, attribute: str, value):
+        # Only used to drop fields before the object is cached
+        if isinstance(value, View):
+            value = value._data
+        self._data[get_field(attribute)] = value
+
+    def __repr__(self) -> str:
+        return f"View({self._data!r})"
+
+    def to_dict(self) -> dict:
+        return self._data
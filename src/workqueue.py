@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from src.cache import get_name, get_kind, wait_for_sync
+from src.constants import (
+    RECONCILE_MAX_REQUEUES,
+    HISTOGRAM_RECONCILE_SECONDS,
+    GAUGE_QUEUE_DEPTH,
+)
+from src.ratelimit import TokenBucket, get_backoff
+
+log = logging.getLogger(__name__)
+
+REQUEUE_BASE_SECONDS = 0.5
+REQUEUE_MAX_SECONDS = 60
+
+
+# Queue of events keyed by Locust name: repeated events for a key are collapsed and a key
+# is never handed to two workers at the same time
+class WorkQueue:
+    def __init__(self, qps: float, burst: int):
+        self.limiter = TokenBucket(qps, burst)
+        self._cond = threading.Condition()
+        self._ready = deque()
+        self._pending = {}
+        self._processing = set()
+        self._failures = {}
+        GAUGE_QUEUE_DEPTH.set_function(self.__len__)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def add(self, key: str, handler: Callable, operation: str, obj):
+        received_at = time.monotonic()
+        with self._cond:
+            items = self._pending.setdefault(key, [])
+            last = items[-1] if items else None
+            if (
+                last
+                and operation == "MODIFIED"
+                and last[0] is handler
+                and last[1] == "MODIFIED"
+                and get_name(last[2]) == get_name(obj)
+            ):
+                # Only the latest state of a modified object matters, the latency
+                # counts from the first event
+                items[-1] = (handler, operation, obj, last[3])
+                return
+            items.append((handler, operation, obj, received_at))
+            if key not in self._processing and len(items) == 1:
+                self._ready.append(key)
+                self._wakeup()
+
+    def requeue(self, key: str, items: list):
+        with self._cond:
+            failures = self._failures.pop(key, 0)
+            dropped = RECONCILE_MAX_REQUEUES and failures >= RECONCILE_MAX_REQUEUES
+            if not dropped:
+                self._failures[key] = failures + 1
+        if dropped:
+            # The next event or resync of the key reconciles it again
+            log.info(f"Dropped {len(items)} events of {key} after {failures} requeues")
+            return
+        delay = get_backoff(failures, REQUEUE_BASE_SECONDS, REQUEUE_MAX_SECONDS)
+        log.info(f"Requeue {key} in {delay:.1f}s")
+        t = threading.Timer(delay, self._add_items, args=(key, items))
+        t.daemon = True
+        t.start()
+
+    def forget(self, key: str):
+        with self._cond:
+            self._failures.pop(key, None)
+
+    def pop(self) -> [str, list]:
+        key = self._ready.popleft()
+        self._processing.add(key)
+        return key, self._pending.pop(key)
+
+    def get(self) -> [str, list]:
+        self.limiter.acquire()
+        with self._cond:
+            while not self._ready:
+                self._cond.wait()
+            return self.pop()
+
+    def done(self, key: str):
+        with self._cond:
+            self._processing.discard(key)
+            # Events received while the key was processed
+            if key in self._pending:
+                self._ready.append(key)
+                self._wakeup()
+
+    def _wakeup(self):
+        self._cond.notify()
+
+    def _add_items(self, key: str, items: list):
+        with self._cond:
+            # Failed events go before the ones received since
+            queued = key in self._pending
+            self._pending[key] = items + self._pending.get(key, [])
+            if not queued and key not in self._processing:
+                self._ready.append(key)
+                self._wakeup()
+
+
+def observe_reconcile(operation: str, obj, received_at: float):
+    HISTOGRAM_RECONCILE_SECONDS.labels(kind=get_kind(obj), operation=operation).observe(
+        time.monotonic() - received_at
+    )
+
+
+def process(queue: WorkQueue):
+    # Handlers compare with the stores, they must be filled first
+    wait_for_sync()
+    while True:
+        key, items = queue.get()
+        try:
+            for i, (handler, operation, obj, received_at) in enumerate(items):
+                try:
+                    handler(operation, obj)
+                    observe_reconcile(operation, obj, received_at)
+                except Exception:
+                    log.exception(f"Reconcile {operation} on {key} exception")
+                    queue.requeue(key, items[i:])
+                    break
+            else:
+                queue.forget(key)
+        finally:
+            queue.done(key)
+
+
+def start_workers(queue: WorkQueue, workers: int):
+    for i in range(workers):
+        t = threading.Thread(target=process, args=(queue,), name=f"reconcile-{i}")
+        t.daemon = True
+        t.start()
@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+from src.histogram import RELATIVE_ACCURACY, LogHistogram
+from src.results import get_anchors
+
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+ANCHORS = [0, 0.5, 0.9, 0.95, 0.99, 1]
+
+
+def get_samples(count: int, seed: int = 0) -> list:
+    # Response times in milliseconds, log-normal like most services
+    rng = random.Random(seed)
+    return sorted(rng.lognormvariate(4, 0.8) for _ in range(count))
+
+
+def get_quantile(samples: list, q: float) -> float:
+    # Nearest rank, as the histogram counts
+    return samples[max(int(q * len(samples) + 0.5) - 1, 0)]
+
+
+def get_histogram(samples: list) -> LogHistogram:
+    histogram = LogHistogram()
+    for sample in samples:
+        histogram.add(sample)
+    return histogram
+
+
+def test_quantiles_of_samples_are_within_the_accuracy():
+    samples = get_samples(10000)
+    histogram = get_histogram(samples)
+    assert histogram.count == len(samples)
+    for q in QUANTILES:
+        assert histogram.quantile(q) == pytest.approx(
+            get_quantile(samples, q), rel=RELATIVE_ACCURACY
+        )
+
+
+def test_merge_equals_the_histogram_of_all_samples():
+    first, second = get_samples(5000, 1), get_samples(5000, 2)
+    merged = get_histogram(first).merge(get_histogram(second))
+    assert merged.bins == get_histogram(first + second).bins
+
+
+def test_to_dict_round_trip():
+    histogram = get_histogram(get_samples(1000) + [0])
+    assert LogHistogram.from_dict(histogram.to_dict()).to_dict() == histogram.to_dict()
+    assert histogram.zero == 1
+
+
+def test_rebuild_matches_the_anchors():
+    samples = get_samples(10000)
+    anchors = [(q, get_quantile(samples, q)) for q in ANCHORS]
+    histogram = LogHistogram()
+    histogram.add_anchors(len(samples), anchors)
+    assert histogram.count == pytest.approx(len(samples))
+    for q, value in anchors[1:-1]:
+        # One bucket of rounding on each side of the anchor
+        assert histogram.quantile(q) == pytest.approx(value, rel=2 * RELATIVE_ACCURACY)
+
+
+def test_rebuild_between_anchors_stays_between_them():
+    samples = get_samples(10000)
+    anchors = [(q, get_quantile(samples, q)) for q in ANCHORS]
+    histogram = LogHistogram()
+    histogram.add_anchors(len(samples), anchors)
+    for (q_low, low), (q_high, high) in zip(anchors, anchors[1:]):
+        q = (q_low + q_high) / 2
+        assert low * (1 - RELATIVE_ACCURACY) <= histogram.quantile(q)
+        assert histogram.quantile(q) <= high * (1 + RELATIVE_ACCURACY)
+
+
+def test_merged_rebuilds_stay_between_the_runs():
+    # Two runs of different speeds, each rebuilt from its own percentiles: at the
+    # anchors, the percentile of both lies between those of each run, like the exact one
+    runs = [get_samples(5000, 1), [sample * 3 for sample in get_samples(5000, 2)]]
+    merged = LogHistogram()
+    for samples in runs:
+        merged.add_anchors(
+            len(samples), [(q, get_quantile(samples, q)) for q in ANCHORS]
+        )
+    both = sorted(runs[0] + runs[1])
+    for q in QUANTILES:
+        low, high = sorted(get_quantile(samples, q) for samples in runs)
+        assert low <= get_quantile(both, q) <= high
+        assert low * (1 - 2 * RELATIVE_ACCURACY) <= merged.quantile(q)
+        assert merged.quantile(q) <= high * (1 + 2 * RELATIVE_ACCURACY)
+
+
+def test_get_anchors():
+    row = {
+        "min_response_time": 10,
+        "median_response_time": 50,
+        "ninetieth_response_time": 90,
+        "ninety_ninth_response_time": 200,
+        "max_response_time": 500,
+        "response_time_percentile_0.95": 120,
+    }
+    assert sorted(get_anchors(row)) == [
+        (0, 10),
+        (0.5, 50),
+        (0.9, 90),
+        (0.95, 120),
+        (0.99, 200),
+        (1, 500),
+    ]
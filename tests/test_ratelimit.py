@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+import src.ratelimit
+from src.ratelimit import TokenBucket, get_backoff
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_burst_is_not_delayed():
+    bucket = TokenBucket(10, 5)
+    assert [bucket.reserve() for _ in range(5)] == [0] * 5
+
+
+def test_tokens_past_the_burst_are_spaced():
+    bucket = TokenBucket(10, 2)
+    bucket.reserve()
+    bucket.reserve()
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_no_limit():
+    bucket = TokenBucket(0, 1)
+    assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+def test_tokens_refill(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(src.ratelimit, "time", clock)
+    bucket = TokenBucket(10, 2)
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 0.15
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.05)
+
+
+def test_backoff_is_capped_and_jittered():
+    random.seed(0)
+    delays = [
+        get_backoff(failures, 0.5, 30) for failures in range(20) for _ in range(50)
+    ]
+    assert all(0 <= delay <= 30 for delay in delays)
+    # Full jitter: uniform between 0 and the exponential delay
+    first = [get_backoff(0, 0.5, 30) for _ in range(1000)]
+    assert max(first) <= 0.5
+    assert min(first) < 0.05
+    assert len(set(first)) > 1
+
+
+def test_backoff_grows_exponentially():
+    random.seed(0)
+    for failures in range(5):
+        delays = [get_backoff(failures, 0.5, 30) for _ in range(1000)]
+        assert max(delays) <= 0.5 * 2**failures
+        assert max(delays) > 0.9 * 0.5 * 2**failures
@@ -0,0 +1,102 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from kubernetes import client
+
+import src.sharding
+from src.sharding import HashRing, Sharder
+
+KEYS = [f"locust/test-{i}" for i in range(2000)]
+
+
+def get_lease(identity: str, renewed: datetime) -> client.V1Lease:
+    return client.V1Lease(
+        metadata=client.V1ObjectMeta(name=f"lease-{identity}", resource_version="1"),
+        spec=client.V1LeaseSpec(
+            holder_identity=identity, lease_duration_seconds=15, renew_time=renewed
+        ),
+    )
+
+
+class CoordinationApi:
+    def __init__(self, sharder: Sharder, leases: list):
+        self.sharder = sharder
+        self.leases = leases
+        self.owned_while_listed = None
+        self.deleted = []
+
+    def patch_namespaced_lease(self, name, namespace, body):
+        pass
+
+    def list_namespaced_lease(self, namespace, label_selector):
+        self.owned_while_listed = [key for key in KEYS if self.sharder.owns(key)]
+        return client.V1LeaseList(items=self.leases)
+
+    def delete_namespaced_lease(self, name, namespace, body=None):
+        self.deleted.append(name)
+
+
+def test_ring_is_stable():
+    ring = HashRing(["a", "b", "c"])
+    assert all(ring.get(key) == HashRing(["c", "a", "b"]).get(key) for key in KEYS)
+
+
+def test_empty_ring():
+    assert HashRing([]).get("locust/test") is None
+
+
+def test_ring_spreads_the_keys():
+    counts = Counter(HashRing(["a", "b", "c"]).get(key) for key in KEYS)
+    assert set(counts) == {"a", "b", "c"}
+    assert all(count > len(KEYS) / 3 * 0.6 for count in counts.values())
+
+
+def test_new_member_only_takes_keys():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in KEYS if before.get(key) != after.get(key)]
+    assert all(after.get(key) == "d" for key in moved)
+    assert len(moved) < len(KEYS) / 2
+
+
+def test_no_keys_owned_before_the_lease_is_renewed():
+    sharder = Sharder("a", "lease-a", "locust")
+    assert not any(sharder.owns(key) for key in KEYS)
+
+
+def test_rebalance_replays_the_new_keys():
+    sharder = Sharder("a", "lease-a", "locust")
+    replayed = []
+    sharder.add_handler(lambda is_new_key: replayed.extend(filter(is_new_key, KEYS)))
+    sharder.set_members(["a", "b"], force=True)
+    sharder.renewed_at = float("inf")
+    assert sharder.set_members(["a", "b"]) is None
+    is_new_key = sharder.set_members(["a"])
+    sharder.replay(is_new_key)
+    ring = HashRing(["a", "b"])
+    assert sorted(replayed) == sorted(key for key in KEYS if ring.get(key) == "b")
+
+
+def test_heartbeat_sets_the_members_before_owning_keys(monkeypatch):
+    sharder = Sharder("a", "lease-a", "locust")
+    now = datetime.now(timezone.utc)
+    leases = [
+        get_lease("a", now),
+        get_lease("b", now),
+        get_lease("c", now - timedelta(seconds=30)),
+        get_lease("d", now - timedelta(seconds=120)),
+    ]
+    api = CoordinationApi(sharder, leases)
+    monkeypatch.setattr(src.sharding, "get_coordination_api", lambda: api)
+    replayed = []
+    sharder.add_handler(lambda is_new_key: replayed.extend(filter(is_new_key, KEYS)))
+    sharder.heartbeat()
+    # A lone member would have owned every key while the leases were listed
+    assert api.owned_while_listed == []
+    assert sharder.members == ["a", "b"]
+    ring = HashRing(["a", "b"])
+    owned = [key for key in KEYS if ring.get(key) == "a"]
+    assert [key for key in KEYS if sharder.owns(key)] == owned
+    assert sorted(replayed) == sorted(owned)
+    # Only the leases expired for several durations are deleted
+    assert api.deleted == ["lease-d"]
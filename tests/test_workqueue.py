@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+import src.cache
+import src.workqueue
+from src.cache import Store, wait_for_sync
+from src.workqueue import WorkQueue
+
+
+def get_locust(name: str, version: str = "1") -> dict:
+    return {
+        "metadata": {"name": name, "namespace": "locust", "resourceVersion": version}
+    }
+
+
+def handler(operation: str, obj):
+    pass
+
+
+def wait_until(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queue(monkeypatch) -> WorkQueue:
+    # Requeued at once
+    monkeypatch.setattr(src.workqueue, "get_backoff", lambda *_: 0)
+    return WorkQueue(0, 1)
+
+
+def test_modified_events_are_collapsed(queue):
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a", "1"))
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a", "2"))
+    key, items = queue.get()
+    assert key == "locust/a"
+    assert len(items) == 1
+    _, operation, obj, _ = items[0]
+    assert operation == "MODIFIED"
+    assert obj["metadata"]["resourceVersion"] == "2"
+
+
+def test_modified_latency_counts_from_the_first_event(queue):
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a", "1"))
+    _, _, _, received_at = queue._pending["locust/a"][0]
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a", "2"))
+    assert queue._pending["locust/a"][0][3] == received_at
+
+
+def test_added_and_deleted_are_kept(queue):
+    queue.add("locust/a", handler, "ADDED", get_locust("a"))
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a"))
+    queue.add("locust/a", handler, "DELETED", get_locust("a"))
+    _, items = queue.get()
+    assert [item[1] for item in items] == ["ADDED", "MODIFIED", "DELETED"]
+
+
+def test_key_is_not_handed_out_twice(queue):
+    queue.add("locust/a", handler, "ADDED", get_locust("a"))
+    queue.get()
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a"))
+    queue.add("locust/b", handler, "ADDED", get_locust("b"))
+    key, _ = queue.get()
+    assert key == "locust/b"
+    assert not queue._ready
+    queue.done("locust/a")
+    key, items = queue.get()
+    assert key == "locust/a"
+    assert [item[1] for item in items] == ["MODIFIED"]
+
+
+def test_requeued_events_go_first(queue):
+    queue.add("locust/a", handler, "ADDED", get_locust("a"))
+    key, items = queue.get()
+    queue.add("locust/a", handler, "MODIFIED", get_locust("a"))
+    queue.requeue(key, items)
+    queue.done(key)
+    wait_until(lambda: len(queue._pending.get(key, [])) == 2)
+    _, items = queue.get()
+    assert [item[1] for item in items] == ["ADDED", "MODIFIED"]
+
+
+def test_requeue_is_dropped_after_the_maximum(queue, monkeypatch):
+    monkeypatch.setattr(src.workqueue, "RECONCILE_MAX_REQUEUES", 2)
+    queue.add("locust/a", handler, "ADDED", get_locust("a"))
+    for _ in range(2):
+        key, items = queue.get()
+        queue.requeue(key, items)
+        queue.done(key)
+        wait_until(lambda: key in queue._pending)
+    key, items = queue.get()
+    queue.requeue(key, items)
+    queue.done(key)
+    time.sleep(0.05)
+    assert len(queue) == 0
+    # Counted again from the next failure
+    assert key not in queue._failures
+
+
+def test_forget_resets_the_failures(queue):
+    queue.add("locust/a", handler, "ADDED", get_locust("a"))
+    key, items = queue.get()
+    queue.requeue(key, items)
+    queue.forget(key)
+    assert key not in queue._failures
+
+
+def test_wait_for_sync(monkeypatch):
+    stores = [Store("Locust"), Store("Job")]
+    monkeypatch.setattr(src.cache, "STORES", stores)
+    for store in stores:
+        store.add_scope("locust")
+    assert not wait_for_sync(0)
+    stores[0].replace([get_locust("a")], "locust")
+    assert not wait_for_sync(0)
+    stores[1].replace([], "locust")
+    assert wait_for_sync(0)